@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import aiohttp
+from typing import Dict, NamedTuple, Optional
+from urllib.parse import urlparse
+from config import (
+    AUTOTUNE_ENABLED, AUTOTUNE_FILE, AUTOTUNE_MAX_CONNECTIONS,
+    AUTOTUNE_MIN_CHUNK, AUTOTUNE_MAX_CHUNK, AUTOTUNE_MIN_SAMPLE, AUTOTUNE_CEILING_TTL
+)
+from bandwidth import download_governor
+from retry import HttpStatusError
+
+logger = logging.getLogger(__name__)
+
+# Transfers measured per setting before it is judged
+SAMPLES = 2
+
+# Throughput gain a bigger setting must show to be kept
+GAIN = 0.1
+
+# Judgements spent at the best setting before probing upward again
+HOLD = 5
+
+# Errors within this many seconds of a back-off count as the same incident
+# (every fragment in flight fails at once)
+ERROR_GAP = 10
+
+# yt-dlp only reports its last error line
+PUSHBACK_TEXT = ('HTTP Error 429', 'Too Many Requests', 'HTTP Error 503', 'Connection reset', 'timed out')
+
+
+class Tuning(NamedTuple):
+    connections: int  # yt-dlp fragments, direct byte ranges or DASH segments in flight
+    chunk_size: int  # yt-dlp --http-chunk-size and native read size
+
+
+def is_pushback(error: BaseException) -> bool:
+    """Errors that say we ask too much of a host: 429/503 and dropped connections"""
+    if isinstance(error, HttpStatusError):
+        return error.status in (429, 503)
+    return isinstance(error, (
+        aiohttp.ClientPayloadError,
+        aiohttp.ServerDisconnectedError,
+        aiohttp.ClientOSError,
+        ConnectionResetError,
+        asyncio.TimeoutError,
+    ))
+
+
+class HostTuner:
+    """Hill-climbs one host's settings on measured throughput.
+    
+    Each setting is measured over SAMPLES transfers. A step up (half again
+    as many connections, or twice the chunk size) is kept while it is
+    GAIN faster than the setting before it; otherwise the tuner returns to
+    the better setting, holds there for a while and next tries the other
+    knob. Pushback halves the connections and caps them below the level
+    that caused it for AUTOTUNE_CEILING_TTL.
+    """
+    
+    def __init__(self, host: str, connections: int, chunk_size: int):
+        self.host = host
+        self.connections = connections
+        self.chunk_size = chunk_size
+        self.ceiling = AUTOTUNE_MAX_CONNECTIONS
+        self.ceiling_until = 0.0
+        self.knob = 'connections'
+        self.rate = 0.0
+        self.samples = 0
+        self.base: Optional[dict] = None  # Setting (and its rate) a probe is compared with
+        self.hold = 0
+        self.backed_off_at = 0.0
+    
+    def settings(self) -> Tuning:
+        if self.ceiling_until and time.time() > self.ceiling_until:
+            self.ceiling = AUTOTUNE_MAX_CONNECTIONS
+            self.ceiling_until = 0.0
+        return Tuning(self.connections, self.chunk_size)
+    
+    def record_transfer(self, nbytes: int, seconds: float, used: Tuning) -> bool:
+        """Add a throughput sample; returns whether the settings changed"""
+        if used != self.settings() or seconds <= 0:
+            # Started before the last change, or could not use the full setting
+            return False
+        
+        rate = nbytes / seconds
+        self.rate = rate if not self.samples else self.rate + (rate - self.rate) / (self.samples + 1)
+        self.samples += 1
+        if self.samples < SAMPLES:
+            return False
+        
+        rate, self.rate, self.samples = self.rate, 0.0, 0
+        if self.base is not None:
+            base, self.base = self.base, None
+            if rate > base['rate'] * (1 + GAIN):
+                return self._probe(rate, "faster")
+            self._set(base['connections'], base['chunk_size'], f"no gain over {_mbps(base['rate'])}")
+            self.hold = HOLD
+            self.knob = 'chunk_size' if self.knob == 'connections' else 'connections'
+            return True
+        
+        if self.hold:
+            self.hold -= 1
+            return False
+        return self._probe(rate, "probing")
+    
+    def _probe(self, rate: float, reason: str) -> bool:
+        """Step the current knob up (or the other one if it is maxed out)"""
+        for knob in (self.knob, 'chunk_size' if self.knob == 'connections' else 'connections'):
+            if knob == 'connections':
+                step = min(self.ceiling, self.connections + max(1, self.connections // 2))
+                if step == self.connections:
+                    continue
+                self.base = {'connections': self.connections, 'chunk_size': self.chunk_size, 'rate': rate}
+                self._set(step, self.chunk_size, f"{reason} at {_mbps(rate)}")
+            else:
+                step = min(AUTOTUNE_MAX_CHUNK, self.chunk_size * 2)
+                if step == self.chunk_size:
+                    continue
+                self.base = {'connections': self.connections, 'chunk_size': self.chunk_size, 'rate': rate}
+                self._set(self.connections, step, f"{reason} at {_mbps(rate)}")
+            self.knob = knob
+            return True
+        
+        self.hold = HOLD
+        return False
+    
+    def record_error(self, error_name: str, rate_limited: bool) -> bool:
+        """Back off after pushback; returns whether the settings changed"""
+        now = time.monotonic()
+        if now - self.backed_off_at < ERROR_GAP:
+            return False
+        self.backed_off_at = now
+        
+        # Never go back up to the level that was refused, for a while
+        self.ceiling = max(1, self.connections - 1)
+        self.ceiling_until = time.time() + AUTOTUNE_CEILING_TTL
+        chunk_size = self.chunk_size if rate_limited else max(AUTOTUNE_MIN_CHUNK, self.chunk_size // 2)
+        
+        self.base = None
+        self.hold = HOLD
+        self.rate, self.samples = 0.0, 0
+        self._set(max(1, self.connections // 2), chunk_size, f"backing off after {error_name}", logging.WARNING)
+        return True
+    
+    def _set(self, connections: int, chunk_size: int, reason: str, level: int = logging.INFO):
+        self.connections = connections
+        self.chunk_size = chunk_size
+        logger.log(level, f"🎛️ {self.host}: {connections} connections, {chunk_size // 1024}KB chunks ({reason})")
+    
+    def to_dict(self) -> dict:
+        return {
+            'connections': self.connections,
+            'chunk_size': self.chunk_size,
+            'ceiling': self.ceiling,
+            'ceiling_until': self.ceiling_until,
+        }
+    
+    @classmethod
+    def from_dict(cls, host: str, data: dict) -> 'HostTuner':
+        tuner = cls(host, int(data['connections']), int(data['chunk_size']))
+        tuner.ceiling = int(data.get('ceiling', AUTOTUNE_MAX_CONNECTIONS))
+        tuner.ceiling_until = float(data.get('ceiling_until', 0))
+        return tuner
+
+
+class Autotuner:
+    """Per-host HostTuners, persisted to AUTOTUNE_FILE whenever one changes.
+    
+    A host starts from the defaults of whichever path asks first. Samples
+    are only taken while no bandwidth budget is set, since a budget caps
+    throughput regardless of the settings.
+    """
+    
+    def __init__(self, path: str, enabled: bool):
+        self.path = path
+        self.enabled = enabled
+        self.hosts: Dict[str, HostTuner] = {}
+        if enabled:
+            self._load()
+    
+    def settings(self, url: str, connections: int, chunk_size: int) -> Tuning:
+        """Current settings for a URL's host, given the caller's static defaults"""
+        if not self.enabled:
+            return Tuning(connections, chunk_size)
+        host = urlparse(url).netloc
+        tuner = self.hosts.get(host)
+        if tuner is None:
+            tuner = self.hosts[host] = HostTuner(host, connections, chunk_size)
+        return tuner.settings()
+    
+    def record_transfer(self, url: str, nbytes: int, seconds: float, used: Tuning):
+        """Report a completed download made with the given settings"""
+        if not self.enabled or nbytes < AUTOTUNE_MIN_SAMPLE or download_governor.enabled:
+            return
+        tuner = self.hosts.get(urlparse(url).netloc)
+        if tuner is not None and tuner.record_transfer(nbytes, seconds, used):
+            self._save()
+    
+    def record_error(self, url: str, error: BaseException):
+        """Report a failed request; pushback makes the host back off"""
+        if not self.enabled or not is_pushback(error):
+            return
+        rate_limited = isinstance(error, HttpStatusError) and error.status == 429
+        self._back_off(url, type(error).__name__ if not isinstance(error, HttpStatusError)
+                       else f"HTTP {error.status}", rate_limited)
+    
+    def record_error_text(self, url: str, text: str):
+        """record_error for yt-dlp, which only leaves its last error line"""
+        if not self.enabled:
+            return
+        for marker in PUSHBACK_TEXT:
+            if marker in text:
+                self._back_off(url, marker, '429' in marker or 'Too Many' in marker)
+                return
+    
+    def _back_off(self, url: str, error_name: str, rate_limited: bool):
+        tuner = self.hosts.get(urlparse(url).netloc)
+        if tuner is not None and tuner.record_error(error_name, rate_limited):
+            self._save()
+    
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.hosts = {host: HostTuner.from_dict(host, entry) for host, entry in data.items()}
+            logger.info(f"🎛️ Loaded tuned settings for {len(self.hosts)} host(s)")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable {self.path}: {e}")
+    
+    def _save(self):
+        """Write all hosts atomically (a few hundred bytes, on settings changes only)"""
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({host: tuner.to_dict() for host, tuner in self.hosts.items()}, f, indent=1)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save {self.path}: {e}")
+
+
+def _mbps(rate: float) -> str:
+    return f"{rate / 1024 / 1024:.1f}MB/s"
+
+
+autotuner = Autotuner(AUTOTUNE_FILE, AUTOTUNE_ENABLED)
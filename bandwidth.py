@@ -0,0 +1,115 @@
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Dict
+from config import DOWNLOAD_BUDGET_MB, UPLOAD_BUDGET_MB, BANDWIDTH_BURST_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def user_of(job_id: str) -> str:
+    """User part of a job ID (see progress.make_job_id)"""
+    return job_id.split(':', 1)[0]
+
+
+class TokenBucket:
+    """Byte-rate limiter; callers may go into debt and then wait it off"""
+    
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    @property
+    def burst(self) -> float:
+        return self.rate * BANDWIDTH_BURST_SECONDS
+    
+    def debit(self, nbytes: int):
+        """Take bytes out of the bucket without waiting"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        self.tokens -= nbytes
+    
+    async def consume(self, nbytes: int):
+        """Take bytes out of the bucket, sleeping until they are covered"""
+        async with self._lock:
+            self.debit(nbytes)
+            if self.tokens < 0:
+                await asyncio.sleep(-self.tokens / self.rate)
+
+
+class BandwidthGovernor:
+    """Global byte budget for one direction with equal per-user shares.
+    
+    Every byte passes a per-user bucket refilled at rate / active users and
+    then the global bucket, so one user's many parallel transfers cannot
+    crowd out another user, while a user alone gets the whole link.
+    """
+    
+    def __init__(self, name: str, rate: float):
+        self.name = name
+        self.rate = rate
+        self._global = TokenBucket(rate) if rate else None
+        self._users: Dict[str, TokenBucket] = {}
+        self._active: Dict[str, int] = {}
+    
+    @property
+    def enabled(self) -> bool:
+        return self._global is not None
+    
+    def share(self, job_id: str) -> float:
+        """Current fair share in bytes/s for the job's user (0 = unlimited)"""
+        if not self.enabled:
+            return 0
+        active = len(self._active) or 1
+        if user_of(job_id) not in self._active:
+            active += 1
+        return self.rate / active
+    
+    @contextmanager
+    def lease(self, job_id: str):
+        """Count the job's user as active for the duration of a transfer"""
+        user = user_of(job_id)
+        self._active[user] = self._active.get(user, 0) + 1
+        self._rebalance()
+        try:
+            yield
+        finally:
+            self._active[user] -= 1
+            if not self._active[user]:
+                del self._active[user]
+                self._users.pop(user, None)
+            self._rebalance()
+    
+    def _rebalance(self):
+        if not self.enabled:
+            return
+        share = self.rate / max(1, len(self._active))
+        for bucket in self._users.values():
+            bucket.rate = share
+    
+    async def throttle(self, job_id: str, nbytes: int):
+        """Wait until nbytes fit in the user's share and the global budget"""
+        if not self.enabled:
+            return
+        
+        user = user_of(job_id)
+        bucket = self._users.get(user)
+        if bucket is None:
+            bucket = self._users[user] = TokenBucket(self.rate / max(1, len(self._active)))
+        
+        await bucket.consume(nbytes)
+        await self._global.consume(nbytes)
+    
+    def charge(self, nbytes: int):
+        """Account for traffic moved outside our readers (yt-dlp) so native
+        transfers back off by the same amount"""
+        if self.enabled and nbytes > 0:
+            self._global.debit(nbytes)
+
+
+download_governor = BandwidthGovernor('download', DOWNLOAD_BUDGET_MB * 1024 * 1024)
+upload_governor = BandwidthGovernor('upload', UPLOAD_BUDGET_MB * 1024 * 1024)
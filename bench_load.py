@@ -0,0 +1,595 @@
+"""Multi-user load and soak harness.
+
+Drives the real ``handlers.setup_handlers`` with synthetic users and no
+Telegram connection:
+
+* a fake client records every send, edit and answer, and applies per-chat
+  and global rate limits like Telegram (waits under pyrogram's
+  ``sleep_threshold`` are slept through, longer ones raise ``FloodWait``);
+* updates run through a fixed number of handler slots, like pyrogram's
+  ``workers``, and each goes to the first handler whose filters match;
+* a local aiohttp origin serves the listed images (valid PNGs) and
+  documents, optionally slow or flaky;
+* every user loops: send a list, pick a range or everything, choose a
+  quality, and sometimes stop or re-send a list mid-batch.
+
+Lists hold images and documents only. Videos would measure yt-dlp and
+ffmpeg rather than the handlers.
+
+Reports per-user latency, handler-slot occupancy, growth of the global
+state and files left behind in DOWNLOAD_DIR. Exits non-zero on leaks or
+handler errors:
+
+    python bench_load.py --users 20 --duration 120
+    python bench_load.py --users 50 --duration 1800 --error-rate 0.05   # soak
+"""
+import os
+import sys
+import time
+import zlib
+import random
+import struct
+import asyncio
+import logging
+import argparse
+import tempfile
+import statistics
+from collections import defaultdict
+from contextvars import ContextVar
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+from aiohttp import web
+from pyrogram import enums
+from pyrogram.errors import FloodWait
+from pyrogram.types import Message, CallbackQuery
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# main.py builds its Client with sleep_threshold=60 and workers=8
+SLEEP_THRESHOLD = 60
+BOT_ID = 1
+QUALITIES = ('360p', '480p', '720p', '1080p')
+
+# Probe of the update whose handler is running (inherited by tasks it starts)
+_probe: ContextVar[Optional[SimpleNamespace]] = ContextVar('_probe', default=None)
+
+
+def make_png(size: int, seed: int) -> bytes:
+    """A valid 64x64 PNG padded to about size bytes with a private ancillary chunk"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    
+    rng = random.Random(seed)
+    rows = b''.join(b'\x00' + rng.randbytes(64 * 3) for _ in range(64))
+    png = b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 64, 64, 8, 2, 0, 0, 0))
+    png += chunk(b'IDAT', zlib.compress(rows))
+    png += chunk(b'prVt', rng.randbytes(max(0, size - len(png) - 24)))
+    return png + chunk(b'IEND', b'')
+
+
+class Origin:
+    """Local stand-in for the media hosts: /img/<n>.png and /doc/<n>.pdf"""
+    
+    def __init__(self, latency: float, error_rate: float, seed: int):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.bodies: Dict[str, bytes] = {}
+        self.requests = 0
+        self.errors = 0
+    
+    def _body(self, kind: str, n: int) -> bytes:
+        key = f"{kind}{n}"
+        if key not in self.bodies:
+            rng = random.Random(n)
+            if kind == 'img':
+                # Mostly sub-MB, a few large enough for the regular path
+                roll = rng.random()
+                size = rng.randint(20_000, 300_000) if roll < 0.7 else (
+                    rng.randint(300_000, 1_500_000) if roll < 0.95 else rng.randint(1_500_000, 4_000_000))
+                self.bodies[key] = make_png(size, n)
+            else:
+                self.bodies[key] = b'%PDF-1.4\n' + rng.randbytes(rng.randint(50_000, 3_000_000))
+        return self.bodies[key]
+    
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if request.method == 'GET' and self.rng.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=503)
+        
+        kind = request.match_info['kind']
+        body = self._body(kind, int(request.match_info['n']))
+        return web.Response(body=body, content_type='image/png' if kind == 'img' else 'application/pdf')
+    
+    async def start(self) -> str:
+        """Serve on a free local port; returns the base URL"""
+        app = web.Application()
+        app.router.add_get(r'/{kind:img|doc}/{n:\d+}.{ext}', self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        return f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+
+class RateLimit:
+    """Token bucket that hands out waits instead of sleeping"""
+    
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+    
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+
+class FakeMessage(Message):
+    """Just enough of a Message for the handlers and pyrogram's filters"""
+    
+    def __init__(self, client: 'FakeClient', chat_id: int, message_id: int, from_id: int,
+                 text: Optional[str] = None, document=None):
+        self._client = client
+        self.id = message_id
+        self.chat = SimpleNamespace(id=chat_id, type=enums.ChatType.PRIVATE)
+        self.from_user = SimpleNamespace(id=from_id, is_bot=from_id == BOT_ID)
+        self.text = text
+        self.caption = None
+        self.document = document
+        self.command = None
+    
+    async def reply_text(self, text: str, **kwargs) -> 'FakeMessage':
+        return await self._client.send_message(self.chat.id, text, **kwargs)
+    
+    async def edit_text(self, text: str, **kwargs) -> 'FakeMessage':
+        await self._client.call('edit_message_text', self.chat.id)
+        self.text = text
+        return self
+    
+    async def delete(self, revoke: bool = True):
+        await self._client.call('delete_messages', self.chat.id)
+    
+    async def pin(self, **kwargs):
+        await self._client.call('pin_chat_message', self.chat.id)
+    
+    async def unpin(self):
+        await self._client.call('unpin_chat_message', self.chat.id)
+    
+    async def download(self, file_name: str = '', **kwargs) -> str:
+        await self._client.call('get_file', self.chat.id, limited=False)
+        path = os.path.abspath(file_name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.document.content)
+        return path
+
+
+class FakeCallback(CallbackQuery):
+    """A button press on one of the bot's messages"""
+    
+    def __init__(self, client: 'FakeClient', user_id: int, data: str, message: FakeMessage):
+        self._client = client
+        self.id = str(message.id)
+        self.from_user = SimpleNamespace(id=user_id)
+        self.data = data
+        self.message = message
+    
+    async def answer(self, text: str = None, show_alert: bool = None, **kwargs):
+        await self._client.call('answer_callback_query', self.message.chat.id, limited=False)
+
+
+class FakeClient:
+    """Stands in for pyrogram.Client.
+    
+    Handlers register through the usual decorators. Injected updates wait in
+    one queue for a free handler slot. Every API call is counted, rate limited
+    and charged to the update whose handler (or its tasks) made it.
+    """
+    
+    def __init__(self, workers: int, chat_rate: float, global_rate: float, upload_rate: float):
+        self.me = SimpleNamespace(id=BOT_ID, username='load_test_bot')
+        self.handlers: Dict[str, list] = {'message': [], 'callback': []}
+        self.updates: asyncio.Queue = asyncio.Queue()
+        self.workers = workers
+        self.busy = 0
+        self.slot_samples: List[int] = []
+        self.chat_rate = chat_rate
+        self.chat_limits: Dict[int, RateLimit] = {}
+        self.global_limit = RateLimit(global_rate, global_rate)
+        self.upload_rate = upload_rate
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.flood_sleeps = 0
+        self.flood_sleep_time = 0.0
+        self.flood_errors = 0
+        self.uploaded = 0
+        self.probes: List[SimpleNamespace] = []
+        self.handler_errors: Dict[str, int] = defaultdict(int)
+        self._message_ids: Dict[int, int] = defaultdict(int)
+    
+    # Handler registration, as used by setup_handlers
+    
+    def on_message(self, filters=None, group: int = 0):
+        def decorator(func):
+            self.handlers['message'].append((filters, func))
+            return func
+        return decorator
+    
+    def on_callback_query(self, filters=None, group: int = 0):
+        def decorator(func):
+            self.handlers['callback'].append((filters, func))
+            return func
+        return decorator
+    
+    # Dispatch
+    
+    def start(self) -> List[asyncio.Task]:
+        loop = asyncio.get_running_loop()
+        return [loop.create_task(self._worker()) for _ in range(self.workers)] + [
+            loop.create_task(self._sample_slots())
+        ]
+    
+    def inject(self, update, user_id: int, kind: str) -> asyncio.Future:
+        """Queue an update from a user; the future resolves when its handler returns"""
+        probe = SimpleNamespace(user=user_id, kind=kind, injected=time.monotonic(),
+                                started=None, answered=None)
+        self.probes.append(probe)
+        done = asyncio.get_running_loop().create_future()
+        self.updates.put_nowait((update, probe, done))
+        return done
+    
+    async def _worker(self):
+        while True:
+            update, probe, done = await self.updates.get()
+            probe.started = time.monotonic()
+            self.busy += 1
+            _probe.set(probe)
+            try:
+                handler = await self._match(update)
+                if handler is not None:
+                    await handler(self, update)
+            except Exception as e:
+                # pyrogram logs handler errors and keeps the slot
+                self.handler_errors[f"{type(e).__name__}: {e}"[:120]] += 1
+            finally:
+                self.busy -= 1
+                _probe.set(None)
+                if not done.done():
+                    done.set_result(None)
+    
+    async def _match(self, update):
+        """First handler whose filters pass, as within one pyrogram handler group"""
+        kind = 'callback' if isinstance(update, CallbackQuery) else 'message'
+        for filters, func in self.handlers[kind]:
+            if filters is None or await filters(self, update):
+                return func
+        return None
+    
+    async def _sample_slots(self):
+        while True:
+            self.slot_samples.append(self.busy)
+            await asyncio.sleep(0.1)
+    
+    # API surface used by handlers, uploader and fanout
+    
+    async def call(self, method: str, chat_id: int, limited: bool = True):
+        """Count a call, apply flood limits and charge it to the running update"""
+        self.calls[method] += 1
+        if limited:
+            limit = self.chat_limits.get(chat_id)
+            if limit is None:
+                limit = self.chat_limits[chat_id] = RateLimit(self.chat_rate, max(1.0, self.chat_rate * 3))
+            wait = max(limit.reserve(), self.global_limit.reserve())
+            if wait > SLEEP_THRESHOLD:
+                self.flood_errors += 1
+                raise FloodWait(value=int(wait) + 1)
+            if wait:
+                self.flood_sleeps += 1
+                self.flood_sleep_time += wait
+                await asyncio.sleep(wait)
+        
+        probe = _probe.get()
+        if probe is not None and probe.answered is None:
+            probe.answered = time.monotonic()
+    
+    def bot_message(self, chat_id: int, text: Optional[str] = None) -> FakeMessage:
+        self._message_ids[chat_id] += 1
+        return FakeMessage(self, chat_id, self._message_ids[chat_id], BOT_ID, text)
+    
+    def user_message(self, user_id: int, text: Optional[str] = None, document=None) -> FakeMessage:
+        self._message_ids[user_id] += 1
+        return FakeMessage(self, user_id, self._message_ids[user_id], user_id, text, document)
+    
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> FakeMessage:
+        await self.call('send_message', chat_id)
+        return self.bot_message(chat_id, text)
+    
+    async def _upload(self, media, progress=None) -> int:
+        if isinstance(media, str):
+            size = os.path.getsize(media)  # Fails like pyrogram if the file is already gone
+        else:
+            media.seek(0, os.SEEK_END)
+            size = media.tell()
+            media.seek(0)
+        await asyncio.sleep(size / self.upload_rate)
+        if progress:
+            await progress(size, size)
+        self.uploaded += size
+        return size
+    
+    async def send_video(self, chat_id: int, video, progress=None, **kwargs) -> FakeMessage:
+        await self._upload(video, progress)
+        return await self.send_message(chat_id, kwargs.get('caption', ''))
+    
+    async def send_photo(self, chat_id: int, photo, progress=None, **kwargs) -> FakeMessage:
+        await self._upload(photo, progress)
+        return await self.send_message(chat_id, kwargs.get('caption', ''))
+    
+    async def send_document(self, chat_id: int, document, progress=None, **kwargs) -> FakeMessage:
+        await self._upload(document, progress)
+        return await self.send_message(chat_id, kwargs.get('caption', ''))
+    
+    async def send_media_group(self, chat_id: int, media: list, **kwargs) -> List[FakeMessage]:
+        for item in media:
+            await self._upload(item.media)
+        await self.call('send_media_group', chat_id)
+        return [self.bot_message(chat_id) for _ in media]
+    
+    async def copy_message(self, chat_id: int, from_chat_id: int, message_id: int, **kwargs) -> FakeMessage:
+        await self.call('copy_message', chat_id)
+        return self.bot_message(chat_id)
+    
+    async def copy_media_group(self, chat_id: int, from_chat_id: int, message_id: int, **kwargs) -> list:
+        await self.call('copy_media_group', chat_id)
+        return [self.bot_message(chat_id)]
+    
+    async def get_chat(self, chat_id) -> SimpleNamespace:
+        return SimpleNamespace(
+            id=chat_id if isinstance(chat_id, int) else -abs(hash(chat_id)),
+            type=enums.ChatType.SUPERGROUP
+        )
+    
+    async def get_chat_member(self, chat_id: int, user_id: int) -> SimpleNamespace:
+        return SimpleNamespace(status=enums.ChatMemberStatus.MEMBER, is_member=True)
+
+
+def make_list(rng: random.Random, base_url: str, count: int) -> str:
+    lines = []
+    for i in range(count):
+        n = rng.randint(1, 500)
+        if rng.random() < 0.7:
+            lines.append(f"Picture {i + 1}: {base_url}/img/{n}.png")
+        else:
+            lines.append(f"Notes {i + 1}: {base_url}/doc/{n}.pdf")
+    return "\n".join(lines)
+
+
+async def run_user(client: FakeClient, user_id: int, base_url: str, args, deadline: float, stats: dict):
+    """One user's session loop until the deadline (the last batch is finished,
+    and a list re-sent during it is run too, so no session is left open)"""
+    rng = random.Random(args.seed * 100_003 + user_id)
+    
+    def send_list(count: int) -> asyncio.Future:
+        stats['lists'] += 1
+        document = SimpleNamespace(file_name=f"list_{stats['lists']}.txt", content=make_list(rng, base_url, count))
+        return client.inject(client.user_message(user_id, document=document), user_id, 'list')
+    
+    resent = None  # (reply future, item count) of a list sent mid-batch
+    while time.monotonic() < deadline or resent:
+        if resent:
+            sent, count = resent
+            resent = None
+            await sent
+        else:
+            count = rng.randint(3, args.items)
+            await send_list(count)
+        menu = client.bot_message(user_id)
+        
+        if rng.random() < 0.3:
+            await client.inject(FakeCallback(client, user_id, 'download_all', menu), user_id, 'all')
+        else:
+            await client.inject(FakeCallback(client, user_id, 'select_range', menu), user_id, 'select')
+            start = rng.randint(1, 3)
+            end = rng.randint(start, count)
+            selection = f"{start}-{end}" if rng.random() < 0.7 else f"{start}-{end},!{start + 1}"
+            await client.inject(client.user_message(user_id, text=selection), user_id, 'range')
+        
+        quality = FakeCallback(client, user_id, f"q_{rng.choice(QUALITIES)}", client.bot_message(user_id))
+        batch = client.inject(quality, user_id, 'quality')
+        stats['batches'] += 1
+        
+        roll = rng.random()
+        if roll < args.cancel_rate:
+            await asyncio.sleep(rng.uniform(0.1, 3))
+            if not batch.done():
+                stats['stops'] += 1
+                if rng.random() < 0.5:
+                    stop = FakeCallback(client, user_id, 'stop', quality.message)
+                    client.inject(stop, user_id, 'stop')
+                else:
+                    client.inject(client.user_message(user_id, text='/cancel'), user_id, 'cancel')
+        elif roll < args.cancel_rate + args.resend_rate:
+            await asyncio.sleep(rng.uniform(0.1, 2))
+            if not batch.done():
+                stats['resends'] += 1
+                count = rng.randint(3, args.items)
+                resent = (send_list(count), count)
+        
+        await batch
+        await asyncio.sleep(rng.uniform(0, args.think))
+
+
+def global_state() -> Dict[str, int]:
+    """Sizes of the module-level state that must not grow without bound"""
+    import handlers
+    import progress
+    import retry
+    import bandwidth
+    import jobs
+    import memory_files
+    return {
+        'handlers.user_data': len(handlers.user_data),
+        'handlers.active_jobs': len(handlers.active_jobs),
+        'handlers.fanout_targets': len(handlers.fanout_targets),
+        'progress_bus state': len(progress.progress_bus._state),
+        'progress_bus estimators': len(progress.progress_bus._estimators),
+        'progress_bus subscribers': len(progress.progress_bus._subscribers),
+        'retry breakers': len(retry._breakers),
+        'download governor users': len(bandwidth.download_governor._active),
+        'upload governor users': len(bandwidth.upload_governor._active),
+        'live scratch dirs': len(jobs._live_scratch),
+        'memory budget used (B)': memory_files.memory_budget.used,
+    }
+
+
+# Entries that should be back to zero once every user is idle
+MUST_DRAIN = (
+    'handlers.user_data', 'handlers.active_jobs', 'progress_bus state',
+    'progress_bus subscribers', 'live scratch dirs', 'memory budget used (B)'
+)
+
+
+def _percentiles(values: List[float]) -> str:
+    if not values:
+        return "-"
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+    return f"p50 {statistics.median(values) * 1000:7.0f} ms | p95 {p95 * 1000:7.0f} ms | max {values[-1] * 1000:7.0f} ms"
+
+
+async def run(args) -> int:
+    import handlers
+    from config import DOWNLOAD_DIR
+    
+    origin = Origin(args.latency_ms / 1000, args.error_rate, args.seed)
+    base_url = await origin.start()
+    client = FakeClient(args.workers, args.chat_rate, args.global_rate, args.upload_mbps * 1024 * 1024)
+    handlers.setup_handlers(client)
+    handlers.start_background_tasks()
+    background = client.start()
+    
+    files_before = {os.path.join(root, name) for root, _, names in os.walk(DOWNLOAD_DIR) for name in names}
+    state_start = global_state()
+    state_peak = dict(state_start)
+    stats = defaultdict(int)
+    
+    async def sample_state():
+        while True:
+            await asyncio.sleep(1)
+            for key, value in global_state().items():
+                state_peak[key] = max(state_peak[key], value)
+    
+    sampler = asyncio.create_task(sample_state())
+    deadline = time.monotonic() + args.duration
+    users = [
+        asyncio.create_task(run_user(client, 1000 + n, base_url, args, deadline, stats))
+        for n in range(args.users)
+    ]
+    print(f"{args.users} users for {args.duration}s against {base_url} "
+          f"({args.workers} handler slots)...", flush=True)
+    
+    _, pending = await asyncio.wait(users, timeout=args.duration + args.drain)
+    for task in pending:
+        task.cancel()
+    for task in users:
+        if task.done() and not task.cancelled() and task.exception():
+            client.handler_errors[f"user loop: {task.exception()!r}"[:120]] += 1
+    await asyncio.sleep(args.settle)
+    sampler.cancel()
+    for task in background:
+        task.cancel()
+    
+    state_end = global_state()
+    files_after = {os.path.join(root, name) for root, _, names in os.walk(DOWNLOAD_DIR) for name in names}
+    leaked = sorted(files_after - files_before)
+    
+    # Report
+    print(f"\nLists sent: {stats['lists']} | batches: {stats['batches']} | "
+          f"stopped: {stats['stops']} | re-sent mid-batch: {stats['resends']} | "
+          f"users still busy at drain timeout: {len(pending)}")
+    
+    print("\nFirst response per update kind (inject → first bot API call):")
+    by_kind = defaultdict(list)
+    for probe in client.probes:
+        by_kind[probe.kind].append(probe)
+    for kind, probes in sorted(by_kind.items()):
+        answered = [p.answered - p.injected for p in probes if p.answered]
+        print(f"  {kind:8} {len(probes):6}x  {_percentiles(answered)}  unanswered {len(probes) - len(answered)}")
+    
+    print("\nPer user:")
+    by_user = defaultdict(list)
+    for probe in client.probes:
+        by_user[probe.user].append(probe)
+    for user, probes in sorted(by_user.items()):
+        answered = [p.answered - p.injected for p in probes if p.answered]
+        print(f"  {user}  {len(probes):5} updates  {_percentiles(answered)}")
+    
+    waits = [p.started - p.injected for p in client.probes if p.started]
+    samples = client.slot_samples or [0]
+    saturated = sum(1 for busy in samples if busy >= client.workers) / len(samples)
+    print(f"\nHandler slots: {client.workers} | mean busy {statistics.mean(samples):.1f} | "
+          f"all busy {saturated * 100:.0f}% of the time")
+    print(f"  queue wait: {_percentiles(waits)}")
+    
+    calls = ", ".join(f"{method} {count}" for method, count in sorted(client.calls.items()))
+    print(f"\nTelegram calls: {calls}")
+    print(f"  flood waits slept: {client.flood_sleeps} ({client.flood_sleep_time:.1f}s) | "
+          f"FloodWait raised: {client.flood_errors} | uploaded {client.uploaded / 1024 / 1024:.1f} MB")
+    print(f"Origin: {origin.requests} requests, {origin.errors} injected 503s")
+    
+    print("\nGlobal state (start → peak → end):")
+    for key in state_start:
+        print(f"  {key:26} {state_start[key]:>10} → {state_peak[key]:>10} → {state_end[key]:>10}")
+    
+    print(f"\nFiles left in {DOWNLOAD_DIR}: {len(leaked)}")
+    for path in leaked[:10]:
+        print(f"  {os.path.relpath(path)}")
+    
+    if client.handler_errors:
+        print(f"\nHandler errors: {sum(client.handler_errors.values())}")
+        for error, count in sorted(client.handler_errors.items(), key=lambda item: -item[1])[:10]:
+            print(f"  {count:5}x {error}")
+    
+    undrained = [key for key in MUST_DRAIN if state_end[key] > state_start[key]]
+    if undrained:
+        print(f"\nNot drained: {', '.join(undrained)}")
+    return 1 if leaked or undrained or client.handler_errors else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=60, help="seconds users keep starting new batches")
+    parser.add_argument('--drain', type=float, default=300, help="extra seconds for the last batches to finish")
+    parser.add_argument('--settle', type=float, default=2, help="seconds to wait before checking for leaks")
+    parser.add_argument('--workers', type=int, default=8, help="handler slots (pyrogram workers)")
+    parser.add_argument('--items', type=int, default=30, help="max items per list")
+    parser.add_argument('--cancel-rate', type=float, default=0.2, help="share of batches stopped mid-way")
+    parser.add_argument('--resend-rate', type=float, default=0.1, help="share of batches with a new list sent mid-way")
+    parser.add_argument('--think', type=float, default=2, help="max seconds between a user's batches")
+    parser.add_argument('--chat-rate', type=float, default=1, help="API calls per second per chat")
+    parser.add_argument('--global-rate', type=float, default=30, help="API calls per second overall")
+    parser.add_argument('--upload-mbps', type=float, default=20, help="simulated upload speed, MB/s")
+    parser.add_argument('--latency-ms', type=float, default=20, help="origin response delay")
+    parser.add_argument('--error-rate', type=float, default=0, help="share of origin GETs answered 503")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help="show the bot's own log")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    os.environ.setdefault('BOT_MODE', 'standalone')
+    sys.path.insert(0, REPO_DIR)
+    
+    # DOWNLOAD_DIR is relative to the working directory, so leaks land here
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        return asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
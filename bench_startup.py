@@ -0,0 +1,165 @@
+"""Startup-time benchmark.
+
+Measures how long it takes before the health endpoint can be served:
+
+* ``import main`` under ``python -X importtime`` (what runs before the web
+  server starts) is checked against a budget;
+* ``import handlers`` (the background warm-up) is reported, optionally budgeted;
+* ``--health`` also launches ``main.py`` and times the first ``/health`` 200;
+* ``--warm-up`` runs ``main.py`` until its warm-up has imported pyrogram and
+  the handlers (what ``import main`` alone never exercises).
+
+Exits non-zero when a budget is exceeded so it can run in CI:
+
+    python bench_startup.py --budget-ms 400 --runs 5
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+import urllib.request
+from typing import Dict, List, Tuple
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _env(**extra) -> Dict[str, str]:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = REPO_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    env.update(extra)
+    return env
+
+
+def measure_import(module: str, workdir: str) -> Tuple[float, List[Tuple[int, str]]]:
+    """Wall time (ms) of importing a module in a fresh interpreter, plus
+    the (cumulative_us, name) import-time entries"""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=workdir, env=_env(), capture_output=True, text=True
+    )
+    elapsed = (time.perf_counter() - started) * 1000
+    
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        try:
+            _, cumulative, name = line.split(':', 1)[1].split('|')
+            entries.append((int(cumulative), name.strip()))
+        except ValueError:
+            continue
+    return elapsed, entries
+
+
+def measure_health(workdir: str, timeout: float = 60.0) -> float:
+    """Seconds from launching main.py until /health answers 200"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, 'main.py')],
+        cwd=workdir, env=_env(PORT=str(port)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1) as r:
+                    if r.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.02)
+        raise RuntimeError("health endpoint never came up")
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def measure_warm_up(workdir: str, timeout: float = 60.0) -> float:
+    """Seconds from launching main.py until its warm-up imports are done;
+    raises if the bot fails before getting there"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, 'main.py')],
+        cwd=workdir, env=_env(PORT=str(port)),
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    watchdog = threading.Timer(timeout, proc.kill)
+    watchdog.start()
+    output = []
+    try:
+        for line in proc.stdout:
+            if 'Warm-up imports done' in line:
+                return time.perf_counter() - started
+            output.append(line)
+        raise RuntimeError("main.py exited before warm-up finished:\n" + ''.join(output[-20:]))
+    finally:
+        watchdog.cancel()
+        proc.kill()
+        proc.wait()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('STARTUP_BUDGET_MS', '400')),
+                        help="median budget for `import main`")
+    parser.add_argument('--warm-budget-ms', type=float, default=0,
+                        help="optional median budget for the warm-up imports (0 = report only)")
+    parser.add_argument('--top', type=int, default=10, help="slowest imports to list")
+    parser.add_argument('--health', action='store_true', help="also time the first /health response")
+    parser.add_argument('--warm-up', action='store_true',
+                        help="also run main.py until its warm-up imports are done")
+    args = parser.parse_args()
+    
+    failed = False
+    with tempfile.TemporaryDirectory() as workdir:
+        for module, budget in (('main', args.budget_ms), ('handlers', args.warm_budget_ms)):
+            times = []
+            entries = []
+            for _ in range(args.runs):
+                elapsed, entries = measure_import(module, workdir)
+                times.append(elapsed)
+            
+            median = statistics.median(times)
+            verdict = ""
+            if budget:
+                verdict = "OK" if median <= budget else "OVER BUDGET"
+                failed |= median > budget
+            print(f"import {module}: median {median:.0f} ms over {args.runs} runs "
+                  f"(budget {budget or '-'} ms) {verdict}")
+            
+            for cumulative, name in sorted(entries, reverse=True)[:args.top]:
+                print(f"    {cumulative / 1000:8.1f} ms  {name}")
+        
+        if args.health:
+            print(f"first /health 200 after {measure_health(workdir):.2f} s")
+        
+        if args.warm_up:
+            try:
+                print(f"main.py warm-up done after {measure_warm_up(workdir):.2f} s")
+            except RuntimeError as e:
+                print(f"warm-up FAILED: {e}")
+                failed = True
+    
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
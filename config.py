@@ -10,6 +10,9 @@ PORT = int(os.getenv("PORT", "10000"))
 # Directory Configuration
 DOWNLOAD_DIR = Path("downloads")
 DOWNLOAD_DIR.mkdir(exist_ok=True)
+SCRATCH_DIR = DOWNLOAD_DIR / "jobs"  # One private subdirectory per job
+SCRATCH_MAX_AGE = int(os.getenv("SCRATCH_MAX_AGE", "86400"))  # Reclaim foreign dirs after this
+JANITOR_INTERVAL = 600  # Seconds between orphaned scratch sweeps
 
 # Quality Settings
 QUALITY_MAP = {
@@ -19,6 +22,9 @@ QUALITY_MAP = {
     "1080p": "1080",
 }
 
+# Parsed link lists are dropped after this many idle seconds
+SESSION_TTL = int(os.getenv("SESSION_TTL", "1800"))
+
 # Supported File Types
 SUPPORTED_TYPES = {
     'video': ['.m3u8', '.mpd', '.mp4', '.mkv', '.avi', '.mov', '.flv', '.wmv', '.webm', '.ts'],
@@ -33,12 +39,119 @@ MAX_CONCURRENT_DOWNLOADS = 3  # Parallel downloads
 BUFFER_SIZE = 262144  # 256KB buffer
 HTTP_CHUNK_SIZE = 1048576  # 1MB chunks
 
+# Direct Media Fast Path (plain video files skip yt-dlp)
+DIRECT_VIDEO_EXTENSIONS = ['.mp4', '.mkv', '.webm', '.mov']
+DIRECT_SEGMENTS = 8  # Parallel byte ranges per file
+DIRECT_SEGMENT_MIN_SIZE = 4194304  # 4MB minimum per range
+DIRECT_RANGE_RETRIES = 5  # Resume attempts per range
+
+# Native DASH (.mpd manifests are fetched segment by segment without yt-dlp)
+DASH_ENABLED = os.getenv("DASH_ENABLED", "true").lower() == "true"
+DASH_CONNECTIONS = 16  # Segments in flight per track
+DASH_SEGMENT_RETRIES = 5  # Attempts per segment
+
+# Autotuning (per-host connections and chunk size learned from throughput;
+# the static values above are each host's starting point)
+AUTOTUNE_ENABLED = os.getenv("AUTOTUNE_ENABLED", "true").lower() == "true"
+AUTOTUNE_FILE = os.getenv("AUTOTUNE_FILE", "autotune.json")  # Learned settings, kept across restarts
+AUTOTUNE_MAX_CONNECTIONS = 32  # Upper bound for fragments/ranges/segments in flight per host
+AUTOTUNE_MIN_CHUNK = 262144  # 256KB
+AUTOTUNE_MAX_CHUNK = 16777216  # 16MB
+AUTOTUNE_MIN_SAMPLE = 8388608  # Transfers under 8MB say little about throughput
+AUTOTUNE_CEILING_TTL = 86400  # Seconds a host's "too many connections" limit is remembered
+
+# Retry Policy for native HTTP downloads (exponential backoff with jitter)
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "6"))  # Extra attempts per file
+RETRY_BASE_DELAY = 1.0  # Seconds before the first retry
+RETRY_MAX_DELAY = 60  # Backoff ceiling
+
+# Per-host Circuit Breaker (a dead host pauses its remaining items)
+CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive host failures before the circuit opens
+CIRCUIT_COOLDOWN = 30  # First pause in seconds, doubled while the host stays down
+CIRCUIT_MAX_COOLDOWN = 300
+CIRCUIT_MAX_WAIT = int(os.getenv("CIRCUIT_MAX_WAIT", "900"))  # Give up on an item after this long paused
+
+# Format Selection Limits (0 disables a limit)
+MAX_VIDEO_SIZE_MB = int(os.getenv("MAX_VIDEO_SIZE_MB", "2000"))  # Telegram upload cap
+MAX_VIDEO_BITRATE_KBPS = int(os.getenv("MAX_VIDEO_BITRATE_KBPS", "0"))
+
+# Transcoding (videos over the limits above are re-encoded instead of rejected)
+TRANSCODE_ENABLED = os.getenv("TRANSCODE_ENABLED", "false").lower() == "true"
+TRANSCODE_MAX_SOURCE_MB = int(os.getenv("TRANSCODE_MAX_SOURCE_MB", "8000"))  # Largest source to download
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", str(os.cpu_count() or 1)))  # Parallel ffmpeg encoders
+TRANSCODE_SEGMENT_SECONDS = 30  # Segments are cut at the first keyframe after this
+TRANSCODE_PRESET = "veryfast"  # CPU-friendly x264 preset
+TRANSCODE_AUDIO_KBPS = 128
+
+# Bandwidth Budgets in MB/s, shared fairly between users (0 = unlimited)
+DOWNLOAD_BUDGET_MB = float(os.getenv("DOWNLOAD_BUDGET_MB", "0"))
+UPLOAD_BUDGET_MB = float(os.getenv("UPLOAD_BUDGET_MB", "0"))
+BANDWIDTH_BURST_SECONDS = 0.5  # Bucket depth, in seconds of budget
+
 # Upload Settings
 UPLOAD_CHUNK_SIZE = 524288  # 512KB for faster uploads
 MAX_RETRIES = 20  # Increased retries
 FRAGMENT_RETRIES = 20
 CONNECTION_TIMEOUT = 2400  # 40 minutes
 
+# Album Settings (consecutive images are sent as media groups)
+ALBUM_SIZE = 10  # Telegram's media group limit
+ALBUM_DOCUMENTS = os.getenv("ALBUM_DOCUMENTS", "false").lower() == "true"  # Group documents too
+
+# Fan-out (extra destination chats get copies instead of re-uploads)
+FANOUT_RATE = int(os.getenv("FANOUT_RATE", "20"))  # Copies per second across all destinations
+FANOUT_MAX_CHATS = 10  # Extra destinations per user
+
+# Image Lane (images outside these limits are re-encoded or sent as documents)
+IMAGE_HOST_CONCURRENCY = 16  # Parallel image downloads per host
+PHOTO_MAX_SIZE = 10485760  # 10MB Telegram photo limit
+PHOTO_MAX_DIMENSIONS = 10000  # Width + height
+PHOTO_MAX_ASPECT = 20  # Longest side / shortest side
+PHOTO_RESIZE_SIDE = 2560  # Long side of re-encoded photos
+
+# Small-File Lane (no progress message, processed concurrently)
+SMALL_FILE_MAX_SIZE = int(os.getenv("SMALL_FILE_MAX_KB", "1024")) * 1024  # 0 disables the lane
+SMALL_FILE_CONCURRENCY = 6  # Small files in flight at once
+
+# In-Memory Files (small images/documents skip DOWNLOAD_DIR entirely)
+MEMORY_FILE_MAX_SIZE = int(os.getenv("MEMORY_FILE_MAX_KB", "1024")) * 1024  # 0 = always use disk
+MEMORY_BUDGET = int(os.getenv("MEMORY_BUDGET_MB", "64")) * 1024 * 1024  # All in-memory files together
+
+# Incremental Re-runs (items delivered to a chat are remembered, so a
+# re-sent list can be narrowed to its new or changed lines)
+DELIVERY_DB = os.getenv("DELIVERY_DB", "deliveries.db")
+
+# Scheduling (run order of a batch; captions always keep the original serial)
+# order: list order | sjf: smallest first by HEAD-probed size, unknown sizes last
+SCHEDULE_POLICY = os.getenv("SCHEDULE_POLICY", "order")
+SIZE_PROBE_CONCURRENCY = 16  # HEAD requests in flight while probing sizes
+
+# Batch Dashboard (one live status message per batch)
+DASHBOARD_INTERVAL = 5  # Seconds between dashboard refreshes
+DASHBOARD_MAX_ACTIVE = 8  # Active items listed on the dashboard
+
+# Event-loop Monitor (finds blocking calls; report at /loop)
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+LOOP_STALL_THRESHOLD_MS = int(os.getenv("LOOP_STALL_THRESHOLD_MS", "100"))  # Lag that counts as a stall
+LOOP_MONITOR_INTERVAL = 0.05  # Seconds between heartbeats
+LOOP_REPORT_INTERVAL = 300  # Seconds between worst-offender log reports
+
+# Logging (written by a background thread; the event loop only enqueues)
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_MAX_MB = int(os.getenv("LOG_MAX_MB", "10"))  # Rotate when the file reaches this size
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "3"))  # Rotated files kept
+LOG_JSON = os.getenv("LOG_JSON", "false").lower() == "true"  # One JSON object per line with job IDs
+
+# Scale-out Settings
+# standalone: one process does everything
+# coordinator: chat UI only, items go to the work queue
+# worker: claims queued items (run with `python worker.py`)
+BOT_MODE = os.getenv("BOT_MODE", "standalone")
+QUEUE_DB = os.getenv("QUEUE_DB", "work_queue.db")
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "0"))  # Local workers spawned by the coordinator
+CLAIM_TIMEOUT = 300  # Seconds without heartbeat before an item is requeued
+QUEUE_POLL_INTERVAL = 3  # Seconds between queue polls (workers and batch status)
+
 # Thumbnail Settings
 THUMBNAIL_TIME = "00:00:05"  # 5 seconds into video
 THUMBNAIL_SIZE = "480:270"  # Better quality thumbnail
@@ -0,0 +1,432 @@
+import re
+import math
+import time
+import shutil
+import asyncio
+import aiohttp
+import aiofiles
+import logging
+import xml.etree.ElementTree as ET
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+from config import DASH_CONNECTIONS, DASH_SEGMENT_RETRIES, HTTP_CHUNK_SIZE
+from utils import format_size
+from progress import progress_bus
+from jobs import CancelToken, run_process
+from bandwidth import download_governor
+from retry import breaker_for, backoff_delay, is_retryable, status_error
+from formats import select_format, COPYABLE_VIDEO_CODECS
+from downloader import create_session, download_file, wait_for_host, MEDIA_HEADERS
+from autotune import autotuner, Tuning
+
+logger = logging.getLogger(__name__)
+
+# (url, byte range or None)
+Segment = Tuple[str, Optional[str]]
+
+DURATION_RE = re.compile(
+    r'P(?:(?P<days>\d+)D)?'
+    r'(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>[\d.]+)S)?)?$'
+)
+TEMPLATE_RE = re.compile(r'\$(RepresentationID|Number|Time|Bandwidth)(%0(\d+)d)?\$')
+
+
+def is_dash_url(url: str) -> bool:
+    return urlparse(url).path.lower().endswith('.mpd')
+
+
+def parse_duration(value: Optional[str]) -> float:
+    """Seconds in an ISO 8601 duration such as PT1H2M3.5S"""
+    match = DURATION_RE.match(value or '')
+    if not match:
+        return 0.0
+    parts = {key: float(val) for key, val in match.groupdict().items() if val}
+    return (
+        parts.get('days', 0) * 86400 + parts.get('hours', 0) * 3600
+        + parts.get('minutes', 0) * 60 + parts.get('seconds', 0)
+    )
+
+
+def _fill_template(template: str, rep_id: str, bandwidth: int, number: int, time: int) -> str:
+    values = {'RepresentationID': rep_id, 'Number': number, 'Time': time, 'Bandwidth': bandwidth}
+    
+    def substitute(match):
+        value = values[match.group(1)]
+        if match.group(3) and isinstance(value, int):
+            return str(value).zfill(int(match.group(3)))
+        return str(value)
+    
+    return TEMPLATE_RE.sub(substitute, template).replace('$$', '$')
+
+
+def _base_url(element: ET.Element, parent: str) -> str:
+    node = element.find('BaseURL')
+    if node is not None and node.text and node.text.strip():
+        return urljoin(parent, node.text.strip())
+    return parent
+
+
+def _merged_template(levels: List[ET.Element]) -> Tuple[Dict[str, str], Optional[ET.Element]]:
+    """SegmentTemplate attributes inherited Period -> AdaptationSet -> Representation"""
+    attrs: Dict[str, str] = {}
+    timeline = None
+    for level in levels:
+        template = level.find('SegmentTemplate')
+        if template is None:
+            continue
+        attrs.update(template.attrib)
+        if template.find('SegmentTimeline') is not None:
+            timeline = template.find('SegmentTimeline')
+    return attrs, timeline
+
+
+def _template_segments(
+    attrs: Dict[str, str],
+    timeline: Optional[ET.Element],
+    base: str,
+    rep_id: str,
+    bandwidth: int,
+    duration: float
+) -> Tuple[Optional[Segment], List[Segment]]:
+    start_number = int(attrs.get('startNumber', 1))
+    timescale = int(attrs.get('timescale', 1))
+    media = attrs.get('media')
+    if not media:
+        return None, []
+    
+    init = None
+    if attrs.get('initialization'):
+        init = (urljoin(base, _fill_template(attrs['initialization'], rep_id, bandwidth, 0, 0)), None)
+    
+    # (number, start time) of every segment
+    numbered = []
+    if timeline is not None:
+        number = start_number
+        time = 0
+        end = duration * timescale
+        for entry in timeline.findall('S'):
+            time = int(entry.get('t', time))
+            length = int(entry.get('d'))
+            repeat = int(entry.get('r', 0))
+            if repeat < 0:
+                # Repeat until the end of the period
+                repeat = math.ceil((end - time) / length) - 1 if end else 0
+            for _ in range(repeat + 1):
+                numbered.append((number, time))
+                number += 1
+                time += length
+    elif attrs.get('duration') and duration:
+        length = int(attrs['duration'])
+        count = math.ceil(duration * timescale / length)
+        numbered = [(start_number + n, n * length) for n in range(count)]
+    
+    segments = [
+        (urljoin(base, _fill_template(media, rep_id, bandwidth, number, time)), None)
+        for number, time in numbered
+    ]
+    return init, segments
+
+
+def _list_segments(segment_list: ET.Element, base: str) -> Tuple[Optional[Segment], List[Segment]]:
+    init = None
+    node = segment_list.find('Initialization')
+    if node is not None:
+        init = (urljoin(base, node.get('sourceURL', '')), node.get('range'))
+    segments = [
+        (urljoin(base, entry.get('media', '')), entry.get('mediaRange'))
+        for entry in segment_list.findall('SegmentURL')
+    ]
+    return init, segments
+
+
+def parse_mpd(text: str, url: str) -> Optional[Dict]:
+    """Representations of a static single-period MPD with their segment URLs.
+    
+    Returns None for manifests the native engine does not handle (live,
+    DRM-protected, multi-period); those go to yt-dlp instead.
+    """
+    root = ET.fromstring(text)
+    for element in root.iter():
+        element.tag = element.tag.rsplit('}', 1)[-1]
+    
+    if root.get('type', 'static') != 'static':
+        return None
+    periods = root.findall('Period')
+    if len(periods) != 1:
+        return None
+    period = periods[0]
+    if period.find('.//ContentProtection') is not None:
+        return None
+    
+    duration = parse_duration(period.get('duration') or root.get('mediaPresentationDuration'))
+    mpd_base = _base_url(root, url)
+    period_base = _base_url(period, mpd_base)
+    representations = []
+    
+    for adaptation in period.findall('AdaptationSet'):
+        set_base = _base_url(adaptation, period_base)
+        set_type = adaptation.get('contentType') or adaptation.get('mimeType', '').split('/')[0]
+        
+        for rep in adaptation.findall('Representation'):
+            kind = set_type or rep.get('mimeType', '').split('/')[0]
+            if kind not in ('video', 'audio'):
+                continue
+            
+            base = _base_url(rep, set_base)
+            rep_id = rep.get('id', '')
+            bandwidth = int(rep.get('bandwidth', 0))
+            codecs = (rep.get('codecs') or adaptation.get('codecs') or '').split(',')
+            
+            attrs, timeline = _merged_template([period, adaptation, rep])
+            segment_list = rep.find('SegmentList')
+            if segment_list is None:
+                segment_list = adaptation.find('SegmentList')
+            if attrs:
+                init, segments = _template_segments(attrs, timeline, base, rep_id, bandwidth, duration)
+            elif segment_list is not None:
+                init, segments = _list_segments(segment_list, base)
+            elif base != mpd_base:
+                # SegmentBase or a bare BaseURL: the representation is one file
+                init, segments = None, [(base, None)]
+            else:
+                continue
+            if not segments:
+                continue
+            
+            if kind == 'video':
+                vcodec = codecs[0].strip() or 'unknown'
+                acodec = codecs[1].strip() if len(codecs) > 1 else 'none'
+            else:
+                vcodec, acodec = 'none', codecs[0].strip() or 'unknown'
+            
+            representations.append({
+                'format_id': str(len(representations)),
+                'height': int(rep.get('height') or adaptation.get('height') or 0),
+                'vcodec': vcodec,
+                'acodec': acodec,
+                'tbr': bandwidth / 1000,
+                'init': init,
+                'segments': segments,
+            })
+    
+    return {'duration': duration, 'formats': representations}
+
+
+async def fetch_manifest(session: aiohttp.ClientSession, url: str) -> Optional[Dict]:
+    try:
+        async with session.get(url, headers=MEDIA_HEADERS) as response:
+            if response.status != 200:
+                logger.error(f"MPD fetch failed: HTTP {response.status} for {url}")
+                return None
+            text = await response.text()
+            return parse_mpd(text, str(response.url))
+        
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"MPD parse error for {url}: {e}")
+        return None
+
+
+async def _fetch_segment(
+    session: aiohttp.ClientSession,
+    segment: Segment,
+    job_id: str,
+    token: CancelToken,
+    counter: List[int],
+    total: int,
+    manifest_url: str,
+    chunk_size: int
+) -> bytes:
+    """GET one segment into memory, retrying transient failures; pushback is
+    reported to the manifest host's autotuner, which sized the window"""
+    url, byte_range = segment
+    breaker = breaker_for(url)
+    headers = dict(MEDIA_HEADERS)
+    if byte_range:
+        headers['Range'] = f"bytes={byte_range}"
+    attempts = 0
+    
+    while True:
+        if not await wait_for_host(url, job_id, token):
+            raise IOError(f"Host {breaker.host} still down")
+        
+        parts = []
+        received = 0
+        try:
+            async with session.get(url, headers=headers) as response:
+                if response.status not in (200, 206):
+                    raise status_error(response, url)
+                
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    if token.cancelled:
+                        raise asyncio.CancelledError()
+                    parts.append(chunk)
+                    received += len(chunk)
+                    counter[0] += len(chunk)
+                    progress_bus.publish(job_id, 'download', counter[0], max(total, counter[0]))
+                    await download_governor.throttle(job_id, len(chunk))
+            
+            breaker.record_success()
+            return b''.join(parts)
+            
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            counter[0] -= received
+            breaker.record(e)
+            autotuner.record_error(manifest_url, e)
+            attempts += 1
+            if not is_retryable(e) or attempts > DASH_SEGMENT_RETRIES:
+                raise
+            await asyncio.sleep(backoff_delay(attempts, getattr(e, 'retry_after', None)))
+
+
+async def fetch_track(
+    session: aiohttp.ClientSession,
+    rep: Dict,
+    path: Path,
+    job_id: str,
+    token: CancelToken,
+    counter: List[int],
+    total: int,
+    manifest_url: str,
+    tuning: Tuning
+) -> str:
+    """Fetch a representation's segments concurrently, appending them to
+    path in order; at most tuning.connections segments are held in memory"""
+    segments = ([rep['init']] if rep['init'] else []) + rep['segments']
+    pending = deque()
+    
+    try:
+        async with aiofiles.open(path, 'wb') as f:
+            for segment in segments:
+                pending.append(asyncio.create_task(
+                    _fetch_segment(
+                        session, segment, job_id, token, counter, total,
+                        manifest_url, tuning.chunk_size
+                    )
+                ))
+                if len(pending) >= tuning.connections:
+                    await f.write(await pending.popleft())
+            while pending:
+                await f.write(await pending.popleft())
+        return str(path)
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def fetch_single_file(
+    session: aiohttp.ClientSession,
+    url: str,
+    path: Path,
+    job_id: str,
+    token: CancelToken,
+    counter: List[int]
+) -> Optional[str]:
+    """Stream a single-file representation with resume instead of buffering
+    it; its bytes join the shared counter like those of segmented tracks"""
+    result = await download_file(url, path, job_id, token, session)
+    if result is not None:
+        counter[0] += path.stat().st_size
+    return result
+
+
+async def mux_tracks(video: Path, audio: Optional[Path], output: Path) -> bool:
+    """Join the video and audio tracks with a single stream copy"""
+    cmd = ['ffmpeg', '-v', 'error', '-i', str(video)]
+    if audio is not None:
+        cmd += ['-i', str(audio), '-map', '0:v:0', '-map', '1:a:0']
+    cmd += ['-c', 'copy', '-movflags', '+faststart', str(output), '-y']
+    
+    returncode, _, stderr = await run_process(cmd, timeout=1800)
+    if returncode != 0:
+        logger.error(f"DASH mux failed: {stderr.decode(errors='ignore')[:200]}")
+        return False
+    return output.exists()
+
+
+async def download_dash(
+    url: str,
+    quality: str,
+    filepath: Path,
+    job_id: str,
+    token: CancelToken
+) -> Optional[str]:
+    """Download a DASH manifest natively: pick representations like yt-dlp
+    formats, fetch the tracks in parallel and mux them with stream copy.
+    
+    Returns None when the manifest is unsupported or the download fails, so
+    the caller can fall back to yt-dlp.
+    """
+    workdir = filepath.parent / 'dash'
+    workdir.mkdir(exist_ok=True)
+    # Progress keys of single-file audio tracks, kept off the dashboard
+    side_jobs = []
+    tasks = []
+    tuning = autotuner.settings(url, DASH_CONNECTIONS, HTTP_CHUNK_SIZE)
+    started = time.monotonic()
+    
+    try:
+        with download_governor.lease(job_id):
+            async with create_session(limit_per_host=tuning.connections) as session:
+                manifest = await fetch_manifest(session, url)
+                if not manifest or not manifest['formats']:
+                    return None
+                
+                spec = select_format(manifest, quality)
+                by_id = {rep['format_id']: rep for rep in manifest['formats']}
+                chosen = [by_id.get(part) for part in (spec or '').split('+')]
+                if not spec or None in chosen:
+                    # No sizes to choose by (unknown duration): let yt-dlp decide
+                    return None
+                
+                duration = manifest['duration']
+                total = int(sum(rep['tbr'] * 1000 / 8 * duration for rep in chosen))
+                counter = [0]
+                tracks = [workdir / f"track{n}.mp4" for n in range(len(chosen))]
+                logger.info(
+                    f"DASH download: {url} ({len(chosen)} tracks, "
+                    f"{sum(len(rep['segments']) for rep in chosen)} segments, ~{format_size(total)})"
+                )
+                
+                for n, (rep, path) in enumerate(zip(chosen, tracks)):
+                    if rep['init'] is None and len(rep['segments']) == 1:
+                        track_job = job_id if n == 0 else f"{job_id}:track{n}"
+                        if n:
+                            side_jobs.append(track_job)
+                        fetch = fetch_single_file(session, rep['segments'][0][0], path, track_job, token, counter)
+                    else:
+                        fetch = fetch_track(session, rep, path, job_id, token, counter, total, url, tuning)
+                    tasks.append(asyncio.create_task(fetch))
+                
+                # First failure (or cancellation) stops the other track
+                results = await asyncio.gather(*tasks)
+        
+        if token.cancelled or None in results:
+            return None
+        progress_bus.publish(job_id, 'download', max(counter[0], total), max(counter[0], total))
+        autotuner.record_transfer(url, counter[0], time.monotonic() - started, tuning)
+        
+        if not chosen[0]['vcodec'].lower().startswith(COPYABLE_VIDEO_CODECS):
+            filepath = filepath.with_suffix('.mkv')
+        if not await mux_tracks(tracks[0], tracks[1] if len(tracks) > 1 else None, filepath):
+            return None
+        
+        logger.info(f"DASH download complete: {filepath} ({format_size(filepath.stat().st_size)})")
+        return str(filepath)
+        
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"DASH download error: {e}")
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+        for side_job in side_jobs:
+            progress_bus.close(side_job)
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,106 @@
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from config import DELIVERY_DB
+from item_store import ItemStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS delivered (
+    chat_id INTEGER NOT NULL,
+    fingerprint BLOB NOT NULL,
+    delivered_at REAL NOT NULL,
+    PRIMARY KEY (chat_id, fingerprint)
+) WITHOUT ROWID;
+"""
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url: str) -> str:
+    """Spelling-independent form of a URL: lowercase scheme and host, no
+    default port or fragment, query parameters sorted"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+
+def fingerprint(item: Dict) -> bytes:
+    """16-byte identity of an item; a new URL or retitled line is a new item"""
+    title = ' '.join(item['title'].split()).casefold()
+    key = f"{normalize_url(item['url'])}\n{title}"
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+
+class DeliveryLog:
+    """Fingerprints of the items each chat has received, kept in SQLite so
+    re-sent lists can be diffed against them across restarts and workers"""
+    
+    def __init__(self, path: str = DELIVERY_DB):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+    
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread; WAL lets readers run beside a writer"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def record(self, chat_id: int, items: Iterable[Dict]):
+        """Remember items as delivered to a chat"""
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR REPLACE INTO delivered (chat_id, fingerprint, delivered_at) VALUES (?, ?, ?)",
+                [(chat_id, fingerprint(item), now) for item in items]
+            )
+    
+    def unseen(self, chat_id: int, items: ItemStore) -> Tuple[array, int]:
+        """Serials of the items a chat has not received yet, and how many of
+        the list it already has"""
+        known = {
+            row[0] for row in self._connect().execute(
+                "SELECT fingerprint FROM delivered WHERE chat_id = ?", (chat_id,)
+            )
+        }
+        new = array('I')
+        if not known:
+            new.extend(range(1, len(items) + 1))
+            return new, 0
+        
+        for serial, item in enumerate(items, 1):
+            if fingerprint(item) not in known:
+                new.append(serial)
+        return new, len(items) - len(new)
+    
+    def forget(self, chat_id: int) -> int:
+        """Drop a chat's history; returns how many items were forgotten"""
+        return self._connect().execute(
+            "DELETE FROM delivered WHERE chat_id = ?", (chat_id,)
+        ).rowcount
+
+
+_log: Optional[DeliveryLog] = None
+
+
+def get_delivery_log() -> DeliveryLog:
+    """Process-wide delivery log, opened on first use"""
+    global _log
+    if _log is None:
+        _log = DeliveryLog()
+    return _log
@@ -1,322 +1,663 @@
 import os
 import ssl
+import sys
+import json
+import time
 import asyncio
 import aiohttp
 import aiofiles
-import yt_dlp
 import logging
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, List, Union
+from urllib.parse import urlparse
 from pyrogram.types import Message
 from config import (
-    DOWNLOAD_DIR, CHUNK_SIZE, CONCURRENT_FRAGMENTS, 
+    CHUNK_SIZE, CONCURRENT_FRAGMENTS, 
     MAX_RETRIES, FRAGMENT_RETRIES, CONNECTION_TIMEOUT,
-    HTTP_CHUNK_SIZE, BUFFER_SIZE
+    HTTP_CHUNK_SIZE, BUFFER_SIZE, MAX_VIDEO_SIZE_MB, TRANSCODE_ENABLED, TRANSCODE_MAX_SOURCE_MB,
+    DIRECT_VIDEO_EXTENSIONS, DIRECT_SEGMENTS, DIRECT_SEGMENT_MIN_SIZE,
+    DIRECT_RANGE_RETRIES, HTTP_RETRIES
 )
-from utils import format_size, format_time, create_progress_bar
+from utils import format_size
+from progress import progress_bus
+from jobs import CancelToken, kill_process_tree, run_process
+from bandwidth import download_governor
+from retry import breaker_for, backoff_delay, is_retryable, status_error
+from formats import select_format
+from memory_files import MemoryFile, memory_budget
+from autotune import autotuner, Tuning
 
 logger = logging.getLogger(__name__)
 
+# Largest file worth downloading; oversize sources are fine when they get transcoded
+SOURCE_LIMIT_MB = TRANSCODE_MAX_SOURCE_MB if TRANSCODE_ENABLED else MAX_VIDEO_SIZE_MB
+
+
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': '*/*',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive'
+}
+
+# Ranged media requests must not be compressed so byte offsets line up
+MEDIA_HEADERS = dict(HTTP_HEADERS, **{'Accept-Encoding': 'identity'})
+
+DIRECT_MEDIA_CONTENT_TYPES = (
+    'video/', 'application/octet-stream', 'binary/octet-stream', 'application/mp4'
+)
+
+
+def create_session(limit_per_host: int = 30) -> aiohttp.ClientSession:
+    """Create an HTTP session tuned for large transfers"""
+    # Enhanced SSL context
+    ssl_context = ssl.create_default_context()
+    ssl_context.check_hostname = False
+    ssl_context.verify_mode = ssl.CERT_NONE
+    
+    # Optimized connector for speed
+    connector = aiohttp.TCPConnector(
+        ssl=ssl_context,
+        limit=50,  # Increased connection limit
+        limit_per_host=limit_per_host,
+        ttl_dns_cache=300,
+        force_close=False,
+        enable_cleanup_closed=True
+    )
+    
+    timeout = aiohttp.ClientTimeout(
+        total=CONNECTION_TIMEOUT,
+        connect=60,
+        sock_read=120
+    )
+    
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
 
 async def download_file(
     url: str, 
-    filename: str, 
-    progress_msg: Message, 
-    user_id: int,
-    active_downloads: Dict[int, bool]
-) -> Optional[str]:
-    """Universal file downloader with enhanced speed and progress tracking"""
-    filepath = DOWNLOAD_DIR / filename
+    filepath: Path, 
+    job_id: str, 
+    token: CancelToken,
+    session: Optional[aiohttp.ClientSession] = None,
+    in_memory: bool = False
+) -> Optional[Union[str, MemoryFile]]:
+    """Universal file downloader with retries, resume and progress tracking.
     
+    Pass a shared session to reuse its keep-alive connections across files.
+    With in_memory, a small enough file is returned as a MemoryFile named
+    after filepath instead of being written there (the caller discards it).
+    """
     try:
-        # Enhanced SSL context
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-        
-        # Optimized connector for speed
-        connector = aiohttp.TCPConnector(
-            ssl=ssl_context,
-            limit=50,  # Increased connection limit
-            limit_per_host=30,
-            ttl_dns_cache=300,
-            force_close=False,
-            enable_cleanup_closed=True
-        )
+        with download_governor.lease(job_id):
+            if session is None:
+                async with create_session() as session:
+                    return await _download_with_retries(session, url, filepath, job_id, token, in_memory)
+            return await _download_with_retries(session, url, filepath, job_id, token, in_memory)
         
-        timeout = aiohttp.ClientTimeout(
-            total=CONNECTION_TIMEOUT,
-            connect=60,
-            sock_read=120
-        )
+    except asyncio.CancelledError:
+        # Leaving the session context aborts the open response
+        if filepath.exists():
+            os.remove(filepath)
+        raise
+    except asyncio.TimeoutError:
+        logger.error(f"Download timeout for {url}")
+        return None
+    except Exception as e:
+        logger.error(f"File download error: {e}")
+        return None
+
+
+async def wait_for_host(url: str, job_id: str, token: CancelToken) -> bool:
+    """Hold a transfer while its host's circuit is open, showing it as paused"""
+    breaker = breaker_for(url)
+    if breaker.is_open:
+        progress_bus.publish(job_id, 'paused', 0, 0)
+    return await breaker.wait(token)
+
+
+async def _download_with_retries(
+    session: aiohttp.ClientSession,
+    url: str,
+    filepath: Path,
+    job_id: str,
+    token: CancelToken,
+    in_memory: bool = False
+) -> Optional[Union[str, MemoryFile]]:
+    """Run _stream_to_file under the retry policy and the host's circuit
+    breaker, resuming from the last written byte after a failure"""
+    breaker = breaker_for(url)
+    validator: List[str] = []
+    attempt = 0
+    
+    while True:
+        if not await wait_for_host(url, job_id, token):
+            logger.error(f"Host {breaker.host} still down, giving up on {url}")
+            return None
         
-        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': '*/*',
-                'Accept-Encoding': 'gzip, deflate',
-                'Connection': 'keep-alive'
-            }
+        try:
+            result = await _stream_to_file(
+                session, url, filepath, job_id, token, attempt > 0, validator, in_memory
+            )
+            breaker.record_success()
+            return result
             
-            async with session.get(url, headers=headers) as response:
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            breaker.record(e)
+            autotuner.record_error(url, e)
+            if not is_retryable(e) or attempt >= HTTP_RETRIES or token.cancelled:
+                raise
+            
+            attempt += 1
+            delay = backoff_delay(attempt, getattr(e, 'retry_after', None))
+            logger.warning(f"Download attempt {attempt} failed for {url} ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def _stream_to_file(
+    session: aiohttp.ClientSession,
+    url: str,
+    filepath: Path,
+    job_id: str,
+    token: CancelToken,
+    resume: bool = False,
+    validator: Optional[List[str]] = None,
+    in_memory: bool = False
+) -> Optional[Union[str, MemoryFile]]:
+    """GET a URL into filepath, publishing 'download' progress.
+    
+    With resume, bytes already on disk are kept and only the rest is
+    requested; validator carries the ETag/Last-Modified of the first
+    response so a changed file is fetched again from the start. With
+    in_memory, a body whose Content-Length the memory budget can take is
+    kept in a MemoryFile and never touches the disk.
+    """
+    offset = filepath.stat().st_size if resume and filepath.exists() else 0
+    # Uncompressed transfer so a resumed range lines up with the bytes on disk
+    headers = dict(MEDIA_HEADERS)
+    if offset:
+        headers['Range'] = f"bytes={offset}-"
+        if validator:
+            headers['If-Range'] = validator[0]
+    
+    async with session.get(url, headers=headers) as response:
+        if response.status == 206 and offset:
+            if not response.headers.get('content-range', '').startswith(f"bytes {offset}-"):
+                os.remove(filepath)
+                raise aiohttp.ClientPayloadError(f"Unexpected Content-Range for {url}")
+            mode = 'ab'
+        elif response.status == 200:
+            # Fresh download, or the server ignored the range: start over
+            offset = 0
+            mode = 'wb'
+        else:
+            raise status_error(response, url)
+        
+        if validator is not None and not validator:
+            tag = response.headers.get('etag') or response.headers.get('last-modified')
+            if tag and not tag.startswith('W/'):
+                validator.append(tag)
+        
+        remaining = int(response.headers.get('content-length', 0))
+        total_size = offset + remaining if remaining else 0
+        downloaded = offset
+        last_update = 0
+        update_threshold = 512 * 1024  # Publish every 512KB
+        
+        if offset:
+            logger.info(f"Resuming {url} at {format_size(offset)}")
+        
+        buffer = None
+        # A decoded body can outgrow its Content-Length, so only identity bodies qualify
+        if in_memory and not offset and response.headers.get('content-encoding', 'identity') == 'identity':
+            buffer = memory_budget.buffer(filepath.name, remaining)
+        
+        try:
+            async with (nullcontext() if buffer is not None else aiofiles.open(filepath, mode)) as f:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    if token.cancelled:
+                        raise asyncio.CancelledError()
+                    
+                    if buffer is not None:
+                        buffer.write(chunk)
+                    else:
+                        await f.write(chunk)
+                    downloaded += len(chunk)
+                    await download_governor.throttle(job_id, len(chunk))
+                    
+                    if downloaded - last_update >= update_threshold:
+                        last_update = downloaded
+                        progress_bus.publish(job_id, 'download', downloaded, total_size)
+        except BaseException:
+            if buffer is not None:
+                buffer.close()
+            raise
+        
+        progress_bus.publish(job_id, 'download', downloaded, total_size or downloaded)
+        
+        if buffer is not None:
+            if downloaded > 1024:
+                buffer.seek(0)
+                return buffer
+            buffer.close()
+            return None
+        
+        if filepath.exists() and filepath.stat().st_size > 1024:
+            return str(filepath)
+        return None
+
+
+async def detect_direct_media(url: str) -> Optional[dict]:
+    """HEAD a video URL and return size/range info if it is a plain media file"""
+    ext = os.path.splitext(urlparse(url).path)[1].lower()
+    if ext not in DIRECT_VIDEO_EXTENSIONS:
+        return None
+    
+    try:
+        async with create_session() as session:
+            async with session.head(url, headers=MEDIA_HEADERS, allow_redirects=True) as response:
                 if response.status != 200:
-                    logger.error(f"HTTP {response.status} for {url}")
                     return None
                 
-                total_size = int(response.headers.get('content-length', 0))
-                downloaded = 0
-                start_time = asyncio.get_event_loop().time()
-                last_update = 0
-                update_threshold = 512 * 1024  # Update every 512KB
+                content_type = response.headers.get('content-type', '').lower()
+                if not content_type.startswith(DIRECT_MEDIA_CONTENT_TYPES):
+                    return None
                 
-                async with aiofiles.open(filepath, 'wb') as f:
-                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
-                        if not active_downloads.get(user_id, False):
-                            if filepath.exists():
-                                os.remove(filepath)
-                            return None
+                return {
+                    'url': str(response.url),
+                    'size': int(response.headers.get('content-length', 0)),
+                    'ranges': response.headers.get('accept-ranges', '').lower() == 'bytes',
+                }
+        
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.debug(f"Direct media probe failed for {url}: {e}")
+        return None
+
+
+async def fetch_content_length(url: str, session: aiohttp.ClientSession) -> int:
+    """HEAD a URL and return its Content-Length, or 0 when unknown"""
+    try:
+        async with session.head(url, headers=HTTP_HEADERS, allow_redirects=True) as response:
+            if response.status != 200:
+                return 0
+            return int(response.headers.get('content-length', 0))
+        
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.debug(f"Size probe failed for {url}: {e}")
+        return 0
+
+async def _fetch_range(
+    session: aiohttp.ClientSession,
+    url: str,
+    filepath: Path,
+    start: int,
+    end: int,
+    counter: List[int],
+    job_id: str,
+    total: int,
+    token: CancelToken,
+    chunk_size: int = HTTP_CHUNK_SIZE
+):
+    """Download bytes start..end (inclusive) into place, resuming after drops"""
+    breaker = breaker_for(url)
+    position = start
+    attempts = 0
+    
+    while position <= end:
+        if not await wait_for_host(url, job_id, token):
+            raise IOError(f"Host {breaker.host} still down")
+        
+        headers = dict(MEDIA_HEADERS, Range=f"bytes={position}-{end}")
+        try:
+            async with session.get(url, headers=headers) as response:
+                if response.status != 206:
+                    raise status_error(response, url)
+                
+                async with aiofiles.open(filepath, 'r+b') as f:
+                    await f.seek(position)
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        if token.cancelled:
+                            raise asyncio.CancelledError()
                         
+                        chunk = chunk[:end - position + 1]
                         await f.write(chunk)
-                        downloaded += len(chunk)
+                        position += len(chunk)
+                        counter[0] += len(chunk)
+                        progress_bus.publish(job_id, 'download', counter[0], total)
+                        await download_governor.throttle(job_id, len(chunk))
                         
-                        # Update progress less frequently for speed
-                        if downloaded - last_update >= update_threshold:
-                            last_update = downloaded
-                            try:
-                                percent = (downloaded / total_size * 100) if total_size > 0 else 0
-                                elapsed = asyncio.get_event_loop().time() - start_time
-                                speed = downloaded / elapsed if elapsed > 0 else 0
-                                
-                                eta = int((total_size - downloaded) / speed) if speed > 0 else 0
-                                bar = create_progress_bar(percent)
-                                
-                                await progress_msg.edit_text(
-                                    f"📥 **Downloading...**\n\n"
-                                    f"{bar}\n\n"
-                                    f"📦 {format_size(downloaded)} / {format_size(total_size)}\n"
-                                    f"⚡ {format_size(int(speed))}/s\n"
-                                    f"⏱️ ETA: {format_time(eta)}"
-                                )
-                            except Exception as e:
-                                logger.debug(f"Progress update error: {e}")
-                
-                if filepath.exists() and filepath.stat().st_size > 1024:
-                    return str(filepath)
-                return None
-                
-    except asyncio.TimeoutError:
-        logger.error(f"Download timeout for {url}")
+                        if position > end:
+                            break
+            breaker.record_success()
+            
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            breaker.record(e)
+            autotuner.record_error(url, e)
+            attempts += 1
+            if not is_retryable(e) or attempts > DIRECT_RANGE_RETRIES:
+                raise
+            # Resume from the last written byte
+            delay = backoff_delay(attempts, getattr(e, 'retry_after', None))
+            logger.warning(f"Range {position}-{end} interrupted ({e}), resuming in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def download_direct(
+    url: str,
+    filepath: Path,
+    job_id: str,
+    token: CancelToken,
+    media: dict
+) -> Optional[str]:
+    """Download a plain media file with parallel byte ranges and resume"""
+    # Keep the real container extension (.mkv/.webm are not renamed to .mp4)
+    ext = os.path.splitext(urlparse(url).path)[1].lower()
+    filepath = filepath.with_suffix(ext)
+    total = media['size']
+    
+    if SOURCE_LIMIT_MB and total > SOURCE_LIMIT_MB * 1024 * 1024:
+        logger.error(f"Direct media too large ({format_size(total)}): {url}")
         return None
+    
+    if not media['ranges'] or total <= 0:
+        # No range support: single stream through the regular downloader
+        return await download_file(media['url'], filepath, job_id, token)
+    
+    try:
+        # Preallocate so every segment can write in place
+        async with aiofiles.open(filepath, 'wb') as f:
+            await f.truncate(total)
+        
+        tuning = autotuner.settings(media['url'], DIRECT_SEGMENTS, HTTP_CHUNK_SIZE)
+        segments = max(1, min(tuning.connections, total // DIRECT_SEGMENT_MIN_SIZE))
+        step = -(-total // segments)
+        counter = [0]
+        
+        logger.info(f"Direct download: {url} ({format_size(total)}, {segments} ranges)")
+        
+        started = time.monotonic()
+        with download_governor.lease(job_id):
+            async with create_session(limit_per_host=max(30, segments)) as session:
+                await asyncio.gather(*[
+                    _fetch_range(
+                        session, media['url'], filepath,
+                        offset, min(offset + step, total) - 1,
+                        counter, job_id, total, token, tuning.chunk_size
+                    )
+                    for offset in range(0, total, step)
+                ])
+        
+        if counter[0] != total:
+            logger.error(f"Direct download incomplete: {counter[0]}/{total} bytes")
+            os.remove(filepath)
+            return None
+        
+        # Small files use fewer ranges than tuned; the tuner skips those samples
+        autotuner.record_transfer(
+            media['url'], total, time.monotonic() - started, tuning._replace(connections=segments)
+        )
+        
+        logger.info(f"Direct download complete: {filepath}")
+        return str(filepath)
+        
+    except asyncio.CancelledError:
+        if filepath.exists():
+            os.remove(filepath)
+        raise
     except Exception as e:
-        logger.error(f"File download error: {e}")
+        logger.error(f"Direct download error: {e}")
+        if filepath.exists():
+            os.remove(filepath)
         return None
 
 
-def download_video_sync(
-    url: str, 
-    quality: str, 
-    output_path: str, 
-    user_id: int,
-    active_downloads: Dict[int, bool],
-    download_progress: Dict[int, dict]
-) -> bool:
-    """Enhanced video downloader with optimized settings"""
+YTDLP_PROGRESS_TAG = "__progress__"
+YTDLP_FILE_TAG = "__file__"
+
+
+YTDLP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-us,en;q=0.5',
+    'Sec-Fetch-Mode': 'navigate',
+}
+
+
+def _ytdlp_base_args() -> List[str]:
+    """Arguments shared by the probe and download invocations"""
+    cmd = [
+        sys.executable, '-m', 'yt_dlp',
+        '--quiet', '--no-warnings', '--no-check-certificates',
+        '--no-playlist',
+        '--extractor-retries', str(MAX_RETRIES),
+        '--socket-timeout', '120',
+    ]
+    
+    # Headers for better compatibility
+    for key, value in YTDLP_HEADERS.items():
+        cmd += ['--add-header', f'{key}:{value}']
+    return cmd
+
+
+def build_probe_command(url: str) -> List[str]:
+    """Build the yt-dlp command that dumps the extracted info as JSON"""
+    return _ytdlp_base_args() + ['--dump-single-json', url]
+
+
+def build_ytdlp_command(
+    format_spec: str,
+    info_path: str,
+    output_path: str,
+    rate_limit: int = 0,
+    tuning: Tuning = Tuning(CONCURRENT_FRAGMENTS, HTTP_CHUNK_SIZE)
+) -> List[str]:
+    """Build the yt-dlp download command line with optimized settings"""
+    cmd = _ytdlp_base_args() + [
+        '--load-info-json', info_path,
+        '--format', format_spec,
+        '--output', output_path,
+        '--merge-output-format', 'mp4',
+        
+        # Speed optimizations
+        '--concurrent-fragments', str(tuning.connections),
+        '--retries', str(MAX_RETRIES),
+        '--fragment-retries', str(FRAGMENT_RETRIES),
+        '--skip-unavailable-fragments',
+        '--buffer-size', str(BUFFER_SIZE),
+        '--http-chunk-size', str(tuning.chunk_size),
+        
+        # Fast post-processing; moov relocation is done afterwards only if needed
+        '--postprocessor-args', 'ffmpeg:-c copy',
+        
+        '--file-access-retries', str(MAX_RETRIES),
+        
+        # Additional speed settings
+        '--hls-prefer-native',
+        '--external-downloader-args', '-threads 4',
+        
+        # Machine-readable progress, one sample per line
+        '--progress', '--newline',
+        '--progress-template',
+        f'download:{YTDLP_PROGRESS_TAG} %(progress.downloaded_bytes)s '
+        f'%(progress.total_bytes)s %(progress.total_bytes_estimate)s',
+        
+        # Report the final (merged/remuxed) path instead of making us search for it
+        '--no-simulate',
+        '--print', f'after_move:{YTDLP_FILE_TAG} %(filepath)s',
+    ]
+    
+    # yt-dlp applies --limit-rate to each fragment download separately. The
+    # share is the one at process start: it does not grow or shrink as other
+    # users start or finish, so a long download keeps its initial rate
+    if rate_limit:
+        cmd += ['--limit-rate', str(max(1024, rate_limit // tuning.connections))]
+    
+    # Guard for formats whose size was unknown at selection time
+    if SOURCE_LIMIT_MB:
+        cmd += ['--max-filesize', f'{SOURCE_LIMIT_MB}M']
+    return cmd
+
+
+async def probe_video(url: str) -> Optional[dict]:
+    """Extract video info (including the format list) without downloading"""
     try:
-        def progress_hook(d):
-            if not active_downloads.get(user_id, False):
-                raise Exception("Download cancelled by user")
-            
-            if d['status'] == 'downloading':
-                try:
-                    total = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
-                    downloaded = d.get('downloaded_bytes', 0)
-                    speed = d.get('speed', 0) or 0
-                    eta = d.get('eta', 0)
-                    
-                    if total > 0:
-                        percent = (downloaded / total) * 100
-                        download_progress[user_id] = {
-                            'percent': percent,
-                            'downloaded': downloaded,
-                            'total': total,
-                            'speed': speed,
-                            'eta': eta
-                        }
-                except Exception as e:
-                    logger.debug(f"Progress hook error: {e}")
-        
-        # Optimized yt-dlp options for maximum speed
-        ydl_opts = {
-            'format': f'best[height<={quality}]/best',
-            'outtmpl': output_path,
-            'merge_output_format': 'mp4',
-            'quiet': True,
-            'no_warnings': True,
-            'nocheckcertificate': True,
-            
-            # Speed optimizations
-            'concurrent_fragment_downloads': CONCURRENT_FRAGMENTS,
-            'retries': MAX_RETRIES,
-            'fragment_retries': FRAGMENT_RETRIES,
-            'skip_unavailable_fragments': True,
-            'buffersize': BUFFER_SIZE,
-            'http_chunk_size': HTTP_CHUNK_SIZE,
-            
-            # Headers for better compatibility
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-us,en;q=0.5',
-                'Sec-Fetch-Mode': 'navigate',
-            },
-            
-            # Fast post-processing
-            'postprocessor_args': {
-                'ffmpeg': ['-c', 'copy', '-movflags', '+faststart']
-            },
-            
-            'progress_hooks': [progress_hook],
-            'extractor_retries': MAX_RETRIES,
-            'file_access_retries': MAX_RETRIES,
-            
-            # Additional speed settings
-            'socket_timeout': 120,
-            'hls_prefer_native': True,
-            'external_downloader_args': ['-threads', '4'],
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            if not active_downloads.get(user_id, False):
-                return False
-            
-            logger.info(f"Starting download: {url}")
-            ydl.download([url])
-            logger.info(f"Download completed: {url}")
-            return True
-            
-    except Exception as e:
-        logger.error(f"Video download error: {e}")
-        return False
+        returncode, stdout, stderr = await run_process(build_probe_command(url), timeout=180)
+    except asyncio.TimeoutError:
+        logger.error(f"Probe timeout for {url}")
+        return None
+    
+    if returncode != 0:
+        logger.error(f"Probe failed for {url}: {stderr.decode(errors='ignore')[:200]}")
+        return None
+    
+    try:
+        return json.loads(stdout)
+    except json.JSONDecodeError as e:
+        logger.error(f"Probe JSON error: {e}")
+        return None
 
 
-async def update_video_progress(
-    progress_msg: Message, 
-    user_id: int,
-    download_progress: Dict[int, dict],
-    active_downloads: Dict[int, bool]
-):
-    """Update video download progress with enhanced display"""
-    last_percent = -1
+def _parse_progress_line(line: str) -> Optional[tuple]:
+    """Extract (downloaded, total) from a yt-dlp progress template line"""
+    parts = line.split()
+    if len(parts) != 4 or parts[0] != YTDLP_PROGRESS_TAG:
+        return None
     
-    while active_downloads.get(user_id, False) and user_id in download_progress:
+    def to_int(value: str) -> int:
         try:
-            prog = download_progress[user_id]
-            percent = prog.get('percent', 0)
+            return int(float(value))
+        except ValueError:
+            return 0
+    
+    downloaded = to_int(parts[1])
+    total = to_int(parts[2]) or to_int(parts[3])
+    return downloaded, total
+
+
+async def run_ytdlp(cmd: List[str], job_id: str, token: CancelToken, url: Optional[str] = None) -> Optional[str]:
+    """Run yt-dlp as a killable child process, publish its progress and
+    return the output path it reports; a failure is reported to url's autotuner"""
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        start_new_session=True
+    )
+    
+    # Stop kills yt-dlp, its fragment threads and any ffmpeg it spawned
+    remove_callback = token.add_callback(lambda: kill_process_tree(proc))
+    last_error = ""
+    output_path = None
+    last_downloaded = 0
+    
+    try:
+        async for raw in proc.stdout:
+            line = raw.decode(errors='ignore').strip()
+            if line.startswith(YTDLP_FILE_TAG + ' '):
+                output_path = line[len(YTDLP_FILE_TAG) + 1:]
+                continue
             
-            # Update every 3% or significant change
-            if int(percent) - last_percent >= 3:
-                last_percent = int(percent)
-                
-                downloaded = prog.get('downloaded', 0)
-                total = prog.get('total', 0)
-                speed = prog.get('speed', 0)
-                eta = prog.get('eta', 0)
-                
-                bar = create_progress_bar(percent)
-                
-                await progress_msg.edit_text(
-                    f"🎬 **Downloading Video**\n\n"
-                    f"{bar}\n\n"
-                    f"📦 {format_size(downloaded)} / {format_size(total)}\n"
-                    f"⚡ {format_size(int(speed))}/s\n"
-                    f"⏱️ ETA: {format_time(int(eta))}"
-                )
-                
-        except Exception as e:
-            logger.debug(f"Progress update error: {e}")
+            sample = _parse_progress_line(line)
+            if sample is None:
+                if line:
+                    last_error = line
+                continue
+            
+            downloaded, total = sample
+            if total > 0:
+                progress_bus.publish(job_id, 'video', downloaded, total)
+            
+            # Counters restart for each format of a video+audio pair
+            if downloaded >= last_downloaded:
+                download_governor.charge(downloaded - last_downloaded)
+            last_downloaded = downloaded
         
-        await asyncio.sleep(2)
+        returncode = await proc.wait()
+        
+    except asyncio.CancelledError:
+        kill_process_tree(proc)
+        await proc.wait()
+        raise
+    finally:
+        remove_callback()
+    
+    if returncode != 0:
+        if not token.cancelled:
+            logger.error(f"yt-dlp exited with {returncode}: {last_error[:200]}")
+            if url:
+                autotuner.record_error_text(url, last_error)
+        return None
+    return output_path
 
 
 async def download_video(
     url: str,
     quality: str,
-    filename: str,
+    filepath: Path,
     progress_msg: Message,
-    user_id: int,
-    active_downloads: Dict[int, bool],
-    download_progress: Dict[int, dict]
+    token: CancelToken,
+    job_id: str
 ) -> Optional[str]:
     """Download video with progress tracking and error handling"""
-    temp_name = f"temp_{user_id}_{filename.replace('.mp4', '')}"
-    output_path = str(DOWNLOAD_DIR / temp_name)
+    # filepath lives in the job's scratch dir, so partials need no bookkeeping here
+    output_template = str(filepath.parent / f"{filepath.stem}.%(ext)s")
+    info_path = filepath.parent / "info.json"
     
     try:
-        download_progress[user_id] = {'percent': 0}
-        
         await progress_msg.edit_text("🎬 Initializing download...")
         
-        # Start progress updater
-        progress_task = asyncio.create_task(
-            update_video_progress(progress_msg, user_id, download_progress, active_downloads)
-        )
-        
-        # Download video in executor
-        loop = asyncio.get_event_loop()
-        success = await loop.run_in_executor(
-            None,
-            download_video_sync,
-            url, quality, output_path, user_id, active_downloads, download_progress
-        )
-        
-        # Cleanup progress
-        if user_id in download_progress:
-            del download_progress[user_id]
-        
-        try:
-            progress_task.cancel()
-        except:
-            pass
+        # yt-dlp retries on its own; only hold it while the host is known dead
+        if not await wait_for_host(url, job_id, token):
+            logger.error(f"Host still down, skipping {url}")
+            return None
         
-        if not success or not active_downloads.get(user_id, False):
+        info = await probe_video(url)
+        if not info or token.cancelled:
             return None
         
-        await progress_msg.edit_text("✅ Download complete, processing...")
+        format_spec = select_format(info, quality)
+        if not format_spec:
+            return None
         
-        # Find output file
-        possible_files = []
-        for ext in ['.mp4', '.mkv', '.webm', '.ts']:
-            p = Path(output_path + ext)
-            if p.exists() and p.stat().st_size > 10240:
-                possible_files.append(p)
+        async with aiofiles.open(info_path, 'w') as f:
+            await f.write(json.dumps(info))
         
-        # Check temp files
-        for file in DOWNLOAD_DIR.glob(f"temp_{user_id}_*"):
-            if file.is_file() and file.stat().st_size > 10240:
-                possible_files.append(file)
+        logger.info(f"Starting download: {url}")
+        tuning = autotuner.settings(url, CONCURRENT_FRAGMENTS, HTTP_CHUNK_SIZE)
+        started = time.monotonic()
+        with download_governor.lease(job_id):
+            cmd = build_ytdlp_command(
+                format_spec, str(info_path), output_template,
+                int(download_governor.share(job_id)), tuning
+            )
+            output_path = await run_ytdlp(cmd, job_id, token, url)
+        elapsed = time.monotonic() - started
         
-        if not possible_files:
-            logger.error(f"No output file found for {output_path}")
+        if not output_path or token.cancelled:
             return None
         
-        # Get largest file (most complete)
-        output_file = max(possible_files, key=lambda p: p.stat().st_size)
-        final_path = DOWNLOAD_DIR / filename
+        logger.info(f"Download completed: {url}")
+        breaker_for(url).record_success()
         
-        # Rename to final path
-        if output_file != final_path:
-            os.rename(output_file, final_path)
-        else:
-            final_path = output_file
+        await progress_msg.edit_text("✅ Download complete, processing...")
         
-        if final_path.exists() and final_path.stat().st_size > 10240:
-            logger.info(f"Video ready: {final_path} ({format_size(final_path.stat().st_size)})")
-            return str(final_path)
+        if os.path.exists(output_path) and os.path.getsize(output_path) > 10240:
+            logger.info(f"Video ready: {output_path} ({format_size(os.path.getsize(output_path))})")
+            autotuner.record_transfer(url, os.path.getsize(output_path), elapsed, tuning)
+            return output_path
         
+        logger.error(f"No usable output file for {url}")
         return None
         
     except Exception as e:
         logger.error(f"Video download error: {e}")
-        if user_id in download_progress:
-            del download_progress[user_id]
         return None
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Union
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+from pyrogram.types import Message
+from config import FANOUT_RATE
+from bandwidth import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Shared by every batch so the bot as a whole stays under Telegram's send rate
+_copy_bucket = TokenBucket(FANOUT_RATE)
+
+# Fan-out of the batch the current task belongs to (None = single destination)
+current_fanout: ContextVar[Optional['Fanout']] = ContextVar('current_fanout', default=None)
+
+
+class Fanout:
+    """Delivers a batch's uploads to extra chats by copying the sent messages.
+    
+    Each destination has its own queue and worker, so copies reach every
+    chat in upload order while destinations proceed in parallel; files are
+    uploaded once no matter how many destinations there are.
+    """
+    
+    def __init__(self, client: Client, destinations: List[int]):
+        self.client = client
+        self.queues: Dict[int, asyncio.Queue] = {chat_id: asyncio.Queue() for chat_id in destinations}
+        self.failed: Dict[int, int] = {chat_id: 0 for chat_id in destinations}
+        self.copied = 0
+        self._workers = [
+            asyncio.create_task(self._deliver(chat_id, queue))
+            for chat_id, queue in self.queues.items()
+        ]
+    
+    def submit(self, sent: Union[Message, List[Message]]):
+        """Queue a sent message (or album) for every destination"""
+        for queue in self.queues.values():
+            queue.put_nowait(sent)
+    
+    async def _deliver(self, chat_id: int, queue: asyncio.Queue):
+        while True:
+            sent = await queue.get()
+            if sent is None:
+                return
+            if await self._copy(chat_id, sent):
+                self.copied += 1
+            else:
+                self.failed[chat_id] += 1
+    
+    async def _copy(self, chat_id: int, sent: Union[Message, List[Message]]) -> bool:
+        for attempt in range(2):
+            await _copy_bucket.consume(1)
+            try:
+                if isinstance(sent, list):
+                    await self.client.copy_media_group(chat_id, sent[0].chat.id, sent[0].id)
+                else:
+                    await self.client.copy_message(chat_id, sent.chat.id, sent.id)
+                return True
+                
+            except FloodWait as e:
+                # Longer than pyrogram's sleep_threshold: wait it out once
+                logger.warning(f"Fan-out to {chat_id} flood-limited for {e.value}s")
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                logger.error(f"Fan-out to {chat_id} failed: {e}")
+                return False
+        return False
+    
+    async def close(self):
+        """Wait until every queued copy has been delivered"""
+        for queue in self.queues.values():
+            queue.put_nowait(None)
+        await asyncio.gather(*self._workers)
+    
+    def cancel(self):
+        """Drop undelivered copies (batch stopped)"""
+        for worker in self._workers:
+            worker.cancel()
+
+
+def deliver_copies(sent: Union[Message, List[Message], None]):
+    """Hand a freshly sent message to the current batch's fan-out, if any"""
+    fanout = current_fanout.get()
+    if fanout is not None and sent:
+        fanout.submit(sent)
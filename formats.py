@@ -0,0 +1,166 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+from config import MAX_VIDEO_SIZE_MB, MAX_VIDEO_BITRATE_KBPS, TRANSCODE_ENABLED, TRANSCODE_MAX_SOURCE_MB
+from utils import format_size
+
+logger = logging.getLogger(__name__)
+
+# Codecs that can be merged into MP4 with a plain stream copy
+COPYABLE_VIDEO_CODECS = ('avc1', 'h264', 'hvc1', 'hev1', 'h265')
+COPYABLE_AUDIO_CODECS = ('mp4a', 'aac', 'mp3')
+
+# Preferred upper bound for the audio track of a video+audio pair
+AUDIO_TARGET_KBPS = 160
+
+
+def _codec(fmt: Dict, key: str) -> str:
+    return (fmt.get(key) or 'none').lower()
+
+
+def _has_video(fmt: Dict) -> bool:
+    return _codec(fmt, 'vcodec') != 'none'
+
+
+def _has_audio(fmt: Dict) -> bool:
+    return _codec(fmt, 'acodec') != 'none'
+
+
+def _bitrate(fmt: Dict) -> float:
+    """Total bitrate in kbps, 0 if unknown"""
+    return float(fmt.get('tbr') or (fmt.get('vbr') or 0) + (fmt.get('abr') or 0) or 0)
+
+
+def estimate_size(fmt: Dict, duration: float) -> Optional[int]:
+    """Estimated bytes for a format, from declared size or bitrate * duration"""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return int(size)
+    
+    bitrate = _bitrate(fmt)
+    if bitrate and duration:
+        return int(bitrate * 1000 / 8 * duration)
+    return None
+
+
+def _is_copyable_pair(video: Dict, audio: Dict) -> bool:
+    vcodec = _codec(video, 'vcodec')
+    acodec = _codec(audio, 'acodec')
+    return (
+        vcodec.startswith(COPYABLE_VIDEO_CODECS)
+        and acodec.startswith(COPYABLE_AUDIO_CODECS)
+    )
+
+
+def _pick_audio(formats: List[Dict], duration: float) -> Optional[Dict]:
+    """Best audio-only format at or below the target bitrate, else the smallest.
+    
+    Only stream-copyable codecs are considered while there are any, so a
+    higher-bitrate opus track cannot crowd out the m4a that every copyable
+    video pairs with (copyability of the audio does not depend on the video).
+    """
+    audio = [f for f in formats if _has_audio(f) and not _has_video(f)]
+    if not audio:
+        return None
+    
+    copyable = [f for f in audio if _codec(f, 'acodec').startswith(COPYABLE_AUDIO_CODECS)]
+    if copyable:
+        audio = copyable
+    
+    capped = [f for f in audio if 0 < _bitrate(f) <= AUDIO_TARGET_KBPS]
+    if capped:
+        return max(capped, key=_bitrate)
+    return min(audio, key=lambda f: estimate_size(f, duration) or float('inf'))
+
+
+def _within_ceiling(size: Optional[int], bitrate: float) -> bool:
+    if MAX_VIDEO_SIZE_MB and size and size > MAX_VIDEO_SIZE_MB * 1024 * 1024:
+        return False
+    if MAX_VIDEO_BITRATE_KBPS and bitrate and bitrate > MAX_VIDEO_BITRATE_KBPS:
+        return False
+    return True
+
+
+def _candidates(info: Dict) -> Tuple[List[Tuple[int, int, str, str]], List[Tuple[int, int, str, str]]]:
+    """(height, size, format_spec, label) for every usable format or pair,
+    plus the otherwise usable formats rejected by the ceiling"""
+    formats = info.get('formats') or []
+    duration = float(info.get('duration') or 0)
+    audio = _pick_audio(formats, duration)
+    audio_size = estimate_size(audio, duration) if audio else None
+    
+    candidates = []
+    over_ceiling = []
+    for fmt in formats:
+        if not _has_video(fmt) or not fmt.get('height'):
+            continue
+        
+        size = estimate_size(fmt, duration)
+        bitrate = _bitrate(fmt)
+        
+        if _has_audio(fmt):
+            spec = str(fmt['format_id'])
+            label = f"progressive {fmt.get('ext', '?')}"
+        else:
+            if audio is None or not _is_copyable_pair(fmt, audio):
+                continue
+            if size is not None and audio_size is not None:
+                size += audio_size
+            bitrate += _bitrate(audio)
+            spec = f"{fmt['format_id']}+{audio['format_id']}"
+            label = f"{_codec(fmt, 'vcodec').split('.')[0]}+{_codec(audio, 'acodec').split('.')[0]} copy"
+        
+        if size is None:
+            continue
+        candidate = (int(fmt['height']), size, spec, label)
+        if not _within_ceiling(size, bitrate):
+            over_ceiling.append(candidate)
+            continue
+        candidates.append(candidate)
+    
+    return candidates, over_ceiling
+
+
+def fallback_format(quality: str) -> str:
+    """Format expression used when the format list has no usable sizes"""
+    # Prefer the smallest rendition rather than jumping to "best" (often 4K)
+    return f"bv*[height<={quality}]+ba/b[height<={quality}]/wv*+ba/w"
+
+
+def select_format(info: Dict, quality: str) -> Optional[str]:
+    """Choose the smallest format at the highest height not above `quality`"""
+    requested = int(quality)
+    candidates, over_ceiling = _candidates(info)
+    
+    if not candidates and over_ceiling:
+        logger.warning(
+            f"Format: all {len(over_ceiling)} formats exceed the "
+            f"{MAX_VIDEO_SIZE_MB}MB / {MAX_VIDEO_BITRATE_KBPS}kbps ceiling"
+        )
+        if not TRANSCODE_ENABLED:
+            return None
+        
+        # Download anyway and transcode down to the budget afterwards
+        candidates = [
+            c for c in over_ceiling
+            if not TRANSCODE_MAX_SOURCE_MB or c[1] <= TRANSCODE_MAX_SOURCE_MB * 1024 * 1024
+        ]
+        if not candidates:
+            return None
+    
+    if not candidates:
+        logger.info(f"Format: no sized formats, using fallback for {quality}p")
+        return fallback_format(quality)
+    
+    fitting = [c for c in candidates if c[0] <= requested]
+    if fitting:
+        height = max(c[0] for c in fitting)
+    else:
+        # Nothing at or below the request: take the lowest height offered
+        height = min(c[0] for c in candidates)
+    
+    best = min((c for c in candidates if c[0] == height), key=lambda c: c[1])
+    logger.info(
+        f"Format: {best[2]} ({best[3]}) {height}p ~{format_size(best[1])} "
+        f"for requested {quality}p ({len(candidates)} candidates)"
+    )
+    return best[2]
@@ -1,21 +1,48 @@
 import os
+import time
 import asyncio
 import aiofiles
 import logging
-from pyrogram import Client, filters
+from typing import Dict, List, Optional
+from pathlib import Path
+from pyrogram import Client, filters, enums
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from config import DOWNLOAD_DIR, QUALITY_MAP
-from utils import parse_content, sanitize_filename
-from video_processor import get_video_info, generate_thumbnail, validate_video_file
-from downloader import download_video, download_file
-from uploader import upload_video, upload_photo, upload_document
+from config import (
+    DOWNLOAD_DIR, QUALITY_MAP, BOT_MODE, QUEUE_POLL_INTERVAL, SESSION_TTL,
+    ALBUM_SIZE, ALBUM_DOCUMENTS, IMAGE_HOST_CONCURRENCY,
+    SMALL_FILE_MAX_SIZE, SMALL_FILE_CONCURRENCY, TRANSCODE_ENABLED, DASH_ENABLED,
+    FANOUT_MAX_CHATS
+)
+from utils import sanitize_filename, parse_selection, format_selection
+from item_store import ItemStore, ItemSelection
+from scheduler import schedule, probe_sizes
+from video_processor import get_video_info, generate_thumbnail, validate_video_file, ensure_faststart
+from image_processor import prepare_photo
+from transcoder import needs_transcode, transcode_to_budget
+from dash import is_dash_url, download_dash
+from downloader import (
+    download_video, download_file, detect_direct_media, download_direct,
+    create_session, fetch_content_length
+)
+from uploader import upload_video, upload_photo, upload_document, upload_media_group
+from progress import progress_bus, make_job_id, watch_progress, BatchDashboard, ItemStatus
+from jobs import CancelToken, create_scratch_dir, remove_scratch_dir, scratch_janitor
+from memory_files import discard
+from log_pipeline import current_job
+from fanout import Fanout, current_fanout
+from delivery_log import get_delivery_log
+from work_queue import get_work_queue
 
 logger = logging.getLogger(__name__)
 
 # Global state
 user_data = {}
-active_downloads = {}
-download_progress = {}
+active_jobs = {}
+fanout_targets = {}  # user_id -> extra chats every batch is copied to
+
+STOP_KB = InlineKeyboardMarkup([[
+    InlineKeyboardButton("⛔ Stop All", callback_data="stop")
+]])
 
 
 def setup_handlers(app: Client):
@@ -41,6 +68,72 @@ def setup_handlers(app: Client):
         )
     
     
+    @app.on_message(filters.command("fanout"))
+    async def fanout_cmd(client: Client, message: Message):
+        user_id = message.from_user.id
+        args = message.command[1:]
+        
+        if not args:
+            targets = fanout_targets.get(user_id)
+            await message.reply_text(
+                f"📡 **Fan-out:** {', '.join(map(str, targets))}\n\n"
+                f"Each upload is also copied there. `/fanout off` to stop."
+                if targets else
+                "📡 **Fan-out is off**\n\n"
+                "Send `/fanout <chat_id> [chat_id ...]` to also deliver every batch "
+                "to those chats (channels you administer, groups you are in; "
+                "the bot must be able to post there)."
+            )
+            return
+        
+        if args[0].lower() == 'off':
+            fanout_targets.pop(user_id, None)
+            await message.reply_text("📡 Fan-out turned off")
+            return
+        
+        if len(args) > FANOUT_MAX_CHATS:
+            await message.reply_text(f"❌ At most {FANOUT_MAX_CHATS} extra chats")
+            return
+        
+        targets, rejected, forbidden = [], [], []
+        for arg in dict.fromkeys(args):
+            try:
+                chat = await client.get_chat(int(arg) if arg.lstrip('-').isdigit() else arg)
+            except Exception as e:
+                logger.info(f"Fan-out target {arg} rejected: {e}")
+                rejected.append(arg)
+                continue
+            if await _may_fan_out_to(client, chat, user_id):
+                targets.append(chat.id)
+            else:
+                forbidden.append(arg)
+        
+        if rejected:
+            await message.reply_text(
+                f"❌ Can't reach: {', '.join(rejected)}\n"
+                f"Add the bot to those chats (as admin for channels) and try again."
+            )
+            return
+        if forbidden:
+            await message.reply_text(
+                f"❌ Not allowed: {', '.join(forbidden)}\n"
+                f"You must be a member of a group, or an admin of a channel, to deliver there."
+            )
+            return
+        
+        fanout_targets[user_id] = targets
+        await message.reply_text(f"✅ Batches will also be delivered to {len(targets)} chat(s)")
+    
+    
+    @app.on_message(filters.command("forget"))
+    async def forget_cmd(client: Client, message: Message):
+        forgotten = await asyncio.to_thread(get_delivery_log().forget, message.chat.id)
+        await message.reply_text(
+            f"🧹 Forgot {forgotten} delivered item(s)\n\n"
+            f"Re-sent lists will be treated as entirely new."
+        )
+    
+    
     @app.on_message(filters.document)
     async def handle_doc(client: Client, message: Message):
         user_id = message.from_user.id
@@ -53,12 +146,15 @@ def setup_handlers(app: Client):
         status = await message.reply_text("📥 Processing your file...")
         
         try:
-            file_path = await message.download(file_name=f"{DOWNLOAD_DIR}/{user_id}_{file_name}")
+            # Unique per upload, so a running batch never shares its list file with a newer session
+            file_path = await message.download(
+                file_name=f"{DOWNLOAD_DIR}/{user_id}_{message.id}_{file_name}"
+            )
             
             async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
                 content = await f.read()
             
-            items = parse_content(content)
+            items = ItemStore.from_text(content)
             
             if not items:
                 await status.edit_text("❌ No supported links found in file!")
@@ -66,27 +162,50 @@ def setup_handlers(app: Client):
                 return
             
             # Count by type
-            type_counts = {}
-            for item in items:
-                ftype = item['type']
-                type_counts[ftype] = type_counts.get(ftype, 0) + 1
+            type_counts = items.type_counts()
+            # Diff against what this chat already received from earlier runs
+            new_serials, seen = await asyncio.to_thread(
+                get_delivery_log().unseen, message.chat.id, items
+            )
             
-            user_data[user_id] = {'items': items, 'file_path': file_path}
+            # A replaced session's file goes now, unless its batch is still running
+            previous = user_data.get(user_id)
+            job = active_jobs.get(user_id)
+            if previous is not None and (job is None or job['session'] is not previous):
+                cleanup_user_data(user_id, previous)
             
-            kb = InlineKeyboardMarkup([
+            user_data[user_id] = {
+                'items': items,
+                'file_path': file_path,
+                'new': new_serials,
+                'touched': time.monotonic()
+            }
+            
+            buttons = [
                 [InlineKeyboardButton("📊 Select Range", callback_data="select_range")],
                 [InlineKeyboardButton("⬇️ Download All", callback_data="download_all")]
-            ])
+            ]
+            if seen and new_serials:
+                buttons.insert(0, [InlineKeyboardButton(
+                    f"🆕 Only New Items ({len(new_serials)})", callback_data="download_new"
+                )])
+            kb = InlineKeyboardMarkup(buttons)
             
             type_info = "\n".join([
                 f"{'🎬' if t == 'video' else '🖼️' if t == 'image' else '📄'} {t.title()}s: {c}" 
                 for t, c in type_counts.items()
             ])
+            rerun_info = (
+                f"🔁 Already delivered here: {seen}\n"
+                f"🆕 New or changed: {len(new_serials)}\n"
+                if seen else ""
+            )
             
             await status.edit_text(
                 f"✅ **Content Detected Successfully!**\n\n"
                 f"{type_info}\n"
-                f"📦 Total Items: {len(items)}\n\n"
+                f"📦 Total Items: {len(items)}\n"
+                f"{rerun_info}\n"
                 f"Choose your action:",
                 reply_markup=kb
             )
@@ -96,7 +215,7 @@ def setup_handlers(app: Client):
             await status.edit_text(f"❌ Error processing file: {str(e)[:100]}")
     
     
-    @app.on_callback_query(filters.regex(r"^(select_range|download_all)$"))
+    @app.on_callback_query(filters.regex(r"^(select_range|download_all|download_new)$"))
     async def range_select(client: Client, callback: CallbackQuery):
         user_id = callback.from_user.id
         action = callback.data
@@ -106,9 +225,16 @@ def setup_handlers(app: Client):
             return
         
         items = user_data[user_id]['items']
+        user_data[user_id]['touched'] = time.monotonic()
         
-        if action == "download_all":
-            user_data[user_id]['range'] = (1, len(items))
+        if action in ("download_all", "download_new"):
+            if action == "download_new":
+                selection = user_data[user_id]['new']
+                heading = f"🆕 **Downloading {len(selection)} New Items**"
+            else:
+                selection = range(1, len(items) + 1)
+                heading = f"📦 **Downloading All {len(items)} Items**"
+            user_data[user_id]['selection'] = selection
             
             kb = InlineKeyboardMarkup([
                 [
@@ -122,7 +248,7 @@ def setup_handlers(app: Client):
             ])
             
             await callback.message.edit_text(
-                f"📦 **Downloading All {len(items)} Items**\n\n"
+                f"{heading}\n\n"
                 f"🎬 Select video quality:\n"
                 f"(Images & documents process automatically)",
                 reply_markup=kb
@@ -131,70 +257,65 @@ def setup_handlers(app: Client):
             await callback.message.edit_text(
                 f"📊 **Range Selection Mode**\n\n"
                 f"Total available: {len(items)} items\n\n"
-                f"📝 Send range in format:\n"
-                f"• `start-end` (e.g., `1-10`)\n"
-                f"• `number` (e.g., `5` for single item)\n\n"
+                f"📝 Send a selection, parts separated by commas:\n"
+                f"• `start-end` (e.g., `1-10`, or `10-` to the end)\n"
+                f"• `number` (e.g., `5` for single item)\n"
+                f"• `!part` to exclude (e.g., `!7`, `!20-25`)\n\n"
                 f"**Examples:**\n"
                 f"✓ `1-50` → Items 1 to 50\n"
-                f"✓ `10-20` → Items 10 to 20\n"
+                f"✓ `1-5,9,12-20` → Items 1-5, 9 and 12-20\n"
+                f"✓ `1-100,!40-45` → 1 to 100 except 40-45\n"
                 f"✓ `15` → Only item 15\n\n"
                 f"⏳ Waiting for your input..."
             )
     
     
-    @app.on_message(filters.text & filters.private)
+    # Commands registered further down (/cancel) must not be swallowed here
+    @app.on_message(filters.text & filters.private & ~filters.regex(r"^/"))
     async def handle_range(client: Client, message: Message):
         user_id = message.from_user.id
         
-        if user_id not in user_data or 'range' in user_data[user_id]:
+        if user_id not in user_data or 'selection' in user_data[user_id]:
             return
         
         text = message.text.strip()
         items = user_data[user_id]['items']
+        user_data[user_id]['touched'] = time.monotonic()
         
         try:
-            if '-' in text:
-                start, end = map(int, text.split('-'))
-            else:
-                start = end = int(text)
-            
-            if start < 1 or end > len(items) or start > end:
-                await message.reply_text(
-                    f"❌ **Invalid Range!**\n\n"
-                    f"Valid: 1-{len(items)}\n"
-                    f"Please send correct range."
-                )
-                return
-            
-            user_data[user_id]['range'] = (start, end)
-            
-            kb = InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("360p", callback_data="q_360p"),
-                    InlineKeyboardButton("480p", callback_data="q_480p")
-                ],
-                [
-                    InlineKeyboardButton("720p ⭐", callback_data="q_720p"),
-                    InlineKeyboardButton("1080p 🔥", callback_data="q_1080p")
-                ]
-            ])
-            
-            count = end - start + 1
+            serials = parse_selection(text, len(items))
+        except ValueError as e:
             await message.reply_text(
-                f"✅ **Range Confirmed!**\n\n"
-                f"📊 Range: {start}-{end}\n"
-                f"📦 Total: {count} item(s)\n\n"
-                f"🎬 Select video quality:",
-                reply_markup=kb
-            )
-            
-        except Exception as e:
-            await message.reply_text(
-                f"❌ **Invalid Format!**\n\n"
+                f"❌ **Invalid Range!**\n\n"
+                f"{e}\n"
+                f"Valid: 1-{len(items)}\n"
                 f"Use:\n"
                 f"• `start-end` (e.g., `1-10`)\n"
-                f"• `number` (e.g., `5`)"
+                f"• `number` (e.g., `5`)\n"
+                f"• combined (e.g., `1-5,9,12-20,!3`)"
             )
+            return
+        
+        user_data[user_id]['selection'] = serials
+        
+        kb = InlineKeyboardMarkup([
+            [
+                InlineKeyboardButton("360p", callback_data="q_360p"),
+                InlineKeyboardButton("480p", callback_data="q_480p")
+            ],
+            [
+                InlineKeyboardButton("720p ⭐", callback_data="q_720p"),
+                InlineKeyboardButton("1080p 🔥", callback_data="q_1080p")
+            ]
+        ])
+        
+        await message.reply_text(
+            f"✅ **Range Confirmed!**\n\n"
+            f"📊 Items: {format_selection(serials)}\n"
+            f"📦 Total: {len(serials)} item(s)\n\n"
+            f"🎬 Select video quality:",
+            reply_markup=kb
+        )
     
     
     @app.on_callback_query(filters.regex(r"^q_"))
@@ -202,132 +323,643 @@ def setup_handlers(app: Client):
         user_id = callback.from_user.id
         quality = callback.data.split("_")[1]
         
-        if user_id not in user_data or 'range' not in user_data[user_id]:
+        if user_id not in user_data or 'selection' not in user_data[user_id]:
             await callback.answer("❌ Session expired!", show_alert=True)
             return
         
-        items = user_data[user_id]['items']
-        file_path = user_data[user_id]['file_path']
-        start, end = user_data[user_id]['range']
-        
-        selected_items = items[start-1:end]
-        active_downloads[user_id] = True
-        
-        stop_kb = InlineKeyboardMarkup([[
-            InlineKeyboardButton("⛔ Stop All", callback_data="stop")
-        ]])
-        
-        await callback.message.edit_text(
-            f"🚀 **SUPERCHARGED Batch Download Started!**\n\n"
-            f"⚡ Quality: {quality}\n"
-            f"📊 Range: {start}-{end}\n"
-            f"📦 Total: {len(selected_items)} items\n\n"
-            f"⏳ Processing at maximum speed...",
-            reply_markup=stop_kb
-        )
+        # One batch per user, so Stop and /cancel always reach everything running
+        if user_id in active_jobs:
+            await callback.answer(
+                "⏳ A batch is still running. Stop it or wait for it to finish, "
+                "then pick a quality again.",
+                show_alert=True
+            )
+            return
         
-        # Process batch
-        await process_batch(
-            client, callback.message, selected_items, 
-            quality, start, end, user_id
-        )
+        session = user_data[user_id]
+        items = session['items']
         
-        # Cleanup
-        cleanup_user_data(user_id, file_path)
+        # Serials only; items are materialized one at a time while processing
+        selected_items = ItemSelection(items, session['selection'])
+        session['touched'] = time.monotonic()
+        
+        # Registered before the first await so a second tap cannot start another batch
+        token = CancelToken()
+        task = None
+        job = active_jobs[user_id] = {'token': token, 'task': None, 'session': session}
+        
+        try:
+            await callback.message.edit_text(
+                f"🚀 **SUPERCHARGED Batch Download Started!**\n\n"
+                f"⚡ Quality: {quality}\n"
+                f"📊 Items: {format_selection(selected_items.serials)}\n"
+                f"📦 Total: {len(selected_items)} items\n"
+                f"{_fanout_line(user_id)}\n"
+                f"⏳ Processing at maximum speed...",
+                reply_markup=STOP_KB
+            )
+            if token.cancelled:
+                return
+            
+            # Process batch as its own task so Stop can cancel it mid-transfer
+            if BOT_MODE == 'coordinator':
+                task = asyncio.create_task(dispatch_batch(
+                    callback.message, selected_items, quality, user_id
+                ))
+            else:
+                task = asyncio.create_task(process_batch(
+                    client, callback.message, selected_items,
+                    quality, user_id, token, fanout_targets.get(user_id)
+                ))
+            job['task'] = task
+            await task
+        except asyncio.CancelledError:
+            if task is None or not task.cancelled():
+                raise
+            try:
+                await callback.message.reply_text("⛔ **Download stopped by user!**")
+            except Exception:
+                pass
+        finally:
+            # Cleanup (only this batch's own session and job; a list sent
+            # meanwhile has replaced them)
+            cleanup_user_data(user_id, session, job)
     
     
     @app.on_callback_query(filters.regex("^stop$"))
     async def stop_cb(client: Client, callback: CallbackQuery):
         user_id = callback.from_user.id
-        active_downloads[user_id] = False
+        await cancel_user_jobs(user_id)
         await callback.answer("⛔ Stopping all downloads...", show_alert=True)
     
     
     @app.on_message(filters.command("cancel"))
     async def cancel_cmd(client: Client, message: Message):
         user_id = message.from_user.id
-        active_downloads[user_id] = False
-        await message.reply_text("⛔ All downloads cancelled!")
+        if await cancel_user_jobs(user_id):
+            await message.reply_text("⛔ All downloads cancelled!")
+        else:
+            await message.reply_text("ℹ️ No downloads running")
+
+
+def start_background_tasks():
+    """Start periodic housekeeping; call from within the running event loop"""
+    loop = asyncio.get_running_loop()
+    loop.create_task(evict_idle_sessions())
+    loop.create_task(scratch_janitor())
+
+
+async def evict_idle_sessions():
+    """Drop parsed sessions that have been idle longer than SESSION_TTL"""
+    while True:
+        await asyncio.sleep(min(SESSION_TTL, 60))
+        now = time.monotonic()
+        
+        for user_id, session in list(user_data.items()):
+            if user_id in active_jobs:
+                continue
+            if now - session.get('touched', now) > SESSION_TTL:
+                logger.info(f"Evicting idle session of user {user_id}")
+                cleanup_user_data(user_id, session)
+
+
+async def cancel_user_jobs(user_id: int) -> bool:
+    """Abort a user's batch: kill child processes and cancel in-flight I/O;
+    returns whether there was one"""
+    job = active_jobs.get(user_id)
+    if not job:
+        return False
+    
+    job['token'].cancel()
+    if job['task'] is not None:
+        job['task'].cancel()
+    
+    if BOT_MODE == 'coordinator':
+        # Workers watch the queue flag and abort their in-flight items
+        await asyncio.to_thread(get_work_queue().cancel_user, user_id)
+    return True
 
 
 async def process_batch(
     client: Client,
     message: Message,
-    items: list,
+    items: ItemSelection,
     quality: str,
-    start: int,
-    end: int,
-    user_id: int
+    user_id: int,
+    token: CancelToken,
+    destinations: Optional[List[int]] = None
 ):
     """Process batch of downloads with enhanced speed"""
-    success = 0
-    failed = 0
+    end = max(items.serials)
+    # One live message for the whole batch instead of messages per item
+    dashboard = BatchDashboard(
+        message, quality, format_selection(items.serials), len(items), reply_markup=STOP_KB
+    )
+    refresher = asyncio.create_task(dashboard.run())
+    
+    # Small files run beside the main loop
+    small_lane = asyncio.Semaphore(SMALL_FILE_CONCURRENCY)
+    small_tasks = []
+    
+    # Uploads are copied to any extra chats as they complete; set before
+    # the small-file tasks are created so they inherit it
+    fanout = Fanout(client, destinations) if destinations else None
+    fanout_context = current_fanout.set(fanout)
+    finishing = False
     
-    for idx, item in enumerate(items, start):
-        if not active_downloads.get(user_id, False):
-            await message.reply_text("⛔ **Download stopped by user!**")
-            break
+    try:
+        # Inside the try, so a Stop during the pin still unpins and stops the refresher
+        await _set_pinned(message, True)
+        
+        # Image lane: album downloads share keep-alive connections per host
+        async with create_session(limit_per_host=IMAGE_HOST_CONCURRENCY) as image_session:
+            items, sizes = await schedule(items, image_session)
+            sizes = await probe_lane_sizes(items, image_session, sizes)
+            
+            for group in group_albums(items.numbered()):
+                if token.cancelled:
+                    break
+                
+                if len(group) > 1:
+                    sent, lost = await process_album(
+                        client, message, group, user_id, token, dashboard, image_session
+                    )
+                    dashboard.add_result(sent, lost)
+                    continue
+                
+                idx, item = group[0]
+                if item['type'] != 'video' and await is_small_file(item, image_session, sizes.get(idx)):
+                    small_tasks.append(asyncio.create_task(process_small_file(
+                        client, message, item, idx, user_id, token,
+                        dashboard, image_session, small_lane
+                    )))
+                    continue
+                
+                job_id = make_job_id(user_id, idx)
+                ok = await process_item(
+                    client, message, item, quality, idx, end, user_id, token,
+                    job_id, dashboard
+                )
+                dashboard.add_result(int(ok), int(not ok))
+                if not ok and not token.cancelled:
+                    # e.g. rejected uploads, which post no failure text themselves
+                    dashboard.add_failure(job_id, f"❌ {idx}. {item['title']}\n🔗 {item['url']}", once=True)
+            
+            await asyncio.gather(*small_tasks)
+        
+        if fanout:
+            await fanout.close()
+            for chat_id, failed in fanout.failed.items():
+                if failed:
+                    dashboard.add_failure(f"fanout:{chat_id}", f"📡 {failed} copy(ies) to {chat_id} failed")
+        
+        refresher.cancel()
+        finishing = True
+        await dashboard.finish()
+        
+    except asyncio.CancelledError:
+        # Stop or /cancel: leave the final counts and the failures so far,
+        # not a live "in progress" message
+        if not finishing:
+            refresher.cancel()
+            await dashboard.finish(stopped=True)
+        raise
         
+    finally:
+        refresher.cancel()
+        for task in small_tasks:
+            task.cancel()
+        if fanout:
+            fanout.cancel()
+        current_fanout.reset(fanout_context)
+        await _set_pinned(message, False)
+
+
+async def _may_fan_out_to(client: Client, chat, user_id: int) -> bool:
+    """Whether a user may have batches copied into a chat: channels need an
+    admin, groups a member, so the bot cannot be used to post into chats
+    the requester has no part in"""
+    if chat.type == enums.ChatType.CHANNEL:
+        allowed = (enums.ChatMemberStatus.OWNER, enums.ChatMemberStatus.ADMINISTRATOR)
+    elif chat.type in (enums.ChatType.GROUP, enums.ChatType.SUPERGROUP):
+        allowed = (
+            enums.ChatMemberStatus.OWNER, enums.ChatMemberStatus.ADMINISTRATOR,
+            enums.ChatMemberStatus.MEMBER, enums.ChatMemberStatus.RESTRICTED
+        )
+    else:
+        # Private chats and bots: nobody else's inbox
+        return False
+    
+    try:
+        member = await client.get_chat_member(chat.id, user_id)
+    except Exception as e:
+        logger.info(f"Fan-out membership check of {user_id} in {chat.id} failed: {e}")
+        return False
+    if member.status == enums.ChatMemberStatus.RESTRICTED and not member.is_member:
+        return False
+    return member.status in allowed
+
+
+def _fanout_line(user_id: int) -> str:
+    """Batch start note on where copies go ('' when fan-out is off)"""
+    targets = fanout_targets.get(user_id)
+    if not targets:
+        return ""
+    if BOT_MODE == 'coordinator':
+        return "📡 Fan-out is not available with remote workers\n"
+    return f"📡 Also delivering to {len(targets)} chat(s)\n"
+
+
+async def remember_delivered(chat_id: int, items: List[dict]):
+    """Record items a chat received so re-sent lists can skip them; a
+    database error never fails the delivery itself"""
+    if not items:
+        return
+    try:
+        await asyncio.to_thread(get_delivery_log().record, chat_id, items)
+    except Exception as e:
+        logger.warning(f"Could not record deliveries for chat {chat_id}: {e}")
+
+
+async def _set_pinned(message: Message, pinned: bool):
+    """Pin or unpin the batch dashboard, ignoring missing rights"""
+    try:
+        if pinned:
+            await message.pin(disable_notification=True)
+        else:
+            await message.unpin()
+    except Exception as e:
+        logger.debug(f"Dashboard pin error: {e}")
+
+
+async def report_failure(message: Message, prog, text: str):
+    """Post an item failure, or file it for the dashboard's final report"""
+    if isinstance(prog, ItemStatus):
+        prog.fail(text)
+        return
+    await prog.delete()
+    await message.reply_text(text)
+
+
+async def probe_lane_sizes(items: ItemSelection, session, sizes: Dict[int, int]) -> Dict[int, int]:
+    """Sizes of every lone image/document not probed yet, SIZE_PROBE_CONCURRENCY
+    HEADs at a time, so the batch loop never stops to classify an item"""
+    if not SMALL_FILE_MAX_SIZE:
+        return sizes
+    
+    missing = [
+        group[0][0] for group in group_albums(items.numbered())
+        if len(group) == 1 and group[0][1]['type'] != 'video' and group[0][0] not in sizes
+    ]
+    if missing:
+        sizes = {**sizes, **await probe_sizes(items.reordered(missing), session)}
+    return sizes
+
+
+async def is_small_file(item: dict, session, size: Optional[int] = None) -> bool:
+    """Whether an item's advertised size puts it in the small-file lane"""
+    if not SMALL_FILE_MAX_SIZE:
+        return False
+    if size is None:
+        size = await fetch_content_length(item['url'], session)
+    return 0 < size <= SMALL_FILE_MAX_SIZE
+
+
+async def process_small_file(
+    client: Client,
+    message: Message,
+    item: dict,
+    idx: int,
+    user_id: int,
+    token: CancelToken,
+    dashboard: BatchDashboard,
+    session,
+    lane: asyncio.Semaphore
+) -> bool:
+    """Download and upload a small image/document without any messages of
+    its own; the outcome only shows up on the batch dashboard"""
+    async with lane:
+        if token.cancelled:
+            return False
+        
+        job_id = make_job_id(user_id, idx)
+        workdir = create_scratch_dir(job_id)
+        status = dashboard.track(job_id, f"#{idx} {item['title'][:30]}", [job_id])
+        # Runs in its own task, so the job stays bound until the task ends
+        current_job.set(job_id)
+        caption = f"{idx}. {item['title']}"
+        ok = False
+        path = None
+        
+        try:
+            if item['type'] == 'image':
+                path = await download_file(
+                    item['url'], workdir / _item_filename(item, idx, '.jpg'), job_id, token, session,
+                    in_memory=True
+                )
+                if path:
+                    path, as_photo = await prepare_photo(path)
+                    upload = upload_photo if as_photo else upload_document
+                    ok = await upload(client, message.chat.id, path, f"🖼️ {caption}", job_id)
+            else:
+                path = await download_file(
+                    item['url'], workdir / _item_filename(item, idx, '.pdf'), job_id, token, session,
+                    in_memory=True
+                )
+                if path:
+                    ok = await upload_document(client, message.chat.id, path, f"📄 {caption}", job_id)
+            
+        except Exception as e:
+            logger.error(f"Small file {idx} error: {e}")
+            
+        finally:
+            progress_bus.close(job_id)
+            dashboard.untrack(job_id)
+            discard(path)
+            remove_scratch_dir(workdir)
+        
+        if ok:
+            await remember_delivered(message.chat.id, [item])
+        elif not token.cancelled:
+            status.fail(f"❌ {caption}\n🔗 {item['url']}")
+        dashboard.add_result(int(ok), int(not ok))
+        return ok
+
+
+ALBUM_EMOJI = {'image': "🖼️", 'document': "📄"}
+
+
+def group_albums(numbered):
+    """Yield runs of (idx, item): album-able items of one type that are
+    adjacent in run order, up to ALBUM_SIZE each, and every other item on its own"""
+    album_types = ('image', 'document') if ALBUM_DOCUMENTS else ('image',)
+    run = []
+    
+    for idx, item in numbered:
+        if run and (item['type'] != run[0][1]['type'] or len(run) == ALBUM_SIZE):
+            yield run
+            run = []
+        
+        if item['type'] in album_types:
+            run.append((idx, item))
+        else:
+            yield [(idx, item)]
+    
+    if run:
+        yield run
+
+
+async def process_album(
+    client: Client,
+    message: Message,
+    group: list,
+    user_id: int,
+    token: CancelToken,
+    dashboard: BatchDashboard,
+    session=None
+) -> tuple:
+    """Download a run of images/documents concurrently and send it as one
+    media group; returns (sent, failed)"""
+    first, last = group[0][0], group[-1][0]
+    kind = group[0][1]['type']
+    emoji = ALBUM_EMOJI[kind]
+    job_ids = [make_job_id(user_id, idx) for idx, _ in group]
+    
+    status = dashboard.track(job_ids[0], f"#{first}-{last} {emoji} album", job_ids)
+    workdir = create_scratch_dir(job_ids[0])
+    paths = []
+    normalized = {}
+    
+    try:
+        default_ext = '.jpg' if kind == 'image' else '.pdf'
+        # Small files stay in memory (within budget), the rest go to workdir
+        paths = await asyncio.gather(*[
+            download_file(
+                item['url'],
+                workdir / _item_filename(item, idx, default_ext),
+                job_id, token, session, in_memory=True
+            )
+            for (idx, item), job_id in zip(group, job_ids)
+        ])
+        
+        if token.cancelled:
+            return 0, 0
+        
+        # Images Telegram would reject as photos are fixed or sent as files up front
+        if kind == 'image':
+            ready = [path for path in paths if path]
+            normalized = dict(zip(ready, await asyncio.gather(*[prepare_photo(p) for p in ready])))
+        
+        photos = []
+        documents = []
+        missing = []
+        for (idx, item), path, job_id in zip(group, paths, job_ids):
+            if not path:
+                missing.append(_album_failure(idx, item, "download failed"))
+                continue
+            path, as_photo = normalized.get(path, (path, False))
+            entry = (path, f"{emoji} {idx}. {item['title']}", job_id)
+            (photos if as_photo else documents).append(entry)
+        
+        delivered = []
+        if photos or documents:
+            await status.edit_text(f"📤 Uploading album {first}-{last}...")
+            delivered += await _send_album(client, message.chat.id, photos, 'image')
+            delivered += await _send_album(client, message.chat.id, documents, 'document')
+        
+        for text in missing:
+            status.fail(text)
+        
+        # Downloaded but refused by Telegram, even when sent one by one
+        uploaded = set(delivered)
+        for path, _, job_id in photos + documents:
+            if job_id not in uploaded:
+                idx, item = group[job_ids.index(job_id)]
+                status.fail(_album_failure(idx, item, "upload rejected"))
+        
+        items_by_job = {job_id: item for (_, item), job_id in zip(group, job_ids)}
+        await remember_delivered(message.chat.id, [items_by_job[job_id] for job_id in delivered])
+        sent = len(delivered)
+        return sent, len(group) - sent
+        
+    except Exception as e:
+        logger.error(f"Album {first}-{last} error: {e}")
+        for idx, item in group:
+            status.fail(_album_failure(idx, item, str(e)[:100]))
+        return 0, len(group)
+        
+    finally:
+        for job_id in job_ids:
+            progress_bus.close(job_id)
+        dashboard.untrack(job_ids[0])
+        for path in [*paths, *(path for path, _ in normalized.values())]:
+            discard(path)
+        remove_scratch_dir(workdir)
+
+
+def _album_failure(idx: int, item: dict, reason: str) -> str:
+    return f"❌ {idx}. {item['title']} ({reason})\n🔗 {item['url']}"
+
+
+async def _send_album(client: Client, chat_id: int, entries: list, kind: str) -> List[str]:
+    """Send (path, caption, job_id) entries as one album; returns the job
+    IDs of the entries that arrived"""
+    if not entries:
+        return []
+    
+    files = [(path, caption) for path, caption, _ in entries]
+    if len(files) > 1 and await upload_media_group(client, chat_id, files, kind, entries[0][2]):
+        return [job_id for _, _, job_id in entries]
+    
+    # Single file, or the album was rejected: send one by one
+    upload = upload_photo if kind == 'image' else upload_document
+    sent = []
+    for path, caption, job_id in entries:
+        if await upload(client, chat_id, path, caption, job_id):
+            sent.append(job_id)
+    return sent
+
+
+async def process_item(
+    client: Client,
+    message: Message,
+    item: dict,
+    quality: str,
+    idx: int,
+    end: int,
+    user_id: int,
+    token: CancelToken,
+    job_id: Optional[str] = None,
+    dashboard: Optional[BatchDashboard] = None
+) -> bool:
+    """Download and upload one item, shown on the batch dashboard or in its
+    own progress message"""
+    job_id = job_id or make_job_id(user_id, idx)
+    watcher = None
+    
+    if dashboard is not None:
+        prog = dashboard.track(job_id, f"#{idx} {item['title'][:30]}", [job_id])
+    else:
         prog = await message.reply_text(
             f"📦 **Processing Item {idx}/{end}**\n"
             f"📝 {item['title'][:60]}..."
         )
+        watcher = asyncio.create_task(watch_progress(prog, job_id))
+    
+    workdir = create_scratch_dir(job_id)
+    log_context = current_job.set(job_id)
+    
+    try:
+        serial_caption = f"{idx}. {item['title']}"
+        ok = False
         
-        try:
-            serial_caption = f"{idx}. {item['title']}"
+        if item['type'] == 'video':
+            ok = await process_video(
+                client, message, item, quality, 
+                serial_caption, idx, prog, workdir, job_id, token
+            )
             
-            if item['type'] == 'video':
-                result = await process_video(
-                    client, message, item, quality, 
-                    serial_caption, idx, prog, user_id
-                )
-                if result:
-                    success += 1
-                else:
-                    failed += 1
-                    
-            elif item['type'] == 'image':
-                result = await process_image(
-                    client, message, item, 
-                    serial_caption, idx, prog, user_id
-                )
-                if result:
-                    success += 1
-                else:
-                    failed += 1
-                    
-            elif item['type'] == 'document':
-                result = await process_document(
-                    client, message, item,
-                    serial_caption, idx, prog, user_id
-                )
-                if result:
-                    success += 1
-                else:
-                    failed += 1
+        elif item['type'] == 'image':
+            ok = await process_image(
+                client, message, item, 
+                serial_caption, idx, prog, workdir, job_id, token
+            )
+            
+        elif item['type'] == 'document':
+            ok = await process_document(
+                client, message, item,
+                serial_caption, idx, prog, workdir, job_id, token
+            )
         
-        except Exception as e:
-            logger.error(f"Item {idx} error: {e}")
-            try:
-                await prog.delete()
-                await message.reply_text(
-                    f"❌ **Failed:** {idx}. {item['title']}\n\n🔗 {item['url']}"
-                )
-            except:
-                pass
-            failed += 1
-        
-        await asyncio.sleep(0.5)
-    
-    # Final summary
-    await message.reply_text(
-        f"✅ **Batch Processing Complete!**\n\n"
-        f"✔️ Success: {success}\n"
-        f"❌ Failed: {failed}\n"
-        f"📊 Total: {len(items)}\n"
-        f"📍 Range: {start}-{end}\n\n"
-        f"🚀 Powered by SUPERCHARGED Engine!"
+        # Workers deliver through here too, so their items are remembered as well
+        if ok:
+            await remember_delivered(message.chat.id, [item])
+        return ok
+        
+    except asyncio.CancelledError:
+        try:
+            await prog.delete()
+        except Exception:
+            pass
+        raise
+        
+    except Exception as e:
+        logger.error(f"Item {idx} error: {e}")
+        try:
+            await report_failure(
+                message, prog, f"❌ **Failed:** {idx}. {item['title']}\n\n🔗 {item['url']}"
+            )
+        except:
+            pass
+        return False
+        
+    finally:
+        current_job.reset(log_context)
+        progress_bus.close(job_id)
+        if watcher is not None:
+            watcher.cancel()
+        if dashboard is not None:
+            dashboard.untrack(job_id)
+        # Everything the item wrote (partials, thumbnail, output) goes at once
+        remove_scratch_dir(workdir)
+
+
+async def dispatch_batch(
+    message: Message,
+    items: ItemSelection,
+    quality: str,
+    user_id: int
+):
+    """Coordinator mode: enqueue the batch for workers and report their progress"""
+    queue = get_work_queue()
+    label = format_selection(items.serials)
+    # Workers claim in insertion order, so the scheduled order carries over
+    async with create_session() as session:
+        items, _ = await schedule(items, session)
+    batch_id = await asyncio.to_thread(
+        queue.enqueue_batch,
+        user_id, message.chat.id, message.id, quality, list(items.numbered())
     )
+    logger.info(f"Batch {batch_id} queued: {len(items)} items for user {user_id}")
+    
+    last_text = None
+    try:
+        while True:
+            await asyncio.sleep(QUEUE_POLL_INTERVAL)
+            status = await asyncio.to_thread(queue.batch_status, batch_id)
+            counts = status['counts']
+            pending = counts.get('queued', 0) + counts.get('claimed', 0)
+            
+            active = "\n".join(
+                f"⚙️ #{a['idx']} {a['progress'] or 'starting'}" for a in status['active'][:5]
+            )
+            text = (
+                f"🚀 **Batch Queued for Workers**\n\n"
+                f"✔️ Done: {counts.get('done', 0)}\n"
+                f"❌ Failed: {counts.get('failed', 0)}\n"
+                f"⏳ Pending: {pending}\n"
+                f"{active}"
+            )
+            if text != last_text:
+                last_text = text
+                try:
+                    await message.edit_text(text, reply_markup=STOP_KB)
+                except Exception as e:
+                    logger.debug(f"Batch status edit error: {e}")
+            
+            if pending == 0:
+                break
+        
+        await message.reply_text(
+            f"✅ **Batch Processing Complete!**\n\n"
+            f"✔️ Success: {counts.get('done', 0)}\n"
+            f"❌ Failed: {counts.get('failed', 0)}\n"
+            f"📊 Total: {len(items)}\n"
+            f"📍 Items: {label}\n\n"
+            f"🚀 Powered by SUPERCHARGED Engine!"
+        )
+    finally:
+        await asyncio.to_thread(queue.purge_batch, batch_id)
 
 
 async def process_video(
@@ -338,41 +970,66 @@ async def process_video(
     caption: str,
     idx: int,
     prog: Message,
-    user_id: int
+    workdir: Path,
+    job_id: str,
+    token: CancelToken
 ) -> bool:
     """Process video download and upload"""
+    thumb_path = str(workdir / "thumb.jpg")
+    
     try:
         q_val = QUALITY_MAP[quality]
         safe = sanitize_filename(item['title'])
         fname = f"{safe}_{idx}.mp4"
         
-        vpath = await download_video(
-            item['url'], q_val, fname, prog, 
-            user_id, active_downloads, download_progress
-        )
+        # Plain media files go through the native ranged downloader
+        vpath = None
+        direct = await detect_direct_media(item['url'])
+        if direct:
+            vpath = await download_direct(item['url'], workdir / fname, job_id, token, direct)
+        else:
+            # DASH manifests the native engine cannot handle fall back to yt-dlp
+            if DASH_ENABLED and is_dash_url(item['url']):
+                await prog.edit_text("🎬 Fetching DASH segments...")
+                vpath = await download_dash(item['url'], q_val, workdir / fname, job_id, token)
+            if not vpath and not token.cancelled:
+                vpath = await download_video(
+                    item['url'], q_val, workdir / fname, prog,
+                    token, job_id
+                )
         
-        if not vpath or not active_downloads.get(user_id, False):
-            await prog.delete()
-            await message.reply_text(f"❌ Download failed: {caption}\n🔗 {item['url']}")
+        if not vpath or token.cancelled:
+            await report_failure(message, prog, f"❌ Download failed: {caption}\n🔗 {item['url']}")
             return False
         
-        if not os.path.exists(vpath) or not validate_video_file(vpath):
-            await prog.delete()
-            await message.reply_text(f"❌ Invalid video: {caption}\n🔗 {item['url']}")
+        if not os.path.exists(vpath) or not await validate_video_file(vpath):
+            await report_failure(message, prog, f"❌ Invalid video: {caption}\n🔗 {item['url']}")
             return False
         
         # Get video info
         await prog.edit_text("🎬 Analyzing video...")
-        video_info = get_video_info(vpath)
+        video_info = await get_video_info(vpath)
+        
+        # Over the size/bitrate limits: re-encode instead of uploading as-is
+        if TRANSCODE_ENABLED and needs_transcode(vpath, video_info['duration']):
+            await prog.edit_text("⚙️ Transcoding to fit limits...")
+            transcoded = await transcode_to_budget(vpath, video_info['duration'], job_id, token)
+            if transcoded:
+                vpath = transcoded
+                video_info = await get_video_info(vpath)
+            else:
+                logger.warning(f"Transcode failed, uploading original: {vpath}")
+        
+        # Streamable upload; rewrites the file only when moov is at the end
+        await ensure_faststart(vpath, token)
         
         # Generate thumbnail with multiple attempts
-        thumb_path = str(DOWNLOAD_DIR / f"thumb_{user_id}_{idx}.jpg")
-        has_thumb = generate_thumbnail(vpath, thumb_path, video_info['duration'])
+        has_thumb = await generate_thumbnail(vpath, thumb_path, video_info['duration'])
         
         if not has_thumb:
             logger.warning(f"Thumbnail generation failed for {vpath}, retrying...")
             await asyncio.sleep(1)
-            has_thumb = generate_thumbnail(vpath, thumb_path, video_info['duration'])
+            has_thumb = await generate_thumbnail(vpath, thumb_path, video_info['duration'])
         
         # Upload
         fsize = os.path.getsize(vpath) / (1024 * 1024)
@@ -382,18 +1039,10 @@ async def process_video(
         
         upload_success = await upload_video(
             client, message.chat.id, vpath, upload_caption,
-            prog, thumb_path if has_thumb else None,
+            job_id, thumb_path if has_thumb else None,
             video_info['duration'], video_info['width'], video_info['height']
         )
         
-        # Cleanup
-        try:
-            os.remove(vpath)
-            if has_thumb and os.path.exists(thumb_path):
-                os.remove(thumb_path)
-        except:
-            pass
-        
         await prog.delete()
         return upload_success
         
@@ -409,38 +1058,32 @@ async def process_image(
     caption: str,
     idx: int,
     prog: Message,
-    user_id: int
+    workdir: Path,
+    job_id: str,
+    token: CancelToken
 ) -> bool:
     """Process image download and upload"""
     try:
-        safe = sanitize_filename(item['title'])
-        ext = os.path.splitext(item['url'])[1] or '.jpg'
-        fname = f"{safe}_{idx}{ext}"
-        
-        ipath = await download_file(item['url'], fname, prog, user_id, active_downloads)
+        ipath = await download_file(item['url'], workdir / _item_filename(item, idx, '.jpg'), job_id, token)
         
-        if not ipath or not active_downloads.get(user_id, False):
-            await prog.delete()
-            await message.reply_text(f"❌ Download failed: {caption}\n🔗 {item['url']}")
+        if not ipath or token.cancelled:
+            await report_failure(message, prog, f"❌ Download failed: {caption}\n🔗 {item['url']}")
             return False
         
         if not os.path.exists(ipath):
-            await prog.delete()
-            await message.reply_text(f"❌ File not found: {caption}")
+            await report_failure(message, prog, f"❌ File not found: {caption}")
             return False
         
         await prog.edit_text("📤 Uploading image...")
         
-        upload_success = await upload_photo(
-            client, message.chat.id, ipath, 
-            f"🖼️ {caption}", prog
+        # Oversized/odd images are re-encoded, or sent as files if they can't be photos
+        ipath, as_photo = await prepare_photo(ipath)
+        upload = upload_photo if as_photo else upload_document
+        upload_success = await upload(
+            client, message.chat.id, ipath,
+            f"🖼️ {caption}", job_id
         )
         
-        try:
-            os.remove(ipath)
-        except:
-            pass
-        
         await prog.delete()
         return upload_success
         
@@ -456,38 +1099,29 @@ async def process_document(
     caption: str,
     idx: int,
     prog: Message,
-    user_id: int
+    workdir: Path,
+    job_id: str,
+    token: CancelToken
 ) -> bool:
     """Process document download and upload"""
     try:
-        safe = sanitize_filename(item['title'])
-        ext = os.path.splitext(item['url'])[1] or '.pdf'
-        fname = f"{safe}_{idx}{ext}"
+        dpath = await download_file(item['url'], workdir / _item_filename(item, idx, '.pdf'), job_id, token)
         
-        dpath = await download_file(item['url'], fname, prog, user_id, active_downloads)
-        
-        if not dpath or not active_downloads.get(user_id, False):
-            await prog.delete()
-            await message.reply_text(f"❌ Download failed: {caption}\n🔗 {item['url']}")
+        if not dpath or token.cancelled:
+            await report_failure(message, prog, f"❌ Download failed: {caption}\n🔗 {item['url']}")
             return False
         
         if not os.path.exists(dpath):
-            await prog.delete()
-            await message.reply_text(f"❌ File not found: {caption}")
+            await report_failure(message, prog, f"❌ File not found: {caption}")
             return False
         
         await prog.edit_text("📤 Uploading document...")
         
         upload_success = await upload_document(
             client, message.chat.id, dpath,
-            f"📄 {caption}", prog
+            f"📄 {caption}", job_id
         )
         
-        try:
-            os.remove(dpath)
-        except:
-            pass
-        
         await prog.delete()
         return upload_success
         
@@ -496,26 +1130,23 @@ async def process_document(
         return False
 
 
-def cleanup_user_data(user_id: int, file_path: str):
-    """Cleanup user data and temp files"""
+def _item_filename(item: dict, idx: int, default_ext: str) -> str:
+    """Upload file name for an item: sanitized title, serial and URL extension"""
+    ext = os.path.splitext(item['url'])[1] or default_ext
+    return f"{sanitize_filename(item['title'])}_{idx}{ext}"
+
+
+def cleanup_user_data(user_id: int, session: dict, job: Optional[dict] = None):
+    """Remove a session's list file and forget it (and its batch job), unless
+    newer ones have taken their place"""
     try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        if os.path.exists(session['file_path']):
+            os.remove(session['file_path'])
     except:
         pass
     
-    # Remove temp files
-    for pattern in [f"temp_{user_id}_*", f"thumb_{user_id}_*"]:
-        for tf in DOWNLOAD_DIR.glob(pattern):
-            try:
-                os.remove(tf)
-            except:
-                pass
-    
     # Clear user data
-    if user_id in user_data:
+    if user_data.get(user_id) is session:
         del user_data[user_id]
-    if user_id in active_downloads:
-        del active_downloads[user_id]
-    if user_id in download_progress:
-        del download_progress[user_id]
+    if job is not None and active_jobs.get(user_id) is job:
+        del active_jobs[user_id]
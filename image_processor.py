@@ -0,0 +1,157 @@
+import os
+import json
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple, Union
+from config import PHOTO_MAX_SIZE, PHOTO_MAX_DIMENSIONS, PHOTO_MAX_ASPECT, PHOTO_RESIZE_SIDE
+from jobs import run_process
+from memory_files import MemoryFile, memory_budget
+
+logger = logging.getLogger(__name__)
+
+# Codecs Telegram accepts as photos without conversion
+PHOTO_CODECS = ('mjpeg', 'png')
+
+# Animated or vector formats are kept as files instead of flattened to a photo
+DOCUMENT_CODECS = ('gif', 'apng')
+
+# An image on disk, or one held in RAM (fed to ffmpeg through stdin)
+ImageSource = Union[str, MemoryFile]
+
+
+def _ffmpeg_input(source: ImageSource) -> Tuple[str, Optional[bytes]]:
+    """Input argument and stdin bytes for an ffmpeg/ffprobe command"""
+    if isinstance(source, MemoryFile):
+        return 'pipe:0', source.getvalue()
+    return source, None
+
+
+def _source_size(source: ImageSource) -> int:
+    return source.size if isinstance(source, MemoryFile) else os.path.getsize(source)
+
+
+async def probe_image(source: ImageSource) -> Optional[Dict]:
+    """Get image codec and dimensions, or None if ffprobe cannot decode it"""
+    try:
+        input_arg, data = _ffmpeg_input(source)
+        cmd = [
+            'ffprobe', '-v', 'quiet',
+            '-print_format', 'json',
+            '-show_streams', '-select_streams', 'v:0',
+            input_arg
+        ]
+        returncode, stdout, _ = await run_process(cmd, timeout=20, input=data)
+        
+        if returncode != 0:
+            return None
+        
+        streams = json.loads(stdout).get('streams', [])
+        if not streams:
+            return None
+        
+        stream = streams[0]
+        width = stream.get('width', 0)
+        height = stream.get('height', 0)
+        if width <= 0 or height <= 0:
+            return None
+        
+        return {'codec': stream.get('codec_name', ''), 'width': width, 'height': height}
+        
+    except asyncio.TimeoutError:
+        logger.error("Image probe timeout")
+        return None
+    except Exception as e:
+        logger.error(f"Image probe error: {e}")
+        return None
+
+
+def _reencode_cmd(input_arg: str, output: List[str]) -> List[str]:
+    side = PHOTO_RESIZE_SIDE
+    return [
+        'ffmpeg', '-v', 'error',
+        '-i', input_arg,
+        '-frames:v', '1',
+        '-vf', (
+            f"scale='if(gte(iw,ih),min(iw,{side}),-2)':'if(gte(iw,ih),-2,min(ih,{side}))',"
+            "format=yuvj420p"
+        ),
+        '-q:v', '3',
+        *output
+    ]
+
+
+async def _run_reencode(cmd: List[str], name: str, data: Optional[bytes] = None) -> Optional[bytes]:
+    """Run a re-encode command; its stdout, or None when it failed"""
+    try:
+        returncode, stdout, stderr = await run_process(cmd, timeout=60, input=data)
+    except asyncio.TimeoutError:
+        logger.error(f"Photo re-encode timeout: {name}")
+        return None
+    
+    if returncode != 0:
+        logger.error(f"Photo re-encode failed: {stderr.decode(errors='ignore')[:200]}")
+        return None
+    return stdout
+
+
+async def reencode_photo(filepath: str, output_path: str) -> bool:
+    """Re-encode an image to JPEG, shrinking its long side to PHOTO_RESIZE_SIDE"""
+    if await _run_reencode(_reencode_cmd(filepath, [output_path, '-y']), filepath) is None:
+        return False
+    return os.path.exists(output_path) and os.path.getsize(output_path) > 0
+
+
+async def reencode_photo_in_memory(source: MemoryFile) -> Optional[MemoryFile]:
+    """reencode_photo through pipes, for images that never touched the disk"""
+    data = await _run_reencode(
+        _reencode_cmd('pipe:0', ['-f', 'mjpeg', 'pipe:1']), source.name, source.getvalue()
+    )
+    if not data:
+        return None
+    return memory_budget.adopt(os.path.splitext(source.name)[0] + '.photo.jpg', data)
+
+
+async def prepare_photo(filepath: ImageSource) -> Tuple[ImageSource, bool]:
+    """Make a downloaded image fit Telegram's photo limits.
+    
+    Returns (path, as_photo): the original or a re-encoded JPEG to send as a
+    photo, or the original with as_photo=False when it must go as a document.
+    An in-memory original stays in memory, and is discarded when replaced.
+    """
+    info = await probe_image(filepath)
+    if info is None:
+        # SVG, animated WebP and anything else ffmpeg cannot rasterize
+        return filepath, False
+    
+    width, height = info['width'], info['height']
+    if info['codec'] in DOCUMENT_CODECS:
+        return filepath, False
+    if max(width, height) / min(width, height) > PHOTO_MAX_ASPECT:
+        # Resizing keeps the ratio, so this can never become a valid photo
+        return filepath, False
+    
+    fits = (
+        info['codec'] in PHOTO_CODECS
+        and _source_size(filepath) <= PHOTO_MAX_SIZE
+        and width + height <= PHOTO_MAX_DIMENSIONS
+    )
+    if fits:
+        return filepath, True
+    
+    if isinstance(filepath, MemoryFile):
+        photo = await reencode_photo_in_memory(filepath)
+        if photo is None:
+            return filepath, False
+        if photo.size <= PHOTO_MAX_SIZE:
+            logger.info(f"Normalized {info['codec']} {width}x{height} image for photo upload")
+            filepath.close()
+            return photo, True
+        photo.close()
+        return filepath, False
+    
+    output_path = os.path.splitext(filepath)[0] + '.photo.jpg'
+    if await reencode_photo(filepath, output_path) and os.path.getsize(output_path) <= PHOTO_MAX_SIZE:
+        logger.info(f"Normalized {info['codec']} {width}x{height} image for photo upload")
+        return output_path, True
+    
+    return filepath, False
@@ -0,0 +1,121 @@
+from array import array
+from typing import Dict, Iterator, Sequence, Tuple
+from utils import get_file_type
+
+# Interned type codes: one byte per item instead of a string reference
+TYPE_NAMES = ('video', 'image', 'document')
+TYPE_CODES = {name: code for code, name in enumerate(TYPE_NAMES)}
+
+
+class ItemStore:
+    """Parsed links kept as offsets into the original text.
+    
+    Each item costs four integers and one type byte; the title/url strings
+    and the item dicts are only built when an item is actually accessed.
+    """
+    
+    __slots__ = ('text', 'title_start', 'title_end', 'url_start', 'url_end', 'types')
+    
+    def __init__(self, text: str):
+        self.text = text
+        self.title_start = array('I')
+        self.title_end = array('I')
+        self.url_start = array('I')
+        self.url_end = array('I')
+        self.types = bytearray()
+    
+    @classmethod
+    def from_text(cls, text: str) -> 'ItemStore':
+        """Parse `Title: URL` lines and record the spans of supported links"""
+        store = cls(text)
+        pos = 0
+        length = len(text)
+        
+        while pos < length:
+            line_end = text.find('\n', pos)
+            if line_end == -1:
+                line_end = length
+            
+            colon = text.find(':', pos, line_end)
+            has_url = (
+                text.find('http://', pos, line_end) != -1
+                or text.find('https://', pos, line_end) != -1
+            )
+            if colon != -1 and has_url:
+                t_start, t_end = _strip_span(text, pos, colon)
+                u_start, u_end = _strip_span(text, colon + 1, line_end)
+                file_type = get_file_type(text[u_start:u_end])
+                
+                if file_type in TYPE_CODES:
+                    store.title_start.append(t_start)
+                    store.title_end.append(t_end)
+                    store.url_start.append(u_start)
+                    store.url_end.append(u_end)
+                    store.types.append(TYPE_CODES[file_type])
+            
+            pos = line_end + 1
+        
+        return store
+    
+    def __len__(self) -> int:
+        return len(self.types)
+    
+    def __getitem__(self, index: int) -> Dict:
+        if index < 0:
+            index += len(self)
+        return {
+            'title': self.text[self.title_start[index]:self.title_end[index]],
+            'url': self.text[self.url_start[index]:self.url_end[index]],
+            'type': TYPE_NAMES[self.types[index]],
+        }
+    
+    def __iter__(self) -> Iterator[Dict]:
+        for index in range(len(self)):
+            yield self[index]
+    
+    def type_counts(self) -> Dict[str, int]:
+        """Number of items per type, in first-seen order"""
+        counts = {}
+        for code in self.types:
+            name = TYPE_NAMES[code]
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+
+class ItemSelection:
+    """Items of an ItemStore chosen by 1-based serial, in run order.
+    
+    Serials are a range or an int array, so a selection costs at most four
+    bytes per item; items keep their original serial whatever the order.
+    """
+    
+    __slots__ = ('store', 'serials')
+    
+    def __init__(self, store: ItemStore, serials: Sequence[int]):
+        self.store = store
+        self.serials = serials
+    
+    def __len__(self) -> int:
+        return len(self.serials)
+    
+    def __iter__(self) -> Iterator[Dict]:
+        for serial in self.serials:
+            yield self.store[serial - 1]
+    
+    def numbered(self) -> Iterator[Tuple[int, Dict]]:
+        """(serial, item) pairs in run order"""
+        for serial in self.serials:
+            yield serial, self.store[serial - 1]
+    
+    def reordered(self, serials: Sequence[int]) -> 'ItemSelection':
+        """The same store with a new run order"""
+        return ItemSelection(self.store, array('I', serials))
+
+
+def _strip_span(text: str, start: int, end: int) -> tuple:
+    """Offsets of text[start:end] with surrounding whitespace removed"""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
@@ -0,0 +1,175 @@
+import os
+import time
+import shutil
+import signal
+import socket
+import asyncio
+import threading
+import logging
+from pathlib import Path
+from typing import Callable, List, Optional, Set
+from config import SCRATCH_DIR, SCRATCH_MAX_AGE, JANITOR_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class CancelToken:
+    """Cancellation flag shared by a batch's tasks, threads and child processes"""
+    
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+    
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+    
+    def cancel(self):
+        """Set the flag and run every registered abort callback once"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug(f"Cancel callback error: {e}")
+    
+    def add_callback(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Register an abort callback; returns a function that unregisters it"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                
+                def remove():
+                    with self._lock:
+                        if callback in self._callbacks:
+                            self._callbacks.remove(callback)
+                
+                return remove
+        
+        # Already cancelled: abort immediately
+        callback()
+        return lambda: None
+
+
+def kill_process_tree(proc: asyncio.subprocess.Process):
+    """Kill a child started with start_new_session=True and all its descendants"""
+    if proc.returncode is not None:
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+
+
+async def run_process(cmd: List[str], timeout: float, input: Optional[bytes] = None) -> tuple:
+    """Run a command without blocking the loop; killed on timeout or cancellation.
+    
+    input is fed to the command's stdin (e.g. ffmpeg reading pipe:0).
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE if input is not None else None,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(input), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        kill_process_tree(proc)
+        await proc.wait()
+        raise
+    return proc.returncode, stdout, stderr
+
+
+# Scratch dirs live under SCRATCH_DIR/<hostname>/<pid>-<job> so a janitor can
+# tell which process owns them, even on a volume shared by several containers
+HOST_SCRATCH_DIR = SCRATCH_DIR / socket.gethostname()
+_live_scratch: Set[Path] = set()
+
+
+def create_scratch_dir(job_id: str) -> Path:
+    """Private working directory for one job; all its files go in here"""
+    path = HOST_SCRATCH_DIR / f"{os.getpid()}-{job_id.replace(':', '_')}"
+    # Registered before mkdir so a concurrent sweep never sees it unowned
+    _live_scratch.add(path)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def remove_scratch_dir(path: Path):
+    """Delete a job's scratch directory and everything left in it"""
+    _live_scratch.discard(path)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _is_orphaned(path: Path, own_host: bool, now: float) -> bool:
+    """Whether nothing can still be using a scratch directory"""
+    try:
+        age = now - path.stat().st_mtime
+    except OSError:
+        return False
+    
+    if own_host:
+        try:
+            pid = int(path.name.split('-', 1)[0])
+        except ValueError:
+            return age > SCRATCH_MAX_AGE
+        if pid == os.getpid():
+            return path not in _live_scratch
+        if not _pid_alive(pid):
+            return True
+    
+    # Other hosts (or a recycled pid): only reclaim long-abandoned dirs
+    return age > SCRATCH_MAX_AGE
+
+
+def reclaim_orphaned_scratch() -> int:
+    """Remove scratch dirs left behind by crashed or killed processes"""
+    if not SCRATCH_DIR.exists():
+        return 0
+    
+    now = time.time()
+    removed = 0
+    for host_dir in SCRATCH_DIR.iterdir():
+        if not host_dir.is_dir():
+            continue
+        own_host = host_dir == HOST_SCRATCH_DIR
+        
+        for path in host_dir.iterdir():
+            if path.is_dir() and _is_orphaned(path, own_host, now):
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+    
+    if removed:
+        logger.info(f"🧹 Reclaimed {removed} orphaned scratch dir(s)")
+    return removed
+
+
+async def scratch_janitor():
+    """Periodically reclaim orphaned scratch space, starting immediately"""
+    while True:
+        try:
+            await asyncio.to_thread(reclaim_orphaned_scratch)
+        except Exception as e:
+            logger.error(f"Scratch janitor error: {e}")
+        await asyncio.sleep(JANITOR_INTERVAL)
@@ -0,0 +1,86 @@
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+from config import LOG_MAX_MB, LOG_BACKUPS, LOG_JSON
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Job ID of the item the current task is working on (see progress.make_job_id)
+current_job: ContextVar[Optional[str]] = ContextVar('current_job', default=None)
+
+
+class JobContextFilter(logging.Filter):
+    """Stamp records with the job ID of the task that logged them.
+    
+    Runs in the logging task itself, before the record crosses into the
+    writer thread where the context is no longer visible.
+    """
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        job_id = current_job.get()
+        record.job_id = job_id
+        if job_id:
+            parts = job_id.split(':')
+            record.user_id = parts[0]
+            record.item = parts[1] if len(parts) > 1 else None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line (tracebacks are already part of the message,
+    QueueHandler folds them in before the record is queued)"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        job_id = getattr(record, 'job_id', None)
+        if job_id:
+            entry['job_id'] = job_id
+            entry['user_id'] = record.user_id
+            entry['item'] = record.item
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging(log_file: Optional[str] = None, level: int = logging.INFO) -> logging.handlers.QueueListener:
+    """Route all logging through a queue to a writer thread.
+    
+    The root logger only gets a QueueHandler, so a log call on the event
+    loop costs a queue put; console output and the size-rotated log file
+    are written by the listener thread.
+    """
+    formatter = JsonFormatter() if LOG_JSON else logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=LOG_MAX_MB * 1024 * 1024,
+            backupCount=LOG_BACKUPS,
+            encoding='utf-8'
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.addFilter(JobContextFilter())
+    
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(listener.stop)
+    return listener
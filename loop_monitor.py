@@ -0,0 +1,167 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from config import (
+    LOOP_MONITOR_ENABLED, LOOP_STALL_THRESHOLD_MS, LOOP_MONITOR_INTERVAL, LOOP_REPORT_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+MODULE_FILE = os.path.abspath(__file__)
+REPO_DIR = os.path.dirname(MODULE_FILE)
+
+# Stack frames kept per offender in the report
+STACK_DEPTH = 6
+
+# Stalls the watchdog thread could not catch in the act (shorter than its poll)
+UNATTRIBUTED = "(not captured)"
+
+
+class LoopMonitor:
+    """Measures event-loop lag and names the code that blocks it.
+    
+    A heartbeat task wakes every LOOP_MONITOR_INTERVAL and records how late
+    it woke up. A watchdog thread notices when the heartbeat goes quiet for
+    longer than the stall threshold and captures the loop thread's stack
+    while it is still blocked, so the stall is charged to that call site.
+    """
+    
+    def __init__(self, threshold: float, interval: float):
+        self.threshold = threshold
+        self.interval = interval
+        self.beat = time.monotonic()
+        self.thread_id: Optional[int] = None
+        self.lags = deque(maxlen=int(60 / interval))  # Last minute of samples
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.offenders: Dict[str, dict] = {}
+        self._pending: Optional[Tuple[str, List[str]]] = None
+        self._lock = threading.Lock()
+    
+    def start(self):
+        """Start the heartbeat and watchdog; call from within the running event loop"""
+        self.thread_id = threading.get_ident()
+        self.beat = time.monotonic()
+        loop = asyncio.get_running_loop()
+        loop.create_task(self._heartbeat())
+        loop.create_task(self._reporter())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        logger.info(f"🩺 Event-loop monitor started (stall threshold {self.threshold * 1000:.0f}ms)")
+    
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.beat = time.monotonic()
+            self._record(lag)
+    
+    def _record(self, lag: float):
+        with self._lock:
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            pending, self._pending = self._pending, None
+            if lag < self.threshold:
+                return
+            
+            self.stalls += 1
+            key, stack = pending or (UNATTRIBUTED, [])
+            entry = self.offenders.get(key)
+            if entry is None:
+                entry = self.offenders[key] = {'count': 0, 'total': 0.0, 'max': 0.0, 'stack': stack}
+            entry['count'] += 1
+            entry['total'] += lag
+            entry['max'] = max(entry['max'], lag)
+        
+        logger.warning(f"🐢 Event loop blocked {lag * 1000:.0f}ms in {key}")
+    
+    def _watch(self):
+        """Watchdog thread: capture the loop's stack while it is blocked"""
+        poll = max(self.threshold / 4, 0.005)
+        captured_beat = None
+        
+        while True:
+            time.sleep(poll)
+            beat = self.beat
+            if beat == captured_beat or time.monotonic() - beat < self.threshold:
+                continue
+            
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            summary = traceback.extract_stack(frame)
+            del frame
+            
+            # The loop may have woken up while we were reading its stack
+            if self.beat != beat:
+                continue
+            captured_beat = beat
+            with self._lock:
+                self._pending = (_call_site(summary), _format_stack(summary))
+    
+    async def _reporter(self):
+        reported = 0
+        while True:
+            await asyncio.sleep(LOOP_REPORT_INTERVAL)
+            if self.stalls != reported:
+                reported = self.stalls
+                logger.warning(f"Event-loop report:\n{self.report(limit=5)}")
+    
+    def percentile(self, fraction: float) -> float:
+        lags = sorted(self.lags)
+        if not lags:
+            return 0.0
+        return lags[min(len(lags) - 1, int(len(lags) * fraction))]
+    
+    def report(self, limit: int = 10) -> str:
+        """Plain-text lag summary and worst offenders by total blocked time"""
+        with self._lock:
+            offenders = sorted(self.offenders.items(), key=lambda item: item[1]['total'], reverse=True)
+            lines = [
+                f"Loop lag (last minute): p50 {self.percentile(0.5) * 1000:.1f}ms | "
+                f"p99 {self.percentile(0.99) * 1000:.1f}ms | max ever {self.max_lag * 1000:.0f}ms",
+                f"Stalls over {self.threshold * 1000:.0f}ms: {self.stalls}",
+            ]
+            for key, entry in offenders[:limit]:
+                lines.append("")
+                lines.append(
+                    f"{entry['total'] * 1000:.0f}ms total, {entry['count']}x, "
+                    f"max {entry['max'] * 1000:.0f}ms — {key}"
+                )
+                lines += [f"    {line}" for line in entry['stack']]
+        return "\n".join(lines)
+
+
+def _call_site(summary: traceback.StackSummary) -> str:
+    """Innermost frame in our own code, where a fix would go"""
+    for frame in reversed(summary):
+        if frame.filename.startswith(REPO_DIR) and frame.filename != MODULE_FILE:
+            return f"{os.path.basename(frame.filename)}:{frame.lineno} {frame.name}"
+    frame = summary[-1]
+    return f"{frame.filename}:{frame.lineno} {frame.name}"
+
+
+def _format_stack(summary: traceback.StackSummary) -> List[str]:
+    lines = []
+    for frame in summary[-STACK_DEPTH:]:
+        filename = frame.filename
+        if filename.startswith(REPO_DIR):
+            filename = os.path.relpath(filename, REPO_DIR)
+        lines.append(f"{filename}:{frame.lineno} {frame.name}: {frame.line or ''}".rstrip())
+    return lines
+
+
+loop_monitor = LoopMonitor(LOOP_STALL_THRESHOLD_MS / 1000, LOOP_MONITOR_INTERVAL)
+
+
+def start_loop_monitor():
+    """Start the global monitor if enabled; call from within the running event loop"""
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
@@ -1,29 +1,18 @@
+import sys
+import asyncio
 import logging
+import importlib
 from aiohttp import web
-from pyrogram import Client, idle
-from config import API_ID, API_HASH, BOT_TOKEN, PORT
-from handlers import setup_handlers
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('bot.log')
-    ]
-)
-logger = logging.getLogger(__name__)
+from config import API_ID, API_HASH, BOT_TOKEN, PORT, BOT_MODE, WORKER_COUNT, LOG_FILE
+from log_pipeline import setup_logging
+from loop_monitor import loop_monitor, start_loop_monitor
+
+# pyrogram, handlers and the download stack are imported by warm_up() once the
+# health endpoint is already listening, so slow imports never fail HEALTHCHECK
 
-# Initialize bot client
-app = Client(
-    "m3u8_supercharged_bot",
-    api_id=API_ID,
-    api_hash=API_HASH,
-    bot_token=BOT_TOKEN,
-    workers=8,  # Increased workers for parallel processing
-    sleep_threshold=60
-)
+# Configure logging (console + rotated file, written off the event loop)
+setup_logging(LOG_FILE)
+logger = logging.getLogger(__name__)
 
 # Web server for health checks
 web_app = web.Application()
@@ -34,23 +23,83 @@ async def health_check(request):
 async def stats(request):
     return web.Response(text="M3U8 Bot - Enhanced Speed & Progress Tracking")
 
+async def loop_report(request):
+    return web.Response(text=loop_monitor.report())
+
 web_app.router.add_get("/", health_check)
 web_app.router.add_get("/health", health_check)
 web_app.router.add_get("/stats", stats)
+web_app.router.add_get("/loop", loop_report)
+
+
+def _import_for_loop(name: str, loop: asyncio.AbstractEventLoop):
+    """Import a module in a worker thread that sees loop as its event loop;
+    pyrogram.sync captures asyncio.get_event_loop() at import time"""
+    asyncio.set_event_loop(loop)
+    try:
+        return importlib.import_module(name)
+    finally:
+        asyncio.set_event_loop(None)
+
+
+async def warm_up():
+    """Import the heavy modules off the event loop"""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    # Let the health server take its first requests before the imports start
+    await asyncio.sleep(0)
+    
+    pyrogram = await asyncio.to_thread(_import_for_loop, "pyrogram", loop)
+    handlers = await asyncio.to_thread(_import_for_loop, "handlers", loop)
+    
+    logger.info(f"🔥 Warm-up imports done in {loop.time() - started:.2f}s")
+    return pyrogram, handlers
+
+
+async def start_local_workers() -> list:
+    """Coordinator mode: spawn worker processes sharing this container's queue"""
+    workers = []
+    for n in range(WORKER_COUNT):
+        proc = await asyncio.create_subprocess_exec(sys.executable, "-u", "worker.py", str(n))
+        workers.append(proc)
+    if workers:
+        logger.info(f"🛠️ Started {len(workers)} local worker(s)")
+    return workers
 
 
 async def main():
     """Main bot initialization"""
+    workers = []
+    app = None
     try:
-        # Start web server
+        # Start web server first so health checks pass during warm-up
         runner = web.AppRunner(web_app)
         await runner.setup()
         site = web.TCPSite(runner, "0.0.0.0", PORT)
         await site.start()
         logger.info(f"✅ Web server started on port {PORT}")
         
+        # Started before warm-up so slow startup work shows up too
+        start_loop_monitor()
+        
+        pyrogram, handlers = await warm_up()
+        
+        # Initialize bot client
+        app = pyrogram.Client(
+            "m3u8_supercharged_bot",
+            api_id=API_ID,
+            api_hash=API_HASH,
+            bot_token=BOT_TOKEN,
+            workers=8,  # Increased workers for parallel processing
+            sleep_threshold=60
+        )
+        
         # Setup bot handlers
-        setup_handlers(app)
+        handlers.setup_handlers(app)
+        handlers.start_background_tasks()
+        
+        if BOT_MODE == 'coordinator':
+            workers = await start_local_workers()
         
         # Start bot
         await app.start()
@@ -58,15 +107,19 @@ async def main():
         logger.info("⚡ Features: 3-4x Speed, Upload Progress, Enhanced Thumbnails")
         
         # Keep bot running
-        await idle()
+        await pyrogram.idle()
         
     except Exception as e:
         logger.error(f"Bot startup error: {e}")
         raise
     finally:
+        for proc in workers:
+            if proc.returncode is None:
+                proc.terminate()
         try:
-            await app.stop()
-            logger.info("Bot stopped")
+            if app is not None:
+                await app.stop()
+                logger.info("Bot stopped")
         except:
             pass
 
@@ -78,7 +131,7 @@ if __name__ == "__main__":
     logger.info("=" * 60)
     
     try:
-        app.run(main())
+        asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
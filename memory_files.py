@@ -0,0 +1,66 @@
+import io
+from typing import Optional
+from config import MEMORY_FILE_MAX_SIZE, MEMORY_BUDGET
+
+
+class MemoryFile(io.BytesIO):
+    """A downloaded file held in RAM.
+    
+    Pyrogram uploads it like a path (it takes the file name from .name);
+    close() hands its bytes back to the budget.
+    """
+    
+    def __init__(self, name: str, reserved: int, budget: 'MemoryBudget'):
+        super().__init__()
+        self.name = name
+        self._reserved = reserved
+        self._budget = budget
+    
+    @property
+    def size(self) -> int:
+        with self.getbuffer() as view:
+            return view.nbytes
+    
+    def close(self):
+        if self._reserved:
+            self._budget.release(self._reserved)
+            self._reserved = 0
+        super().close()
+
+
+class MemoryBudget:
+    """Caps the bytes of all in-memory files together; a file that does not
+    fit is simply written to disk instead, so nobody ever waits for room"""
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.used = 0
+    
+    def buffer(self, name: str, size: int) -> Optional[MemoryFile]:
+        """Empty in-memory file with size bytes reserved, or None when the size
+        is unknown, over MEMORY_FILE_MAX_SIZE or the budget is spent"""
+        if not 0 < size <= MEMORY_FILE_MAX_SIZE or self.used + size > self.capacity:
+            return None
+        self.used += size
+        return MemoryFile(name, size, self)
+    
+    def adopt(self, name: str, data: bytes) -> MemoryFile:
+        """Wrap bytes that are already in memory (e.g. ffmpeg output); they
+        are counted even past the budget"""
+        self.used += len(data)
+        memory_file = MemoryFile(name, len(data), self)
+        memory_file.write(data)
+        memory_file.seek(0)
+        return memory_file
+    
+    def release(self, size: int):
+        self.used -= size
+
+
+memory_budget = MemoryBudget(MEMORY_BUDGET)
+
+
+def discard(source):
+    """Free an in-memory file; paths are left to their scratch directory"""
+    if isinstance(source, MemoryFile):
+        source.close()
@@ -0,0 +1,332 @@
+import asyncio
+import itertools
+import logging
+from typing import Dict, List, Optional, AsyncIterator
+from pyrogram.types import Message
+from utils import format_size, format_time, create_progress_bar
+from config import DASHBOARD_INTERVAL, DASHBOARD_MAX_ACTIVE
+
+logger = logging.getLogger(__name__)
+
+# EWMA smoothing factor for speed samples (higher reacts faster)
+SPEED_ALPHA = 0.3
+# Minimum time between two speed samples so tiny chunks don't add noise
+SPEED_MIN_INTERVAL = 0.5
+
+STAGE_HEADERS = {
+    'download': "📥 **Downloading...**",
+    'video': "🎬 **Downloading Video**",
+    'upload': "📤 **Uploading...**",
+    'transcode': "⚙️ **Transcoding...**",
+    'paused': "⏸️ **Host unavailable, waiting...**",
+}
+
+STAGE_ICONS = {
+    'download': "📥",
+    'video': "🎬",
+    'upload': "📤",
+    'transcode': "⚙️",
+    'paused': "⏸️",
+}
+
+# Telegram rejects messages longer than 4096 characters
+MESSAGE_LIMIT = 4000
+
+_job_counter = itertools.count(1)
+
+
+def make_job_id(user_id: int, idx: int) -> str:
+    """Create a unique progress key for one item of one user's batch"""
+    return f"{user_id}:{idx}:{next(_job_counter)}"
+
+
+class SpeedEstimator:
+    """Exponentially weighted moving average of transfer speed"""
+    
+    def __init__(self, alpha: float = SPEED_ALPHA):
+        self.alpha = alpha
+        self.speed = 0.0
+        self.last_bytes = 0
+        self.last_time: Optional[float] = None
+    
+    def update(self, current: int, now: float) -> float:
+        """Feed a cumulative byte count and return the smoothed speed"""
+        if self.last_time is None or current < self.last_bytes:
+            self.last_time = now
+            self.last_bytes = current
+            return self.speed
+        
+        elapsed = now - self.last_time
+        if elapsed < SPEED_MIN_INTERVAL:
+            return self.speed
+        
+        instant = (current - self.last_bytes) / elapsed
+        if self.speed <= 0:
+            self.speed = instant
+        else:
+            self.speed = self.alpha * instant + (1 - self.alpha) * self.speed
+        
+        self.last_time = now
+        self.last_bytes = current
+        return self.speed
+
+
+class ProgressBus:
+    """Job-keyed progress pub/sub; subscribers only wake when a sample changes"""
+    
+    def __init__(self):
+        self._state: Dict[str, dict] = {}
+        self._estimators: Dict[str, SpeedEstimator] = {}
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+    
+    def publish(self, job_id: str, stage: str, current: int, total: int):
+        """Record a progress sample and notify subscribers (event loop only)"""
+        now = asyncio.get_running_loop().time()
+        
+        prev = self._state.get(job_id)
+        if prev is None or prev['stage'] != stage:
+            self._estimators[job_id] = SpeedEstimator()
+        elif prev['current'] == current and prev['total'] == total:
+            return
+        
+        speed = self._estimators[job_id].update(current, now)
+        remaining = max(total - current, 0)
+        eta = int(remaining / speed) if speed > 0 and total > 0 else 0
+        percent = (current / total * 100) if total > 0 else 0
+        
+        sample = {
+            'job_id': job_id,
+            'stage': stage,
+            'current': current,
+            'total': total,
+            'percent': min(percent, 100.0),
+            'speed': speed,
+            'eta': eta,
+        }
+        self._state[job_id] = sample
+        
+        for queue in self._subscribers.get(job_id, []):
+            _put_latest(queue, sample)
+    
+    def get(self, job_id: str) -> Optional[dict]:
+        """Return the latest sample for a job"""
+        return self._state.get(job_id)
+    
+    async def subscribe(self, job_id: str) -> AsyncIterator[dict]:
+        """Yield samples for a job as they change until the job is closed"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._subscribers.setdefault(job_id, []).append(queue)
+        
+        current = self._state.get(job_id)
+        if current is not None:
+            _put_latest(queue, current)
+        
+        try:
+            while True:
+                sample = await queue.get()
+                if sample is None:
+                    return
+                yield sample
+        finally:
+            subs = self._subscribers.get(job_id)
+            if subs and queue in subs:
+                subs.remove(queue)
+                if not subs:
+                    del self._subscribers[job_id]
+    
+    def close(self, job_id: str):
+        """Finish a job: wake subscribers with a sentinel and drop its state"""
+        self._state.pop(job_id, None)
+        self._estimators.pop(job_id, None)
+        for queue in self._subscribers.get(job_id, []):
+            _put_latest(queue, None)
+
+
+def _put_latest(queue: asyncio.Queue, item):
+    """Replace whatever is pending so slow subscribers only see the newest sample"""
+    if queue.full():
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+    queue.put_nowait(item)
+
+
+progress_bus = ProgressBus()
+
+
+async def watch_progress(
+    progress_msg: Message,
+    job_id: str,
+    min_step: float = 3.0,
+    min_interval: float = 2.0
+):
+    """Render a job's progress samples into a Telegram message"""
+    last_stage = None
+    last_percent = -100.0
+    last_edit = 0.0
+    loop = asyncio.get_running_loop()
+    
+    async for sample in progress_bus.subscribe(job_id):
+        try:
+            stage = sample['stage']
+            percent = sample['percent']
+            now = loop.time()
+            
+            if stage == last_stage:
+                if percent - last_percent < min_step or now - last_edit < min_interval:
+                    continue
+            
+            last_stage = stage
+            last_percent = percent
+            last_edit = now
+            
+            header = STAGE_HEADERS.get(stage, "⏳ **Working...**")
+            bar = create_progress_bar(percent)
+            
+            await progress_msg.edit_text(
+                f"{header}\n\n"
+                f"{bar}\n\n"
+                f"📦 {format_size(sample['current'])} / {format_size(sample['total'])}\n"
+                f"⚡ {format_size(int(sample['speed']))}/s\n"
+                f"⏱️ ETA: {format_time(sample['eta'])}"
+            )
+        except Exception as e:
+            logger.debug(f"Progress render error: {e}")
+
+
+class ItemStatus:
+    """Stand-in for a per-item progress message when a batch has a dashboard.
+    
+    edit_text() only records the status line and delete() does nothing, so
+    the item code runs unchanged without any API calls of its own.
+    """
+    
+    def __init__(self, dashboard: 'BatchDashboard', key: str):
+        self.dashboard = dashboard
+        self.key = key
+    
+    async def edit_text(self, text: str, **kwargs):
+        line = text.strip().split('\n', 1)[0].replace('**', '')
+        entry = self.dashboard.active.get(self.key)
+        if entry is not None:
+            entry['status'] = line
+    
+    async def delete(self):
+        pass
+    
+    def fail(self, text: str):
+        """File a failure for the final report instead of posting it"""
+        self.dashboard.add_failure(self.key, text)
+
+
+class BatchDashboard:
+    """One live message per batch: overall progress, active items, throughput
+    and running counts, refreshed on a fixed cadence"""
+    
+    def __init__(self, message: Message, quality: str, selection: str, total: int, reply_markup=None):
+        self.message = message
+        self.quality = quality
+        self.selection = selection
+        self.total = total
+        self.reply_markup = reply_markup
+        self.success = 0
+        self.failed = 0
+        self.failures: List[str] = []
+        self._reported = set()
+        self.active: Dict[str, dict] = {}
+        self.started = asyncio.get_running_loop().time()
+        self._last_text = None
+    
+    def track(self, key: str, label: str, job_ids: List[str]) -> ItemStatus:
+        """Show an item (or album) as active; its job IDs feed the stage column"""
+        self.active[key] = {'label': label, 'status': "⏳ Starting", 'job_ids': job_ids}
+        return ItemStatus(self, key)
+    
+    def untrack(self, key: str):
+        self.active.pop(key, None)
+    
+    def add_failure(self, key: str, text: str, once: bool = False):
+        """Queue a line for the final report; once=True skips keys already reported"""
+        if once and key in self._reported:
+            return
+        self._reported.add(key)
+        self.failures.append(text)
+    
+    def add_result(self, success: int, failed: int):
+        self.success += success
+        self.failed += failed
+    
+    def _render_active(self, entry: dict) -> str:
+        samples = [progress_bus.get(job_id) for job_id in entry['job_ids']]
+        samples = [sample for sample in samples if sample]
+        if not samples:
+            return f"• {entry['label']} — {entry['status']}"
+        
+        sample = max(samples, key=lambda s: s['speed'])
+        icon = STAGE_ICONS.get(sample['stage'], "⏳")
+        return f"• {entry['label']} — {icon} {sample['percent']:.0f}% ⚡ {format_size(int(sample['speed']))}/s"
+    
+    def render(self, header: str = "🚀 **Batch in Progress**") -> str:
+        finished = self.success + self.failed
+        percent = finished / self.total * 100 if self.total else 100.0
+        elapsed = int(asyncio.get_running_loop().time() - self.started)
+        throughput = sum(
+            sample['speed']
+            for entry in self.active.values()
+            for sample in map(progress_bus.get, entry['job_ids'])
+            if sample
+        )
+        
+        lines = [
+            f"{header}\n",
+            f"{create_progress_bar(percent)}\n",
+            f"✔️ Success: {self.success} | ❌ Failed: {self.failed} | 📊 Total: {self.total}",
+            f"📍 Items: {self.selection} | 🎬 {self.quality}",
+            f"⚡ Throughput: {format_size(int(throughput))}/s | ⏱️ {format_time(elapsed)}",
+        ]
+        
+        if self.active:
+            lines.append("")
+            entries = list(self.active.values())
+            lines += [self._render_active(entry) for entry in entries[:DASHBOARD_MAX_ACTIVE]]
+            if len(entries) > DASHBOARD_MAX_ACTIVE:
+                lines.append(f"… and {len(entries) - DASHBOARD_MAX_ACTIVE} more")
+        
+        return "\n".join(lines)[:MESSAGE_LIMIT]
+    
+    async def refresh(self, text: Optional[str] = None, reply_markup=None):
+        """Edit the dashboard message if its text changed"""
+        text = text or self.render()
+        if text == self._last_text:
+            return
+        self._last_text = text
+        try:
+            await self.message.edit_text(text, reply_markup=reply_markup)
+        except Exception as e:
+            logger.debug(f"Dashboard edit error: {e}")
+    
+    async def run(self):
+        """Refresh every DASHBOARD_INTERVAL seconds until cancelled"""
+        while True:
+            await self.refresh(reply_markup=self.reply_markup)
+            await asyncio.sleep(DASHBOARD_INTERVAL)
+    
+    async def finish(self, stopped: bool = False):
+        """Final dashboard state plus one report listing every failure"""
+        self.active.clear()
+        header = "⛔ **Batch Stopped**" if stopped else "✅ **Batch Processing Complete!**"
+        await self.refresh(self.render(header))
+        
+        if not self.failures:
+            return
+        
+        # Split the report at item boundaries so no message exceeds the limit
+        chunk = "❌ **Failed Items**\n"
+        for failure in self.failures:
+            failure = failure[:MESSAGE_LIMIT - 100]
+            if len(chunk) + len(failure) + 2 > MESSAGE_LIMIT:
+                await self.message.reply_text(chunk)
+                chunk = ""
+            chunk += f"\n{failure}\n"
+        await self.message.reply_text(chunk)
@@ -0,0 +1,176 @@
+import time
+import random
+import asyncio
+import logging
+import aiohttp
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlparse
+from config import (
+    RETRY_BASE_DELAY, RETRY_MAX_DELAY,
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN, CIRCUIT_MAX_COOLDOWN, CIRCUIT_MAX_WAIT
+)
+from jobs import CancelToken
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth another attempt; every other 4xx is final
+RETRYABLE_STATUSES = (408, 425, 429)
+
+# A half-open probe that never reports back frees the slot after this long
+PROBE_TIMEOUT = 120
+
+
+class HttpStatusError(IOError):
+    """Unexpected HTTP status, carrying the server's Retry-After hint"""
+    
+    def __init__(self, status: int, url: str, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status} for {url}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def status_error(response: aiohttp.ClientResponse, url: str) -> HttpStatusError:
+    """Build the error for an unexpected response"""
+    return HttpStatusError(
+        response.status, url, parse_retry_after(response.headers.get('retry-after'))
+    )
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether another attempt could succeed: 5xx, 408/425/429, resets, timeouts"""
+    if isinstance(error, HttpStatusError):
+        return error.status >= 500 or error.status in RETRYABLE_STATUSES
+    return isinstance(error, (
+        aiohttp.ClientConnectionError,
+        aiohttp.ClientPayloadError,
+        asyncio.TimeoutError,
+        ConnectionError,
+    ))
+
+
+def is_host_failure(error: BaseException) -> bool:
+    """Whether an error says the host itself is down (counts toward its breaker)"""
+    if isinstance(error, HttpStatusError):
+        return error.status >= 500
+    return is_retryable(error)
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Exponential backoff with full jitter; Retry-After wins when given"""
+    if retry_after is not None:
+        return min(retry_after, CIRCUIT_MAX_COOLDOWN)
+    ceiling = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+    return random.uniform(RETRY_BASE_DELAY, max(RETRY_BASE_DELAY, ceiling))
+
+
+class CircuitBreaker:
+    """Failure tracker for one host.
+    
+    After CIRCUIT_FAILURE_THRESHOLD consecutive host failures the circuit
+    opens and every transfer to the host waits instead of failing. Once the
+    cooldown passes, one probe request is let through: success closes the
+    circuit, failure reopens it with a doubled cooldown.
+    """
+    
+    def __init__(self, host: str):
+        self.host = host
+        self.failures = 0
+        self.cooldown = CIRCUIT_COOLDOWN
+        self.open_until = 0.0
+        self.probe_started = 0.0
+    
+    @property
+    def is_open(self) -> bool:
+        return self.failures >= CIRCUIT_FAILURE_THRESHOLD or self.open_until > time.monotonic()
+    
+    def _try_pass(self) -> bool:
+        now = time.monotonic()
+        if now < self.open_until:
+            return False
+        if self.failures < CIRCUIT_FAILURE_THRESHOLD:
+            return True
+        # Half-open: a single probe at a time
+        if now - self.probe_started < PROBE_TIMEOUT:
+            return False
+        self.probe_started = now
+        return True
+    
+    async def wait(self, token: Optional[CancelToken] = None) -> bool:
+        """Wait until requests to the host are allowed; False after
+        CIRCUIT_MAX_WAIT seconds of the host staying down"""
+        deadline = time.monotonic() + CIRCUIT_MAX_WAIT
+        while not self._try_pass():
+            if token is not None and token.cancelled:
+                raise asyncio.CancelledError()
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(1)
+        return True
+    
+    def hold(self, seconds: float):
+        """Pause the whole host, e.g. for a 429 Retry-After"""
+        self.open_until = max(self.open_until, time.monotonic() + seconds)
+    
+    def record_success(self):
+        if self.failures >= CIRCUIT_FAILURE_THRESHOLD:
+            logger.info(f"🔌 Circuit closed for {self.host}")
+        self.failures = 0
+        self.cooldown = CIRCUIT_COOLDOWN
+        self.probe_started = 0.0
+    
+    def record_failure(self):
+        self.failures += 1
+        if self.failures < CIRCUIT_FAILURE_THRESHOLD:
+            return
+        
+        if self.probe_started:
+            # The probe failed too: back off further
+            self.cooldown = min(self.cooldown * 2, CIRCUIT_MAX_COOLDOWN)
+        elif self.failures > CIRCUIT_FAILURE_THRESHOLD:
+            # Straggler from a request that started before the circuit opened
+            return
+        self.probe_started = 0.0
+        self.hold(self.cooldown)
+        logger.warning(
+            f"🔌 Circuit open for {self.host} after {self.failures} failures, "
+            f"pausing {self.cooldown:.0f}s"
+        )
+    
+    def record(self, error: BaseException):
+        """Update the breaker from an attempt's error"""
+        if isinstance(error, HttpStatusError) and error.status == 429:
+            # Rate limited: the host is alive but wants everyone to slow down
+            if error.retry_after:
+                self.hold(min(error.retry_after, CIRCUIT_MAX_COOLDOWN))
+        elif is_host_failure(error):
+            self.record_failure()
+        else:
+            # The host answered; the request itself was the problem
+            self.record_success()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def breaker_for(url: str) -> CircuitBreaker:
+    """The shared circuit breaker for a URL's host"""
+    host = urlparse(url).netloc.lower()
+    breaker = _breakers.get(host)
+    if breaker is None:
+        breaker = _breakers[host] = CircuitBreaker(host)
+    return breaker
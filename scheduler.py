@@ -0,0 +1,46 @@
+import os
+import asyncio
+import logging
+from typing import Dict, Tuple
+from urllib.parse import urlparse
+from config import SCHEDULE_POLICY, SIZE_PROBE_CONCURRENCY, DIRECT_VIDEO_EXTENSIONS
+from item_store import ItemSelection
+from downloader import fetch_content_length
+
+logger = logging.getLogger(__name__)
+
+
+def _has_plain_size(item: dict) -> bool:
+    """Whether a HEAD request tells the real download size of an item"""
+    if item['type'] != 'video':
+        return True
+    # Manifests and site pages only report their own (tiny) size
+    return os.path.splitext(urlparse(item['url']).path)[1].lower() in DIRECT_VIDEO_EXTENSIONS
+
+
+async def probe_sizes(selection: ItemSelection, session) -> Dict[int, int]:
+    """Content-Length of every item by serial (0 = unknown)"""
+    slots = asyncio.Semaphore(SIZE_PROBE_CONCURRENCY)
+    
+    async def probe(serial: int, item: dict) -> Tuple[int, int]:
+        if not _has_plain_size(item):
+            return serial, 0
+        async with slots:
+            return serial, await fetch_content_length(item['url'], session)
+    
+    return dict(await asyncio.gather(*[probe(serial, item) for serial, item in selection.numbered()]))
+
+
+async def schedule(selection: ItemSelection, session) -> Tuple[ItemSelection, Dict[int, int]]:
+    """Run order for a batch under SCHEDULE_POLICY, plus any sizes probed
+    on the way (so the small-file lane need not ask again)"""
+    if SCHEDULE_POLICY != 'sjf' or len(selection) < 2:
+        return selection, {}
+    
+    sizes = await probe_sizes(selection, session)
+    # Shortest job first; unknown sizes (streams, failed probes) keep list order at the end
+    order = sorted(selection.serials, key=lambda serial: (sizes[serial] == 0, sizes[serial], serial))
+    
+    known = sum(1 for size in sizes.values() if size)
+    logger.info(f"Scheduled {len(order)} items shortest-first ({known} with known size)")
+    return selection.reordered(order), sizes
@@ -0,0 +1,25 @@
+from formats import select_format
+
+
+def youtube_info():
+    """A typical YouTube format list: opus and m4a audio, avc1 video-only
+    1080p and progressive 720p/360p"""
+    return {
+        'duration': 600,
+        'formats': [
+            {'format_id': '251', 'ext': 'webm', 'vcodec': 'none', 'acodec': 'opus', 'abr': 150, 'tbr': 150},
+            {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 129, 'tbr': 129},
+            {'format_id': '137', 'ext': 'mp4', 'vcodec': 'avc1.640028', 'acodec': 'none', 'height': 1080, 'tbr': 4000},
+            {'format_id': '22', 'ext': 'mp4', 'vcodec': 'avc1.64001F', 'acodec': 'mp4a.40.2', 'height': 720, 'tbr': 1500},
+            {'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2', 'height': 360, 'tbr': 500},
+        ],
+    }
+
+
+def test_opus_in_cap_does_not_hide_copyable_pair():
+    assert select_format(youtube_info(), '1080') == '137+140'
+
+
+def test_lower_request_still_picks_progressive():
+    assert select_format(youtube_info(), '720') == '22'
+    assert select_format(youtube_info(), '480') == '18'
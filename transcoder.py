@@ -0,0 +1,198 @@
+import os
+import shutil
+import asyncio
+import logging
+from pathlib import Path
+from typing import List, Optional
+from config import (
+    MAX_VIDEO_SIZE_MB, MAX_VIDEO_BITRATE_KBPS,
+    TRANSCODE_WORKERS, TRANSCODE_SEGMENT_SECONDS, TRANSCODE_PRESET, TRANSCODE_AUDIO_KBPS
+)
+from jobs import CancelToken, run_process
+from progress import progress_bus
+
+logger = logging.getLogger(__name__)
+
+# Share of the size budget handed to the encoder; container overhead and
+# rate-control overshoot use up the rest
+SIZE_BUDGET_MARGIN = 0.92
+MIN_VIDEO_KBPS = 150
+
+# Encoder slots shared by every job in this process, so two transcodes
+# split the cores instead of each claiming all of them
+_encoder_slots: Optional[asyncio.Semaphore] = None
+
+
+def _slots() -> asyncio.Semaphore:
+    global _encoder_slots
+    if _encoder_slots is None:
+        _encoder_slots = asyncio.Semaphore(max(1, TRANSCODE_WORKERS))
+    return _encoder_slots
+
+
+def needs_transcode(filepath: str, duration: float) -> bool:
+    """Whether a downloaded video breaks the size or bitrate limit"""
+    size = os.path.getsize(filepath)
+    if MAX_VIDEO_SIZE_MB and size > MAX_VIDEO_SIZE_MB * 1024 * 1024:
+        return True
+    if MAX_VIDEO_BITRATE_KBPS and duration > 0:
+        return size * 8 / duration / 1000 > MAX_VIDEO_BITRATE_KBPS
+    return False
+
+
+def video_budget_kbps(duration: float) -> int:
+    """Video bitrate that keeps the output within both limits, 0 if unbounded"""
+    limits = []
+    if MAX_VIDEO_SIZE_MB and duration > 0:
+        total_kbps = MAX_VIDEO_SIZE_MB * 1024 * 1024 * 8 * SIZE_BUDGET_MARGIN / duration / 1000
+        limits.append(total_kbps - TRANSCODE_AUDIO_KBPS)
+    if MAX_VIDEO_BITRATE_KBPS:
+        limits.append(MAX_VIDEO_BITRATE_KBPS - TRANSCODE_AUDIO_KBPS)
+    
+    if not limits:
+        return 0
+    return max(int(min(limits)), MIN_VIDEO_KBPS)
+
+
+async def split_at_keyframes(filepath: str, workdir: Path) -> List[Path]:
+    """Cut the video stream into ~TRANSCODE_SEGMENT_SECONDS pieces with stream copy"""
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-i', filepath,
+        '-map', '0:v:0', '-an', '-c', 'copy',
+        '-f', 'segment',
+        '-segment_time', str(TRANSCODE_SEGMENT_SECONDS),
+        '-reset_timestamps', '1',
+        str(workdir / 'src_%05d.mkv'), '-y'
+    ]
+    returncode, _, stderr = await run_process(cmd, timeout=1800)
+    
+    if returncode != 0:
+        logger.error(f"Segment split failed: {stderr.decode(errors='ignore')[:200]}")
+        return []
+    # The workdir is private to this job, so listing it is cheap and safe
+    return sorted(workdir.glob('src_*.mkv'))
+
+
+async def encode_segment(src: Path, dst: Path, kbps: int, threads: int) -> bool:
+    """Re-encode one segment with x264 at the budget bitrate"""
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-i', str(src),
+        '-map', '0:v:0',
+        '-c:v', 'libx264', '-preset', TRANSCODE_PRESET,
+        '-b:v', f'{kbps}k', '-maxrate', f'{int(kbps * 1.5)}k', '-bufsize', f'{kbps * 2}k',
+        '-pix_fmt', 'yuv420p',
+        '-threads', str(threads),
+        str(dst), '-y'
+    ]
+    async with _slots():
+        returncode, _, stderr = await run_process(cmd, timeout=1800)
+    
+    if returncode != 0:
+        logger.error(f"Segment encode failed ({src.name}): {stderr.decode(errors='ignore')[:200]}")
+        return False
+    return True
+
+
+async def encode_audio(filepath: str, dst: Path) -> bool:
+    """Encode the whole audio track once so segment joins stay gapless"""
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-i', filepath,
+        '-map', '0:a:0', '-vn',
+        '-c:a', 'aac', '-b:a', f'{TRANSCODE_AUDIO_KBPS}k',
+        str(dst), '-y'
+    ]
+    returncode, _, _ = await run_process(cmd, timeout=1800)
+    return returncode == 0 and dst.exists()
+
+
+async def concat_segments(segments: List[Path], audio: Optional[Path], output: Path) -> bool:
+    """Join encoded segments (and the audio track) with stream copy"""
+    listing = segments[0].parent / 'segments.txt'
+    listing.write_text(''.join(f"file '{segment.name}'\n" for segment in segments))
+    
+    cmd = ['ffmpeg', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', str(listing)]
+    if audio is not None:
+        cmd += ['-i', str(audio), '-map', '0:v:0', '-map', '1:a:0']
+    cmd += ['-c', 'copy', '-movflags', '+faststart', str(output), '-y']
+    
+    returncode, _, stderr = await run_process(cmd, timeout=1800)
+    if returncode != 0:
+        logger.error(f"Segment concat failed: {stderr.decode(errors='ignore')[:200]}")
+        return False
+    return True
+
+
+async def transcode_to_budget(
+    filepath: str,
+    duration: float,
+    job_id: str,
+    token: CancelToken
+) -> Optional[str]:
+    """Re-encode a video to fit the size/bitrate limits, encoding keyframe
+    segments in parallel; returns the new .mp4 path or None"""
+    kbps = video_budget_kbps(duration)
+    if not kbps:
+        return None
+    
+    source = Path(filepath)
+    workdir = source.parent / 'transcode'
+    workdir.mkdir(exist_ok=True)
+    tasks = []
+    
+    try:
+        segments = await split_at_keyframes(filepath, workdir)
+        if not segments or token.cancelled:
+            return None
+        
+        total = sum(segment.stat().st_size for segment in segments)
+        threads = max(1, (os.cpu_count() or 1) // max(1, TRANSCODE_WORKERS))
+        done = 0
+        progress_bus.publish(job_id, 'transcode', 0, total)
+        logger.info(f"Transcoding {source.name}: {len(segments)} segments at {kbps}kbps")
+        
+        async def encode(src: Path) -> Path:
+            nonlocal done
+            dst = workdir / f"enc_{src.stem[4:]}.mp4"
+            if token.cancelled or not await encode_segment(src, dst, kbps, threads):
+                raise RuntimeError(f"segment {src.name} not encoded")
+            done += src.stat().st_size
+            progress_bus.publish(job_id, 'transcode', done, total)
+            return dst
+        
+        audio_path = workdir / 'audio.m4a'
+        tasks = [asyncio.create_task(encode(src)) for src in segments]
+        audio_task = asyncio.create_task(encode_audio(filepath, audio_path))
+        tasks.append(audio_task)
+        
+        # First failure (or cancellation) stops every other encoder
+        encoded = await asyncio.gather(*tasks[:-1])
+        has_audio = await audio_task
+        if not has_audio:
+            logger.warning(f"No audio track encoded for {source.name}")
+        
+        output = workdir / 'output.mp4'
+        if not await concat_segments(encoded, audio_path if has_audio else None, output):
+            return None
+        
+        if MAX_VIDEO_SIZE_MB and output.stat().st_size > MAX_VIDEO_SIZE_MB * 1024 * 1024:
+            logger.error(f"Transcoded {source.name} still exceeds {MAX_VIDEO_SIZE_MB}MB")
+            return None
+        
+        final_path = source.with_suffix('.mp4')
+        os.replace(output, final_path)
+        if final_path != source:
+            os.remove(source)
+        return str(final_path)
+        
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Transcode error: {e}")
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -1,49 +1,46 @@
 import os
-import asyncio
 import logging
-from typing import Optional
+from typing import List, Optional, Tuple, Union
 from pyrogram import Client
-from pyrogram.types import Message
-from utils import format_size, format_time, create_progress_bar
+from pyrogram.types import InputMediaPhoto, InputMediaDocument
 from config import UPLOAD_CHUNK_SIZE
+from progress import progress_bus
+from bandwidth import upload_governor
+from fanout import deliver_copies
+from memory_files import MemoryFile
 
 logger = logging.getLogger(__name__)
 
+# Photos and documents may come straight from memory (see memory_files)
+UploadSource = Union[str, MemoryFile]
+
+
+def source_name(source: UploadSource) -> str:
+    return source.name if isinstance(source, MemoryFile) else os.path.basename(source)
+
+
+def source_size(source: UploadSource) -> int:
+    return source.size if isinstance(source, MemoryFile) else os.path.getsize(source)
+
 
 class UploadProgressTracker:
-    """Track upload progress with enhanced display"""
+    """Publish upload progress for a job to the progress bus"""
     
-    def __init__(self, progress_msg: Message, filename: str):
-        self.progress_msg = progress_msg
+    def __init__(self, job_id: str, filename: str):
+        self.job_id = job_id
         self.filename = filename
-        self.last_update = 0
-        self.start_time = asyncio.get_event_loop().time()
-        self.last_percent = -1
+        self.sent = 0
     
     async def progress_callback(self, current: int, total: int):
-        """Callback for upload progress"""
+        """Callback for upload progress; pyrogram awaits it after every part,
+        which is where the upload budget is enforced"""
         try:
-            percent = (current / total) * 100 if total > 0 else 0
-            
-            # Update every 4% for speed
-            if int(percent) - self.last_percent >= 4:
-                self.last_percent = int(percent)
-                
-                elapsed = asyncio.get_event_loop().time() - self.start_time
-                speed = current / elapsed if elapsed > 0 else 0
-                eta = int((total - current) / speed) if speed > 0 else 0
-                
-                bar = create_progress_bar(percent)
-                
-                await self.progress_msg.edit_text(
-                    f"📤 **Uploading...**\n\n"
-                    f"{bar}\n\n"
-                    f"📦 {format_size(current)} / {format_size(total)}\n"
-                    f"⚡ {format_size(int(speed))}/s\n"
-                    f"⏱️ ETA: {format_time(eta)}"
-                )
+            progress_bus.publish(self.job_id, 'upload', current, total)
         except Exception as e:
             logger.debug(f"Upload progress error: {e}")
+        
+        await upload_governor.throttle(self.job_id, current - self.sent)
+        self.sent = current
 
 
 async def upload_video(
@@ -51,7 +48,7 @@ async def upload_video(
     chat_id: int,
     video_path: str,
     caption: str,
-    progress_msg: Message,
+    job_id: str,
     thumb_path: Optional[str] = None,
     duration: int = 0,
     width: int = 1280,
@@ -59,19 +56,21 @@ async def upload_video(
 ) -> bool:
     """Upload video with progress tracking"""
     try:
-        tracker = UploadProgressTracker(progress_msg, os.path.basename(video_path))
+        tracker = UploadProgressTracker(job_id, os.path.basename(video_path))
         
-        await client.send_video(
-            chat_id=chat_id,
-            video=video_path,
-            caption=caption,
-            supports_streaming=True,
-            duration=duration,
-            width=width,
-            height=height,
-            thumb=thumb_path,
-            progress=tracker.progress_callback
-        )
+        with upload_governor.lease(job_id):
+            sent = await client.send_video(
+                chat_id=chat_id,
+                video=video_path,
+                caption=caption,
+                supports_streaming=True,
+                duration=duration,
+                width=width,
+                height=height,
+                thumb=thumb_path,
+                progress=tracker.progress_callback
+            )
+        deliver_copies(sent)
         
         logger.info(f"Video uploaded: {video_path}")
         return True
@@ -84,22 +83,24 @@ async def upload_video(
 async def upload_photo(
     client: Client,
     chat_id: int,
-    photo_path: str,
+    photo_path: UploadSource,
     caption: str,
-    progress_msg: Message
+    job_id: str
 ) -> bool:
     """Upload photo with progress tracking"""
     try:
-        tracker = UploadProgressTracker(progress_msg, os.path.basename(photo_path))
+        tracker = UploadProgressTracker(job_id, source_name(photo_path))
         
-        await client.send_photo(
-            chat_id=chat_id,
-            photo=photo_path,
-            caption=caption,
-            progress=tracker.progress_callback
-        )
+        with upload_governor.lease(job_id):
+            sent = await client.send_photo(
+                chat_id=chat_id,
+                photo=photo_path,
+                caption=caption,
+                progress=tracker.progress_callback
+            )
+        deliver_copies(sent)
         
-        logger.info(f"Photo uploaded: {photo_path}")
+        logger.info(f"Photo uploaded: {source_name(photo_path)}")
         return True
         
     except Exception as e:
@@ -110,24 +111,54 @@ async def upload_photo(
 async def upload_document(
     client: Client,
     chat_id: int,
-    document_path: str,
+    document_path: UploadSource,
     caption: str,
-    progress_msg: Message
+    job_id: str
 ) -> bool:
     """Upload document with progress tracking"""
     try:
-        tracker = UploadProgressTracker(progress_msg, os.path.basename(document_path))
+        tracker = UploadProgressTracker(job_id, source_name(document_path))
         
-        await client.send_document(
-            chat_id=chat_id,
-            document=document_path,
-            caption=caption,
-            progress=tracker.progress_callback
-        )
+        with upload_governor.lease(job_id):
+            sent = await client.send_document(
+                chat_id=chat_id,
+                document=document_path,
+                caption=caption,
+                progress=tracker.progress_callback
+            )
+        deliver_copies(sent)
         
-        logger.info(f"Document uploaded: {document_path}")
+        logger.info(f"Document uploaded: {source_name(document_path)}")
         return True
         
     except Exception as e:
         logger.error(f"Document upload error: {e}")
         return False
+
+
+async def upload_media_group(
+    client: Client,
+    chat_id: int,
+    files: List[Tuple[UploadSource, str]],
+    kind: str,
+    job_id: str
+) -> bool:
+    """Send up to ALBUM_SIZE photos or documents as one album of (path, caption)"""
+    try:
+        media_type = InputMediaPhoto if kind == 'image' else InputMediaDocument
+        
+        with upload_governor.lease(job_id):
+            # send_media_group has no progress callback: charge the album up front
+            await upload_governor.throttle(job_id, sum(source_size(path) for path, _ in files))
+            sent = await client.send_media_group(
+                chat_id=chat_id,
+                media=[media_type(path, caption=caption) for path, caption in files]
+            )
+        deliver_copies(sent)
+        
+        logger.info(f"Album uploaded: {len(files)} {kind} item(s)")
+        return True
+        
+    except Exception as e:
+        logger.error(f"Album upload error: {e}")
+        return False
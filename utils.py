@@ -1,7 +1,8 @@
 import re
 import os
 import logging
-from typing import List, Dict
+from array import array
+from typing import List, Dict, Sequence
 from config import SUPPORTED_TYPES
 
 logger = logging.getLogger(__name__)
@@ -19,26 +20,8 @@ def get_file_type(url: str) -> str:
 
 def parse_content(text: str) -> List[Dict]:
     """Parse content and identify all supported file types"""
-    lines = text.strip().split('\n')
-    items = []
-    
-    for line in lines:
-        if ':' in line and ('http://' in line or 'https://' in line):
-            parts = line.split(':', 1)
-            if len(parts) == 2:
-                title = parts[0].strip()
-                url = parts[1].strip()
-                
-                file_type = get_file_type(url)
-                
-                if file_type != 'unknown':
-                    items.append({
-                        'title': title, 
-                        'url': url, 
-                        'type': file_type
-                    })
-    
-    return items
+    from item_store import ItemStore
+    return list(ItemStore.from_text(text))
 
 
 def format_size(bytes_size: int) -> str:
@@ -75,3 +58,62 @@ def create_progress_bar(percent: float, length: int = 20) -> str:
     filled = int(length * percent / 100)
     bar = "█" * filled + "░" * (length - filled)
     return f"[{bar}] {percent:.1f}%"
+
+
+def parse_selection(text: str, total: int) -> Sequence[int]:
+    """Serials chosen by a selection such as `1-5,9,12-20,!7`.
+    
+    Parts are separated by commas or spaces: `a-b` is a range (`a-` runs to
+    the last item), `n` a single item and `!part` an exclusion; exclusions
+    alone mean everything else. Raises ValueError for bad or out-of-range parts.
+    """
+    include, exclude = [], []
+    for part in re.split(r'[,\s]+', text.strip()):
+        if not part:
+            continue
+        target = include
+        if part.startswith('!'):
+            target = exclude
+            part = part[1:]
+        
+        first, dash, last = part.partition('-')
+        if not first.isdigit() or not (last.isdigit() or last == ''):
+            raise ValueError(f"cannot read `{part}`")
+        first = int(first)
+        last = (int(last) if last else total) if dash else first
+        if first < 1 or last > total or first > last:
+            raise ValueError(f"`{part}` is not a valid range within 1-{total}")
+        target.append((first, last))
+    
+    if not include and not exclude:
+        raise ValueError("empty selection")
+    if not include:
+        include = [(1, total)]
+    if len(include) == 1 and not exclude:
+        return range(include[0][0], include[0][1] + 1)
+    
+    chosen = bytearray(total + 1)
+    for first, last in include:
+        chosen[first:last + 1] = b'\x01' * (last - first + 1)
+    for first, last in exclude:
+        chosen[first:last + 1] = bytes(last - first + 1)
+    
+    serials = array('I', (serial for serial in range(1, total + 1) if chosen[serial]))
+    if not serials:
+        raise ValueError("selection excludes every item")
+    return serials
+
+
+def format_selection(serials: Sequence[int], max_parts: int = 6) -> str:
+    """Compact text for a set of serials, e.g. `1-5, 9, 12-20`"""
+    runs = []
+    for serial in sorted(serials):
+        if runs and serial == runs[-1][1] + 1:
+            runs[-1][1] = serial
+        else:
+            runs.append([serial, serial])
+    
+    parts = [f"{a}-{b}" if a != b else str(a) for a, b in runs[:max_parts]]
+    if len(runs) > max_parts:
+        parts.append("…")
+    return ", ".join(parts)
@@ -1,15 +1,17 @@
 import os
 import json
-import subprocess
+import struct
+import asyncio
 import logging
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 from config import THUMBNAIL_TIME, THUMBNAIL_SIZE, THUMBNAIL_QUALITY
+from jobs import CancelToken, run_process
 
 logger = logging.getLogger(__name__)
 
 
-def get_video_info(filepath: str) -> Dict:
+async def get_video_info(filepath: str) -> Dict:
     """Get video duration and dimensions with better error handling"""
     try:
         cmd = [
@@ -18,13 +20,13 @@ def get_video_info(filepath: str) -> Dict:
             '-show_format', '-show_streams',
             filepath
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=20)
+        returncode, stdout, stderr = await run_process(cmd, timeout=20)
         
-        if result.returncode != 0:
-            logger.error(f"FFprobe failed: {result.stderr}")
+        if returncode != 0:
+            logger.error(f"FFprobe failed: {stderr.decode(errors='ignore')}")
             return {'duration': 0, 'width': 1280, 'height': 720}
         
-        data = json.loads(result.stdout)
+        data = json.loads(stdout)
         
         # Get duration
         duration = int(float(data.get('format', {}).get('duration', 0)))
@@ -44,7 +46,7 @@ def get_video_info(filepath: str) -> Dict:
         logger.info(f"Video info: {width}x{height}, {duration}s")
         return {'duration': duration, 'width': width, 'height': height}
         
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
         logger.error("FFprobe timeout")
         return {'duration': 0, 'width': 1280, 'height': 720}
     except json.JSONDecodeError as e:
@@ -55,7 +57,7 @@ def get_video_info(filepath: str) -> Dict:
         return {'duration': 0, 'width': 1280, 'height': 720}
 
 
-def generate_thumbnail(video_path: str, thumb_path: str, video_duration: int = 0) -> bool:
+async def generate_thumbnail(video_path: str, thumb_path: str, video_duration: int = 0) -> bool:
     """Generate high-quality thumbnail from video with multiple fallback attempts"""
     try:
         # Determine best time for thumbnail
@@ -78,7 +80,7 @@ def generate_thumbnail(video_path: str, thumb_path: str, video_duration: int = 0
         ]
         
         logger.info(f"Generating thumbnail at {thumb_time_str}")
-        result = subprocess.run(cmd, capture_output=True, timeout=45)
+        await run_process(cmd, timeout=45)
         
         # Check if thumbnail was created successfully
         if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 2048:
@@ -88,7 +90,7 @@ def generate_thumbnail(video_path: str, thumb_path: str, video_duration: int = 0
         # Fallback 1: Try at 0 seconds
         logger.warning("Primary thumbnail failed, trying at 0s")
         cmd[1] = '00:00:00'
-        result = subprocess.run(cmd, capture_output=True, timeout=45)
+        await run_process(cmd, timeout=45)
         
         if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 2048:
             logger.info("Thumbnail generated at 0s")
@@ -100,7 +102,7 @@ def generate_thumbnail(video_path: str, thumb_path: str, video_duration: int = 0
             mid_str = f"00:00:{mid_time:02d}"
             logger.warning(f"Trying thumbnail at middle: {mid_str}")
             cmd[1] = mid_str
-            result = subprocess.run(cmd, capture_output=True, timeout=45)
+            await run_process(cmd, timeout=45)
             
             if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 2048:
                 logger.info("Thumbnail generated at middle")
@@ -116,7 +118,7 @@ def generate_thumbnail(video_path: str, thumb_path: str, video_duration: int = 0
             thumb_path,
             '-y'
         ]
-        result = subprocess.run(simple_cmd, capture_output=True, timeout=45)
+        await run_process(simple_cmd, timeout=45)
         
         if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 2048:
             logger.info("Thumbnail generated with simple method")
@@ -125,7 +127,7 @@ def generate_thumbnail(video_path: str, thumb_path: str, video_duration: int = 0
         logger.error("All thumbnail generation attempts failed")
         return False
         
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
         logger.error("Thumbnail generation timeout")
         return False
     except Exception as e:
@@ -133,7 +135,7 @@ def generate_thumbnail(video_path: str, thumb_path: str, video_duration: int = 0
         return False
 
 
-def validate_video_file(filepath: str) -> bool:
+async def validate_video_file(filepath: str) -> bool:
     """Validate if video file is playable"""
     try:
         if not os.path.exists(filepath):
@@ -144,10 +146,192 @@ def validate_video_file(filepath: str) -> bool:
         
         # Quick validation with ffprobe
         cmd = ['ffprobe', '-v', 'error', filepath]
-        result = subprocess.run(cmd, capture_output=True, timeout=10)
+        returncode, _, _ = await run_process(cmd, timeout=10)
         
-        return result.returncode == 0
+        return returncode == 0
         
     except Exception as e:
         logger.error(f"Video validation error: {e}")
         return False
+
+
+# Boxes on the path from moov down to the chunk offset tables
+MP4_CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+FASTSTART_COPY_CHUNK = 8 * 1024 * 1024
+
+
+def read_top_level_boxes(filepath: str) -> List[Tuple[str, int, int]]:
+    """List (type, offset, size) of top-level MP4 boxes, reading only headers"""
+    boxes = []
+    with open(filepath, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        offset = 0
+        
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            size, box_type = struct.unpack('>I4s', f.read(8))
+            header_size = 8
+            
+            if size == 1:
+                size = struct.unpack('>Q', f.read(8))[0]
+                header_size = 16
+            elif size == 0:
+                size = file_size - offset
+            
+            if size < header_size:
+                break
+            
+            boxes.append((box_type.decode('latin-1'), offset, size))
+            offset += size
+    
+    return boxes
+
+
+def needs_faststart(filepath: str) -> bool:
+    """True when the moov atom sits after the first mdat"""
+    boxes = read_top_level_boxes(filepath)
+    moov = next((b for b in boxes if b[0] == 'moov'), None)
+    mdat = next((b for b in boxes if b[0] == 'mdat'), None)
+    
+    if not moov or not mdat:
+        return False
+    return moov[1] > mdat[1]
+
+
+def _patch_chunk_offsets(data: bytearray, start: int, end: int, shift) -> bool:
+    """Rewrite stco/co64 entries inside moov; False if an offset overflows stco"""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return False
+        
+        if box_type in MP4_CONTAINER_BOXES:
+            if not _patch_chunk_offsets(data, offset + header_size, offset + size, shift):
+                return False
+            
+        elif box_type in (b'stco', b'co64'):
+            entry_size = 4 if box_type == b'stco' else 8
+            fmt = '>I' if box_type == b'stco' else '>Q'
+            count = struct.unpack_from('>I', data, offset + header_size + 4)[0]
+            pos = offset + header_size + 8
+            
+            for _ in range(count):
+                value = shift(struct.unpack_from(fmt, data, pos)[0])
+                if box_type == b'stco' and value > 0xFFFFFFFF:
+                    return False
+                struct.pack_into(fmt, data, pos, value)
+                pos += entry_size
+        
+        offset += size
+    return True
+
+
+def _copy_range(src, dst, offset: int, count: int, token: Optional[CancelToken]):
+    """Copy a byte range between files, zero-copy where the kernel allows it"""
+    src_fd, dst_fd = src.fileno(), dst.fileno()
+    end = offset + count
+    
+    while offset < end:
+        if token and token.cancelled:
+            raise asyncio.CancelledError()
+        
+        length = min(FASTSTART_COPY_CHUNK, end - offset)
+        try:
+            sent = os.sendfile(dst_fd, src_fd, offset, length)
+        except OSError:
+            src.seek(offset)
+            sent = dst.write(src.read(length))
+        
+        if sent <= 0:
+            raise IOError("Short copy while relocating moov")
+        offset += sent
+
+
+def relocate_moov(filepath: str, token: Optional[CancelToken] = None) -> bool:
+    """Move moov in front of the first mdat with a streaming copy"""
+    boxes = read_top_level_boxes(filepath)
+    moov = next((b for b in boxes if b[0] == 'moov'), None)
+    mdat = next((b for b in boxes if b[0] == 'mdat'), None)
+    
+    if not moov or not mdat or moov[1] < mdat[1]:
+        return True
+    
+    _, moov_offset, moov_size = moov
+    tmp_path = filepath + '.faststart'
+    
+    with open(filepath, 'rb') as src:
+        src.seek(moov_offset)
+        moov_data = bytearray(src.read(moov_size))
+        
+        # Everything between the first mdat and the old moov moves forward
+        def shift(value: int) -> int:
+            if mdat[1] <= value < moov_offset:
+                return value + moov_size
+            return value
+        
+        if not _patch_chunk_offsets(moov_data, 8, moov_size, shift):
+            return False
+        
+        try:
+            with open(tmp_path, 'wb', buffering=0) as dst:
+                for box_type, offset, size in boxes:
+                    if box_type == 'moov':
+                        continue
+                    if offset == mdat[1]:
+                        dst.write(moov_data)
+                    _copy_range(src, dst, offset, size, token)
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    
+    return True
+
+
+async def ensure_faststart(filepath: str, token: Optional[CancelToken] = None) -> bool:
+    """Make an MP4 streamable, rewriting it only when moov is at the end"""
+    try:
+        if not await asyncio.to_thread(needs_faststart, filepath):
+            return True
+        
+        logger.info(f"Relocating moov atom: {filepath}")
+        if await asyncio.to_thread(relocate_moov, filepath, token):
+            return True
+        
+        # 64-bit offsets needed or unusual layout: let ffmpeg remux it
+        logger.warning("Native moov relocation not possible, using ffmpeg")
+        tmp_path = filepath + '.faststart.mp4'
+        cmd = [
+            'ffmpeg', '-i', filepath,
+            '-map', '0', '-c', 'copy',
+            '-movflags', '+faststart',
+            tmp_path, '-y'
+        ]
+        try:
+            returncode, _, _ = await run_process(cmd, timeout=1800)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        
+        if returncode == 0 and os.path.exists(tmp_path):
+            os.replace(tmp_path, filepath)
+            return True
+        
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+        
+    except (asyncio.CancelledError, asyncio.TimeoutError):
+        raise
+    except Exception as e:
+        logger.error(f"Faststart error: {e}")
+        return False
@@ -0,0 +1,202 @@
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+from config import QUEUE_DB, CLAIM_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    quality TEXT NOT NULL,
+    start_idx INTEGER NOT NULL,
+    end_idx INTEGER NOT NULL,
+    cancelled INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch_id TEXT NOT NULL REFERENCES batches(id),
+    idx INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    progress TEXT,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS items_status ON items(status, id);
+CREATE INDEX IF NOT EXISTS items_batch ON items(batch_id, status);
+"""
+
+
+class WorkQueue:
+    """Durable SQLite work queue shared by the coordinator and worker processes"""
+    
+    def __init__(self, path: str = QUEUE_DB):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+    
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread; WAL lets readers run beside a writer"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def enqueue_batch(
+        self,
+        user_id: int,
+        chat_id: int,
+        message_id: int,
+        quality: str,
+        items: List[Tuple[int, Dict]]
+    ) -> str:
+        """Store a batch and its (serial, item) pairs in run order; returns the batch id"""
+        batch_id = uuid.uuid4().hex
+        serials = [idx for idx, _ in items]
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO batches (id, user_id, chat_id, message_id, quality, start_idx, end_idx, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (batch_id, user_id, chat_id, message_id, quality, min(serials), max(serials), time.time())
+            )
+            conn.executemany(
+                "INSERT INTO items (batch_id, idx, payload) VALUES (?, ?, ?)",
+                [(batch_id, idx, json.dumps(item)) for idx, item in items]
+            )
+        return batch_id
+    
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        """Atomically take the oldest queued item of a live batch"""
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT items.id, items.batch_id, items.idx, items.payload, "
+                "batches.user_id, batches.chat_id, batches.message_id, "
+                "batches.quality, batches.end_idx "
+                "FROM items JOIN batches ON batches.id = items.batch_id "
+                "WHERE items.status = 'queued' AND batches.cancelled = 0 "
+                "ORDER BY items.id LIMIT 1"
+            ).fetchone()
+            
+            if row is None:
+                return None
+            
+            conn.execute(
+                "UPDATE items SET status = 'claimed', worker = ?, heartbeat = ? WHERE id = ?",
+                (worker_id, time.time(), row['id'])
+            )
+        
+        claimed = dict(row)
+        claimed['item'] = json.loads(claimed.pop('payload'))
+        return claimed
+    
+    def heartbeat(self, item_id: int, progress: Optional[str] = None):
+        """Refresh a claimed item's lease and record its latest progress"""
+        self._connect().execute(
+            "UPDATE items SET heartbeat = ?, progress = COALESCE(?, progress) WHERE id = ?",
+            (time.time(), progress, item_id)
+        )
+    
+    def complete(self, item_id: int, success: bool):
+        """Mark an item done or failed"""
+        self._connect().execute(
+            "UPDATE items SET status = ?, heartbeat = ? WHERE id = ?",
+            ('done' if success else 'failed', time.time(), item_id)
+        )
+    
+    def release(self, item_id: int):
+        """Give a claimed item back to the queue without waiting for its lease to expire"""
+        self._connect().execute(
+            "UPDATE items SET status = 'queued', worker = NULL WHERE id = ? AND status = 'claimed'",
+            (item_id,)
+        )
+    
+    def requeue_stale(self, timeout: float = CLAIM_TIMEOUT) -> int:
+        """Return items of crashed workers (expired lease) to the queue"""
+        cursor = self._connect().execute(
+            "UPDATE items SET status = 'queued', worker = NULL "
+            "WHERE status = 'claimed' AND heartbeat < ?",
+            (time.time() - timeout,)
+        )
+        if cursor.rowcount:
+            logger.warning(f"Requeued {cursor.rowcount} stale item(s)")
+        return cursor.rowcount
+    
+    def cancel_user(self, user_id: int) -> int:
+        """Flag every unfinished batch of a user as cancelled"""
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute(
+                "UPDATE batches SET cancelled = 1 WHERE user_id = ? AND cancelled = 0",
+                (user_id,)
+            )
+            conn.execute(
+                "UPDATE items SET status = 'cancelled' WHERE status = 'queued' "
+                "AND batch_id IN (SELECT id FROM batches WHERE user_id = ?)",
+                (user_id,)
+            )
+        return cursor.rowcount
+    
+    def is_cancelled(self, batch_id: str) -> bool:
+        """Whether a batch was stopped; a purged batch counts as stopped too,
+        since the coordinator drops it as soon as its task is cancelled"""
+        row = self._connect().execute(
+            "SELECT cancelled FROM batches WHERE id = ?", (batch_id,)
+        ).fetchone()
+        return row is None or bool(row['cancelled'])
+    
+    def batch_status(self, batch_id: str) -> Dict:
+        """Item counts per status plus progress of items being worked on"""
+        conn = self._connect()
+        counts = {
+            row['status']: row['n']
+            for row in conn.execute(
+                "SELECT status, COUNT(*) AS n FROM items WHERE batch_id = ? GROUP BY status",
+                (batch_id,)
+            )
+        }
+        active = [
+            dict(row) for row in conn.execute(
+                "SELECT idx, worker, progress FROM items "
+                "WHERE batch_id = ? AND status = 'claimed' ORDER BY idx",
+                (batch_id,)
+            )
+        ]
+        return {'counts': counts, 'active': active}
+    
+    def purge_batch(self, batch_id: str):
+        """Drop a finished batch and its items"""
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM items WHERE batch_id = ?", (batch_id,))
+            conn.execute("DELETE FROM batches WHERE id = ?", (batch_id,))
+
+
+_queue: Optional[WorkQueue] = None
+
+
+def get_work_queue() -> WorkQueue:
+    """Process-wide queue instance, opened on first use"""
+    global _queue
+    if _queue is None:
+        _queue = WorkQueue()
+    return _queue
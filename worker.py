@@ -0,0 +1,123 @@
+import os
+import sys
+import socket
+import asyncio
+import logging
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+from config import API_ID, API_HASH, BOT_TOKEN, QUEUE_POLL_INTERVAL
+from work_queue import get_work_queue
+from handlers import process_item
+from progress import progress_bus, make_job_id
+from jobs import CancelToken, scratch_janitor
+from loop_monitor import start_loop_monitor
+from log_pipeline import setup_logging
+
+# Configure logging (console only; the coordinator owns the log file)
+setup_logging()
+logger = logging.getLogger(__name__)
+
+WORKER_ID = sys.argv[1] if len(sys.argv) > 1 else f"{socket.gethostname()}-{os.getpid()}"
+
+# Each worker has its own Telegram session for uploads
+app = Client(
+    f"m3u8_worker_{WORKER_ID}",
+    api_id=API_ID,
+    api_hash=API_HASH,
+    bot_token=BOT_TOKEN,
+    workers=4,
+    sleep_threshold=60,
+    no_updates=True
+)
+
+
+def describe_progress(job_id: str) -> str:
+    """Short progress text reported back to the coordinator"""
+    sample = progress_bus.get(job_id)
+    if not sample:
+        return ""
+    return f"{sample['stage']} {sample['percent']:.0f}%"
+
+
+async def run_claimed(claimed: dict):
+    """Process one claimed item, heartbeating and honouring batch cancellation"""
+    queue = get_work_queue()
+    token = CancelToken()
+    job_id = make_job_id(claimed['user_id'], claimed['idx'])
+    
+    try:
+        message = await app.get_messages(claimed['chat_id'], claimed['message_id'])
+    except FloodWait as e:
+        # Transient: hand the item back now, then sit out the limit before claiming more
+        logger.warning(f"Fetching batch message flood-limited for {e.value}s, requeueing item {claimed['idx']}")
+        await asyncio.to_thread(queue.release, claimed['id'])
+        await asyncio.sleep(e.value)
+        return
+    except (OSError, asyncio.TimeoutError) as e:
+        logger.warning(f"Fetching batch message failed ({e}), requeueing item {claimed['idx']}")
+        await asyncio.to_thread(queue.release, claimed['id'])
+        return
+    except Exception as e:
+        logger.error(f"Batch message for item {claimed['idx']} unavailable: {e}")
+        await asyncio.to_thread(queue.complete, claimed['id'], False)
+        return
+    
+    if message is None or message.empty:
+        # The user deleted the message the batch replies to
+        logger.error(f"Batch message for item {claimed['idx']} was deleted")
+        await asyncio.to_thread(queue.complete, claimed['id'], False)
+        return
+    
+    task = asyncio.create_task(process_item(
+        app, message, claimed['item'], claimed['quality'],
+        claimed['idx'], claimed['end_idx'], claimed['user_id'], token, job_id
+    ))
+    
+    while not task.done():
+        await asyncio.wait({task}, timeout=QUEUE_POLL_INTERVAL)
+        if task.done():
+            break
+        
+        await asyncio.to_thread(queue.heartbeat, claimed['id'], describe_progress(job_id))
+        if await asyncio.to_thread(queue.is_cancelled, claimed['batch_id']):
+            token.cancel()
+            task.cancel()
+    
+    try:
+        success = task.result()
+    except asyncio.CancelledError:
+        success = False
+    except Exception as e:
+        logger.error(f"Item {claimed['idx']} error: {e}")
+        success = False
+    
+    await asyncio.to_thread(queue.complete, claimed['id'], success)
+
+
+async def main():
+    """Claim and process queued items until stopped"""
+    queue = get_work_queue()
+    await app.start()
+    asyncio.get_running_loop().create_task(scratch_janitor())
+    start_loop_monitor()
+    logger.info(f"🛠️ Worker {WORKER_ID} started")
+    
+    try:
+        while True:
+            claimed = await asyncio.to_thread(queue.claim, WORKER_ID)
+            if claimed is None:
+                await asyncio.to_thread(queue.requeue_stale)
+                await asyncio.sleep(QUEUE_POLL_INTERVAL)
+                continue
+            
+            logger.info(f"Worker {WORKER_ID} claimed item {claimed['idx']} of batch {claimed['batch_id']}")
+            await run_claimed(claimed)
+    finally:
+        await app.stop()
+
+
+if __name__ == "__main__":
+    try:
+        app.run(main())
+    except KeyboardInterrupt:
+        logger.info("Worker stopped by user")